@@ -0,0 +1,19 @@
+"""
+Load and latency benchmarks for the core API endpoints.
+
+Run from the directory holding manage.py:
+
+    python -m benchmarks run --target client --users 20 --duration 15 --out before.json
+    python -m benchmarks run --target http://localhost:8000 --users 50 --out after.json
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks orderbook --orders 100000          # matching engine only
+    python -m benchmarks orderbook --orders 20000 --settle  # with DB settlement
+    python -m benchmarks servers --connections 10,50,200    # gthread vs ASGI gunicorn
+    python -m benchmarks serializers --rows 10000           # DRF vs .values() serializers
+
+``--target client`` drives the app in-process through Django's test client
+against a freshly seeded test database. An ``http://`` target drives a running
+server, which must already be seeded with ``manage.py seed_league --prefix bench``.
+``servers`` seeds a test database itself and starts gunicorn on it, once per
+profile (needs gunicorn and uvicorn-worker; psutil for the memory figures).
+"""
@@ -0,0 +1,217 @@
+import argparse
+import os
+import sys
+from contextlib import contextmanager
+
+from . import report
+from .scenarios import DEFAULT_MIX
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run(args):
+    from .targets import ClientTarget, HTTPTarget
+
+    usernames = [f"{args.prefix}{i:07d}" for i in range(args.users)]
+    if args.target != 'client':
+        return _run_and_save(args, HTTPTarget(args.target), usernames)
+
+    with seeded_test_database(args, users=max(args.league, args.users), listed=args.listed):
+        return _run_and_save(args, ClientTarget(), usernames)
+
+
+@contextmanager
+def seeded_test_database(args, users, listed, **seed_options):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fantasy_project.settings')
+    import django
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    import logging
+    logging.getLogger('django.request').setLevel(logging.ERROR)  # 4xx from contended buys are expected
+    logging.getLogger('fantasy.db').setLevel(logging.WARNING)  # per-request lines would swamp the report
+    logging.getLogger('fantasy.matching').setLevel(logging.WARNING)
+
+    # never benchmark against the development database: seed a throwaway test one
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=args.keepdb)
+    try:
+        if not User.objects.filter(username__startswith=args.prefix).exists():
+            call_command('seed_league', users=users, seed=args.seed, prefix=args.prefix, listed=listed, verbosity=0,
+                         **seed_options)
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+        teardown_test_environment()
+
+
+def _run_and_save(args, target, usernames):
+    from .runner import run_load
+
+    result = run_load(target, usernames, password=args.password, duration=args.duration, mix=args.mix,
+                      seed=args.seed, pool=args.pool, hot=args.hot, hot_share=args.hot_share)
+    print(report.format_report(result))
+    if args.out:
+        report.save(result, args.out)
+        print(f"saved {args.out}")
+    return 0
+
+
+def orderbook(args):
+    from . import orderbook as bench
+
+    if args.settle:
+        with seeded_test_database(args, users=args.league, listed=0):
+            result = bench.run_settled(args.orders, seed=args.seed, batch_size=args.batch_size)
+    else:
+        result = bench.run_engine(args.orders, players=args.players, teams=args.teams, seed=args.seed)
+    print(bench.format_result(result))
+    if args.out:
+        report.save(result, args.out)
+        print(f"saved {args.out}")
+    return 0
+
+
+def servers(args):
+    from . import servers as bench
+
+    connections = [int(n) for n in args.connections.split(',')]
+    profiles = [p.strip() for p in args.profiles.split(',')]
+    with seeded_test_database(args, users=max(args.league, max(connections)), listed=args.listed):
+        from django.db import connection
+        usernames = [f"{args.prefix}{i:07d}" for i in range(max(connections))]
+        # the servers are separate processes: point them at the seeded test database
+        result = bench.run_servers(usernames, profiles=profiles, connections=connections, duration=args.duration,
+                                   workers=args.workers, port=args.port, seed=args.seed,
+                                   env={'DB_NAME': connection.settings_dict['NAME']},
+                                   tokens=bench.mint_tokens(usernames))
+    print(bench.format_result(result))
+    if args.out:
+        report.save(result, args.out)
+        print(f"saved {args.out}")
+    return 0
+
+
+def serializers(args):
+    from . import serializers as bench
+
+    teams = max(args.rows // bench.PLAYERS_PER_TEAM, 1)
+    # enough history for `rows` transactions
+    with seeded_test_database(args, users=teams, listed=0.05, history=-(-args.rows // teams)):
+        result = bench.run_serializers(args.rows, repeat=args.repeat)
+    print(bench.format_result(result))
+    if args.out:
+        report.save(result, args.out)
+        print(f"saved {args.out}")
+    return 0
+
+
+def revaluation(args):
+    from . import revaluation as bench
+
+    # 20 players a team; the history lands over the last 30 days, the job's window
+    with seeded_test_database(args, users=-(-args.players // 20), listed=0.05, history_days=30):
+        result = bench.run_revaluation(chunk_size=args.chunk_size)
+    print(bench.format_result(result))
+    if args.out:
+        report.save(result, args.out)
+        print(f"saved {args.out}")
+    return 0
+
+
+def compare(args):
+    print(report.compare(report.load(args.base), report.load(args.new)))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description="Load and latency benchmarks for the core API endpoints.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help="drive the endpoints and report latency / throughput")
+    p.add_argument('--target', default='client', help="'client' (in-process) or a base URL like http://localhost:8000")
+    p.add_argument('--users', type=int, default=20, help="concurrent simulated users (default: 20)")
+    p.add_argument('--duration', type=float, default=15.0, help="seconds of load after login (default: 15)")
+    p.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                   help="scenario weights, e.g. market=40,buy=10,transactions=20,teams_me=25,register=5")
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--league', type=int, default=500, help="teams to seed for --target client (default: 500)")
+    p.add_argument('--listed', type=float, default=0.1, help="fraction of players listed when seeding")
+    p.add_argument('--pool', type=int, default=2000, help="listings the buy scenario draws from")
+    p.add_argument('--hot', type=int, default=10, help="popular listings every buyer goes after (default: 10)")
+    p.add_argument('--hot-share', type=float, default=0.5, help="share of buys aimed at the popular listings")
+    p.add_argument('--prefix', default='bench', help="username prefix of the seeded users")
+    p.add_argument('--password', default='StrongPass123!')
+    p.add_argument('--keepdb', action='store_true', help="keep (and reuse) the seeded test database")
+    p.add_argument('--out', help="write the JSON report here")
+    p.set_defaults(func=run)
+
+    o = sub.add_parser('orderbook', help="orders/s through the matching engine, optionally with DB settlement")
+    o.add_argument('--orders', type=int, default=100_000, help="orders to match (default: 100000)")
+    o.add_argument('--players', type=int, default=5000, help="distinct players, in-memory mode (default: 5000)")
+    o.add_argument('--teams', type=int, default=500, help="distinct teams, in-memory mode (default: 500)")
+    o.add_argument('--settle', action='store_true',
+                   help="insert the orders into a seeded throwaway test DB and time MatchingEngine.poll()")
+    o.add_argument('--league', type=int, default=1000, help="teams to seed with --settle (default: 1000)")
+    o.add_argument('--batch-size', type=int, default=500, help="fills per settlement transaction")
+    o.add_argument('--seed', type=int, default=1)
+    o.add_argument('--prefix', default='book', help="username prefix of the seeded users")
+    o.add_argument('--keepdb', action='store_true', help="keep (and reuse) the seeded test database")
+    o.add_argument('--out', help="write the JSON result here")
+    o.set_defaults(func=orderbook)
+
+    s = sub.add_parser('servers', help="gthread vs ASGI gunicorn: throughput and memory per connection")
+    s.add_argument('--profiles', default='gthread,asgi', help="GUNICORN_PROFILEs to compare (default: gthread,asgi)")
+    s.add_argument('--connections', default='10,50,200',
+                   help="concurrent keep-alive connections per level (default: 10,50,200)")
+    s.add_argument('--duration', type=float, default=10.0, help="seconds per level (default: 10)")
+    s.add_argument('--workers', type=int, default=2, help="worker processes for every profile (default: 2)")
+    s.add_argument('--port', type=int, default=8765)
+    s.add_argument('--league', type=int, default=500, help="teams to seed (at least one per connection)")
+    s.add_argument('--listed', type=float, default=0.1, help="fraction of players listed when seeding")
+    s.add_argument('--seed', type=int, default=1)
+    s.add_argument('--prefix', default='bench', help="username prefix of the seeded users")
+    s.add_argument('--keepdb', action='store_true', help="keep (and reuse) the seeded test database")
+    s.add_argument('--out', help="write the JSON result here")
+    s.set_defaults(func=servers)
+
+    z = sub.add_parser('serializers', help="per-row cost of the DRF serializers vs the .values() fast path")
+    z.add_argument('--rows', type=int, default=10_000, help="rows per response (default: 10000)")
+    z.add_argument('--repeat', type=int, default=3, help="renderings per path, the best counts (default: 3)")
+    z.add_argument('--seed', type=int, default=1)
+    z.add_argument('--prefix', default='ser', help="username prefix of the seeded users")
+    z.add_argument('--keepdb', action='store_true', help="keep (and reuse) the seeded test database")
+    z.add_argument('--out', help="write the JSON result here")
+    z.set_defaults(func=serializers)
+
+    v = sub.add_parser('revaluation', help="wall time of revalue_players over a seeded league")
+    v.add_argument('--players', type=int, default=1_000_000, help="players to seed, 20 a team (default: 1000000)")
+    v.add_argument('--chunk-size', type=int, default=20_000, help="players per transaction (default: 20000)")
+    v.add_argument('--seed', type=int, default=1)
+    v.add_argument('--prefix', default='reval', help="username prefix of the seeded users")
+    v.add_argument('--keepdb', action='store_true', help="keep (and reuse) the seeded test database")
+    v.add_argument('--out', help="write the JSON result here")
+    v.set_defaults(func=revaluation)
+
+    c = sub.add_parser('compare', help="compare two saved JSON reports")
+    c.add_argument('base')
+    c.add_argument('new')
+    c.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
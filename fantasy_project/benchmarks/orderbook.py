@@ -0,0 +1,117 @@
+"""
+Throughput of the order-book matching engine.
+
+``run_engine`` feeds synthetic orders straight into ``fantasy.orderbook`` and
+times every ``add`` (no database). ``run_settled`` inserts real Order rows for
+a seeded league and times ``MatchingEngine.poll()``, which rebuilds the book,
+matches and writes every fill through ``settle_fills`` in batches.
+"""
+import random
+import time
+from decimal import Decimal
+
+from .report import percentile
+
+POSITIONS = ('GK', 'DEF', 'MID', 'ATT')
+
+
+def synthetic_orders(count, players=5000, teams=500, seed=1):
+    """Half asks on owned players, half bids (70% on a position, 30% on a player) around player values."""
+    from fantasy.orderbook import ASK, BID, BookOrder
+
+    rng = random.Random(seed)
+    values = [rng.randint(5_000, 25_000) * 10 for _ in range(players)]
+    orders = []
+    for order_id in range(1, count + 1):
+        player = rng.randrange(players)
+        owner = player % teams
+        if rng.random() < 0.5:
+            price = values[player] * rng.uniform(0.9, 1.3)
+            orders.append(BookOrder(order_id, owner, ASK, player, POSITIONS[player % 4], _money(price)))
+        else:
+            bidder = (owner + rng.randrange(1, teams)) % teams
+            price = values[player] * rng.uniform(0.8, 1.2)
+            target = player if rng.random() < 0.3 else None
+            orders.append(BookOrder(order_id, bidder, BID, target, POSITIONS[player % 4], _money(price)))
+    return orders
+
+
+def run_engine(count=100_000, players=5000, teams=500, seed=1):
+    from fantasy.orderbook import OrderBook
+
+    orders = synthetic_orders(count, players, teams, seed)
+    book = OrderBook()
+    latencies = []
+    fills = 0
+    clock = time.perf_counter
+    started = clock()
+    for order in orders:
+        t0 = clock()
+        if book.add(order) is not None:
+            fills += 1
+        latencies.append(clock() - t0)
+    elapsed = clock() - started
+    latencies.sort()
+    return {
+        'mode': 'engine',
+        'orders': count,
+        'fills': fills,
+        'resting': len(book),
+        'elapsed_s': round(elapsed, 3),
+        'orders_per_s': round(count / elapsed),
+        'add_latency_us': {p: round(percentile(latencies, pct) * 1e6, 2)
+                           for p, pct in (('p50', 50), ('p99', 99), ('max', 100))},
+    }
+
+
+def run_settled(count=20_000, seed=1, batch_size=500):
+    """Needs a seeded database (``seed_league``); every open order is replaced by ``count`` new ones."""
+    from fantasy.matching import MatchingEngine
+    from fantasy.models import Order, Player
+
+    rng = random.Random(seed)
+    Order.objects.filter(status=Order.OPEN).update(status=Order.CANCELLED)
+    owned = list(Player.objects.filter(owner__isnull=False).values_list('pk', 'owner_id', 'position', 'value'))
+    teams = sorted({owner for _, owner, _, _ in owned})
+    asks = rng.sample(owned, min(count // 2, len(owned)))  # one open ask per player
+    rows = [Order(team_id=owner, side=Order.ASK, player_id=pk, position=position,
+                  price=_money(value * Decimal(str(round(rng.uniform(0.9, 1.3), 2)))))
+            for pk, owner, position, value in asks]
+    for _ in range(count - len(rows)):
+        _, owner, position, value = rng.choice(owned)
+        bidder = rng.choice(teams)
+        rows.append(Order(team_id=bidder, side=Order.BID, position=position,
+                          price=_money(value * Decimal(str(round(rng.uniform(0.8, 1.2), 2))))))
+    rng.shuffle(rows)
+    Order.objects.bulk_create(rows, batch_size=5000)
+
+    engine = MatchingEngine(batch_size=batch_size)
+    started = time.perf_counter()
+    settled = engine.poll()
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': 'settled',
+        'orders': len(rows),
+        'fills': settled,
+        'rejected': engine.stats['rejected'],
+        'resting': len(engine.book),
+        'batch_size': batch_size,
+        'elapsed_s': round(elapsed, 3),
+        'orders_per_s': round(len(rows) / elapsed),
+        'fills_per_s': round(settled / elapsed),
+    }
+
+
+def format_result(result):
+    lines = [f"order book ({result['mode']}): {result['orders']} orders, {result['fills']} fills, "
+             f"{result['resting']} resting, {result['elapsed_s']}s"]
+    lines.append(f"  {result['orders_per_s']} orders/s"
+                 + (f", {result['fills_per_s']} fills/s, {result['rejected']} orders rejected at settlement"
+                    if result['mode'] == 'settled' else ""))
+    if 'add_latency_us' in result:
+        lines.append("  add latency (us): " + ", ".join(f"{k} {v}" for k, v in result['add_latency_us'].items()))
+    return "\n".join(lines)
+
+
+def _money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
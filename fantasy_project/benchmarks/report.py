@@ -0,0 +1,99 @@
+import json
+import math
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """
+    ``samples`` is a list of (latency_seconds, status, queries); queries may be
+    None when the target cannot report them. Latencies are reported in ms.
+    """
+    latencies = sorted(s[0] * 1000 for s in samples)
+    queries = [s[2] for s in samples if s[2] is not None]
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(n for code, n in statuses.items() if int(code) >= 500),
+        'statuses': statuses,
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': _round(percentile(latencies, 50)),
+            'p95': _round(percentile(latencies, 95)),
+            'p99': _round(percentile(latencies, 99)),
+            'mean': _round(sum(latencies) / len(latencies)) if latencies else None,
+            'max': _round(latencies[-1]) if latencies else None,
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def build_report(meta, samples_by_endpoint, elapsed):
+    everything = [s for samples in samples_by_endpoint.values() for s in samples]
+    return {
+        'meta': meta,
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize(everything, elapsed),
+        'endpoints': {name: summarize(samples, elapsed) for name, samples in sorted(samples_by_endpoint.items())},
+    }
+
+
+def save(report, path):
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def format_report(report):
+    lines = [f"{'endpoint':<14}{'reqs':>8}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'q/req':>8}{'5xx':>6}"]
+    rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+    for name, s in rows:
+        lat = s['latency_ms']
+        lines.append(f"{name:<14}{s['requests']:>8}{_fmt(s['rps']):>10}{_fmt(lat['p50']):>10}"
+                      f"{_fmt(lat['p95']):>10}{_fmt(lat['p99']):>10}{_fmt(s['queries_per_request']):>8}"
+                      f"{s['errors']:>6}")
+    return "\n".join(lines)
+
+
+def compare(base, new):
+    """Side-by-side of two saved runs; deltas are new relative to base."""
+    lines = [f"{'endpoint':<14}{'metric':<8}{'base':>12}{'new':>12}{'change':>10}"]
+    names = sorted(set(base['endpoints']) | set(new['endpoints'])) + ['TOTAL']
+    for name in names:
+        b = base['total'] if name == 'TOTAL' else base['endpoints'].get(name)
+        n = new['total'] if name == 'TOTAL' else new['endpoints'].get(name)
+        if not b or not n:
+            lines.append(f"{name:<14}{'(only in one run)':<8}")
+            continue
+        metrics = [('rps', b['rps'], n['rps'])]
+        metrics += [(p, b['latency_ms'][p], n['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]
+        metrics += [('q/req', b['queries_per_request'], n['queries_per_request'])]
+        for metric, old, cur in metrics:
+            lines.append(f"{name:<14}{metric:<8}{_fmt(old):>12}{_fmt(cur):>12}{_change(old, cur):>10}")
+    return "\n".join(lines)
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:g}"
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return '-'
+    return f"{(new - old) / old * 100:+.1f}%"
@@ -0,0 +1,48 @@
+"""
+Wall time of the league-wide revaluation job (``manage.py revalue_players``).
+
+``run_revaluation`` revalues every player of a seeded league, timing the
+market-signal load and the chunked pass separately, then checks that every
+team's stored squad_value still matches its players.
+"""
+import io
+import time
+
+
+def run_revaluation(chunk_size=20_000):
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+    from fantasy.revaluation import Revaluation
+
+    revaluation = Revaluation(chunk_size=chunk_size)
+    started = time.perf_counter()
+    revaluation.load()
+    loaded = time.perf_counter()
+    last_pk = revaluation.revalue_chunk(0)
+    while last_pk is not None:
+        last_pk = revaluation.revalue_chunk(last_pk)
+    finished = time.perf_counter()
+    try:
+        call_command('rebuild_team_values', '--verify', stdout=io.StringIO())
+        consistent = True
+    except CommandError:
+        consistent = False
+    stats = revaluation.stats
+    return {
+        'mode': 'revaluation',
+        'chunk_size': chunk_size,
+        'players': stats['players'],
+        'changed': stats['changed'],
+        'trades': stats['trades'],
+        'load_s': round(loaded - started, 2),
+        'revalue_s': round(finished - loaded, 2),
+        'players_per_s': round(stats['players'] / (finished - started)) if stats['players'] else None,
+        'squads_consistent': consistent,
+    }
+
+
+def format_result(result):
+    return (f"Revalued {result['players']} players ({result['changed']} changed) from {result['trades']} recent "
+            f"trades, {result['chunk_size']} per transaction: market load {result['load_s']}s, revaluation "
+            f"{result['revalue_s']}s, {result['players_per_s']} players/s; squad values "
+            f"{'consistent' if result['squads_consistent'] else 'DRIFTED'}")
@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from .report import build_report
+from .scenarios import SCENARIOS, Workload, discover_listings, login
+
+
+def run_load(target, usernames, password='StrongPass123!', duration=10.0, mix=None, seed=0,
+             pool=2000, hot=10, hot_share=0.5, tokens=None):
+    """
+    Drive ``target`` with one thread per username for ``duration`` seconds.
+
+    Each simulated user logs in once (or uses its access token from
+    ``tokens``), then picks scenarios from ``mix`` (name -> weight) with its
+    own seeded RNG. Returns the report dict.
+    """
+    mix = {name: weight for name, weight in (mix or {}).items() if weight > 0}
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    setup = target.session()
+    try:
+        login(setup, usernames[0], password)
+        listing_ids = discover_listings(setup, pool) if 'buy' in mix else []
+    finally:
+        setup.close()
+    workload = Workload(listing_ids, hot=hot, hot_share=hot_share)
+
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}
+    failures = []
+    clock = {}
+
+    def start_clock():
+        # runs once, when every user has logged in, before any of them is released
+        clock['started'] = time.perf_counter()
+        clock['stop_at'] = clock['started'] + duration
+
+    ready = threading.Barrier(len(usernames) + 1, action=start_clock)
+
+    def simulated_user(index, username):
+        rng = random.Random(f"{seed}:{index}")
+        session = target.session()
+        local = {name: [] for name in names}
+        try:
+            if tokens:
+                session.authenticate(tokens[username])
+            else:
+                login(session, username, password)
+            ready.wait()
+            while time.perf_counter() < clock['stop_at']:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                result = SCENARIOS[name](session, workload, rng)
+                if result is not None:
+                    local[name].append((time.perf_counter() - started, result.status, result.queries))
+        except Exception as exc:
+            failures.append((username, exc))
+            ready.abort()
+        finally:
+            session.close()
+            for name, rows in local.items():
+                samples[name].extend(rows)  # list.extend is atomic under the GIL
+
+    threads = [threading.Thread(target=simulated_user, args=(i, u), daemon=True) for i, u in enumerate(usernames)]
+    for t in threads:
+        t.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass
+    for t in threads:
+        t.join()
+    if failures:
+        username, exc = failures[0]
+        raise RuntimeError(f"simulated user {username} failed: {exc}") from exc
+    elapsed = time.perf_counter() - clock['started']
+
+    meta = {
+        'target': target.name,
+        'users': len(usernames),
+        'duration_s': duration,
+        'mix': mix,
+        'seed': seed,
+        'hot_listings': len(workload.hot),
+        'hot_share': hot_share,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    return build_report(meta, samples, elapsed)
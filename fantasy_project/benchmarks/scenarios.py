@@ -0,0 +1,98 @@
+import itertools
+import threading
+
+API = '/api'
+
+
+class Workload:
+    """
+    State shared by all simulated users: the pool of listings to buy from and
+    a counter for fresh registrations. A small "hot" set of listings takes a
+    fixed share of all buys, so buyers contend for the same rows.
+    """
+
+    def __init__(self, listing_ids, hot=10, hot_share=0.5, register_prefix='benchreg'):
+        self.hot = list(listing_ids[:hot])
+        self.cold = list(listing_ids[hot:])
+        self.hot_share = hot_share
+        self.register_prefix = register_prefix
+        self._registrations = itertools.count()
+        self._lock = threading.Lock()
+
+    def pick_listing(self, rng):
+        if self.hot and (not self.cold or rng.random() < self.hot_share):
+            return rng.choice(self.hot)
+        with self._lock:
+            # cold listings are handed out once, like a market being worked through
+            return self.cold.pop(rng.randrange(len(self.cold))) if self.cold else None
+
+    def next_username(self):
+        return f"{self.register_prefix}{next(self._registrations):07d}"
+
+
+def market(session, workload, rng):
+    return session.request('GET', f'{API}/players/market/?page_size=20')
+
+
+def buy(session, workload, rng):
+    listing_id = workload.pick_listing(rng)
+    if listing_id is None:
+        return None
+    return session.request('POST', f'{API}/transfers/{listing_id}/buy/')
+
+
+def transactions(session, workload, rng):
+    return session.request('GET', f'{API}/transactions/?pagination=cursor')
+
+
+def teams_me(session, workload, rng):
+    return session.request('GET', f'{API}/teams/me/')
+
+
+def players(session, workload, rng):
+    position = rng.choice(('gk', 'def', 'mid', 'att'))
+    return session.request('GET', f'{API}/players/?position={position}&limit=20')
+
+
+def register(session, workload, rng):
+    username = workload.next_username()
+    return session.request('POST', f'{API}/auth/register', {
+        'username': username,
+        'email': f'{username}@example.com',
+        'password': 'StrongPass123!',
+        'first_name': 'Bench',
+        'last_name': 'User',
+    })
+
+
+SCENARIOS = {
+    'market': market,
+    'buy': buy,
+    'transactions': transactions,
+    'teams_me': teams_me,
+    'players': players,
+    'register': register,
+}
+
+DEFAULT_MIX = {'market': 40, 'teams_me': 25, 'transactions': 20, 'buy': 10, 'register': 5}
+
+
+def login(session, username, password):
+    result = session.request('POST', f'{API}/auth/login', {'username': username, 'password': password})
+    if result.status != 200:
+        raise RuntimeError(f"login failed for {username}: HTTP {result.status}")
+    session.authenticate(result.data['access'])
+
+
+def discover_listings(session, limit):
+    """Collect up to ``limit`` active listing ids by walking the market feed."""
+    ids, path = [], f'{API}/players/market/?page_size=100'
+    while path and len(ids) < limit:
+        result = session.request('GET', path)
+        if result.status != 200:
+            raise RuntimeError(f"market discovery failed: HTTP {result.status}")
+        ids += [row['listing_id'] for row in result.data['results']]
+        nxt = result.data.get('next')
+        # follow the cursor link relative to the target
+        path = nxt[nxt.index(API):] if nxt else None
+    return ids[:limit]
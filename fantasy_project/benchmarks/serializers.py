@@ -0,0 +1,75 @@
+"""
+Per-row cost of the DRF serializers against the ``.values()`` fast path.
+
+``run_serializers`` renders the same 10k-row responses both ways from a
+seeded league: players, transactions, and teams (``rows / 20`` of them, so
+the same number of players nested in their squads; per row means per team
+there). Each timing covers the whole trip, queries included: fetch, build
+the rows, JSONRenderer. The rendered bytes must come out identical.
+"""
+import time
+
+PLAYERS_PER_TEAM = 20
+
+
+def cases(rows):
+    from fantasy.fast_serializers import FastPlayerSerializer, FastTeamSerializer, FastTransactionSerializer
+    from fantasy.serializers import PlayerSerializer, TeamSerializer, TransactionSerializer
+    from fantasy.views import PlayerViewSet, TeamViewSet, TransactionViewSet
+
+    teams = max(rows // PLAYERS_PER_TEAM, 1)  # about as many players as the other lists have rows
+    return [
+        ('players', PlayerViewSet.queryset.order_by('pk')[:rows], PlayerSerializer, FastPlayerSerializer),
+        ('transactions', TransactionViewSet.queryset[:rows], TransactionSerializer, FastTransactionSerializer),
+        ('teams', TeamViewSet.queryset.select_related('user').order_by('pk')[:teams], TeamSerializer,
+         FastTeamSerializer),
+    ]
+
+
+def render_drf(queryset, serializer_class):
+    from rest_framework.renderers import JSONRenderer
+
+    return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+
+def render_fast(queryset, fast_class):
+    from rest_framework.renderers import JSONRenderer
+
+    fast = fast_class()
+    return JSONRenderer().render(fast.rows(fast.values(queryset.all())))
+
+
+def best_of(repeat, render, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = render(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+
+def run_serializers(rows=10_000, repeat=3):
+    results = []
+    for name, queryset, serializer_class, fast_class in cases(rows):
+        drf_s, drf_body = best_of(repeat, render_drf, queryset, serializer_class)
+        fast_s, fast_body = best_of(repeat, render_fast, queryset, fast_class)
+        count = queryset.count()
+        results.append({
+            'response': name,
+            'rows': count,
+            'bytes': len(drf_body),
+            'identical': fast_body == drf_body,
+            'drf_us_per_row': round(drf_s / count * 1e6, 2) if count else None,
+            'fast_us_per_row': round(fast_s / count * 1e6, 2) if count else None,
+            'speedup': round(drf_s / fast_s, 2) if fast_s else None,
+        })
+    return {'mode': 'serializers', 'repeat': repeat, 'results': results}
+
+
+def format_result(result):
+    lines = [f"DRF serializers vs .values() fast path, best of {result['repeat']}, queries included"]
+    for r in result['results']:
+        lines.append(f"  {r['response']:<13} {r['rows']:>6} rows, {r['bytes'] / 2 ** 20:.1f} MB: "
+                     f"DRF {r['drf_us_per_row']} us/row, fast {r['fast_us_per_row']} us/row, "
+                     f"{r['speedup']}x, {'identical' if r['identical'] else 'DIFFERENT'} bytes")
+    return "\n".join(lines)
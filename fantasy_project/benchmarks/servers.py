@@ -0,0 +1,168 @@
+"""
+Concurrency and memory of the two gunicorn profiles on the read endpoints.
+
+``run_servers`` starts gunicorn once per profile (``GUNICORN_PROFILE`` in
+gunicorn.conf.py: gthread WSGI workers, or uvicorn ASGI workers serving the
+async views) with the same number of worker processes, then drives the
+read-only mix over more and more keep-alive connections. The RSS of the
+master and its workers is sampled while each level runs; the peak over the
+idle RSS, divided by the number of connections, is what one open connection
+costs.
+"""
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from .runner import run_load
+from .targets import HTTPTarget
+
+READ_MIX = {'market': 40, 'teams_me': 25, 'transactions': 20, 'players': 15}
+PROFILES = ('gthread', 'asgi')
+PROJECT_DIR = Path(__file__).resolve().parent.parent  # holds gunicorn.conf.py
+
+
+def process_rss(pid):
+    """Resident memory in bytes of ``pid`` and all its children; None without psutil."""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        root = psutil.Process(pid)
+        processes = [root, *root.children(recursive=True)]
+    except psutil.NoSuchProcess:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass  # a worker being recycled
+    return total
+
+
+class PeakMemory:
+    """Samples ``process_rss(pid)`` every ``interval`` seconds for as long as it is entered."""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._record()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._record()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def _record(self):
+        rss = process_rss(self.pid)
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+@contextmanager
+def gunicorn(profile, port, workers, env=None):
+    """A gunicorn running ``profile`` on 127.0.0.1:``port``, up and answering when the block starts."""
+    env = dict(os.environ, GUNICORN_PROFILE=profile, GUNICORN_WORKERS=str(workers), **(env or {}))
+    with tempfile.TemporaryFile() as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+             '--access-logfile', os.devnull],
+            cwd=PROJECT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            _wait_until_serving(server, port, log)
+            yield server
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def _wait_until_serving(server, port, log, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f"gunicorn exited with {server.returncode}:\n{log.read()[-2000:].decode()}")
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        try:
+            conn.request('GET', '/api/players/market/')
+            conn.getresponse().read()  # 401 is fine: a worker has booted the app
+            return
+        except OSError:
+            time.sleep(0.2)
+        finally:
+            conn.close()
+    raise RuntimeError(f"gunicorn did not answer on port {port} within {timeout}s")
+
+
+def mint_tokens(usernames):
+    """Access tokens as auth/login would issue them, without hashing a password per connection."""
+    from django.contrib.auth.models import User
+    from fantasy.authentication import ClaimsTokenObtainPairSerializer
+
+    return {user.username: str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+            for user in User.objects.filter(username__in=usernames)}
+
+
+def run_servers(usernames, profiles=PROFILES, connections=(10, 50, 200), duration=10.0, workers=2,
+                port=8765, seed=1, env=None, tokens=None):
+    """
+    Needs ``max(connections)`` users in ``usernames``, seeded in the database
+    the servers will use (``env`` is passed on to gunicorn, e.g. DB_NAME).
+    Without ``tokens`` every simulated user logs in over HTTP first.
+    """
+    results = []
+    for profile in profiles:
+        with gunicorn(profile, port, workers, env) as server:
+            idle = process_rss(server.pid)
+            levels = []
+            for count in connections:
+                with PeakMemory(server.pid) as memory:
+                    report = run_load(HTTPTarget(f'http://127.0.0.1:{port}'), usernames[:count],
+                                      duration=duration, mix=READ_MIX, seed=seed, tokens=tokens)
+                total = report['total']
+                levels.append({
+                    'connections': count,
+                    'requests': total['requests'],
+                    'errors': total['errors'],
+                    'rps': total['rps'],
+                    'latency_ms': total['latency_ms'],
+                    'peak_rss_mb': _mb(memory.peak),
+                    'kb_per_connection': (round((memory.peak - idle) / count / 1024, 1)
+                                          if memory.peak is not None and idle is not None else None),
+                })
+        results.append({'profile': profile, 'workers': workers, 'idle_rss_mb': _mb(idle), 'levels': levels})
+    return {'mode': 'servers', 'mix': READ_MIX, 'duration_s': duration, 'profiles': results}
+
+
+def format_result(result):
+    lines = [f"gunicorn profiles on the read mix, {result['duration_s']}s per level"]
+    for profile in result['profiles']:
+        lines.append(f"{profile['profile']}: {profile['workers']} workers, idle {profile['idle_rss_mb']} MB")
+        for level in profile['levels']:
+            latency = level['latency_ms']
+            lines.append(f"  {level['connections']:>5} connections: {level['rps']} req/s, p50 {latency['p50']} ms, "
+                         f"p99 {latency['p99']} ms, {level['errors']} errors, peak {level['peak_rss_mb']} MB, "
+                         f"{level['kb_per_connection']} KB/connection")
+    return "\n".join(lines)
+
+
+def _mb(value):
+    return round(value / 2 ** 20, 1) if value is not None else None
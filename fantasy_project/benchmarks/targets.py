@@ -0,0 +1,94 @@
+import http.client
+import json
+from urllib.parse import urlsplit
+
+
+class Result:
+    __slots__ = ('status', 'data', 'queries')
+
+    def __init__(self, status, data, queries=None):
+        self.status = status
+        self.data = data
+        self.queries = queries
+
+
+def _decode(body):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+class ClientTarget:
+    """In-process target: one django.test.Client per simulated user, queries counted per request."""
+    name = 'client'
+
+    def session(self):
+        return ClientSession()
+
+
+class ClientSession:
+    def __init__(self):
+        from django.test import Client
+        self.client = Client(raise_request_exception=False)
+        self.headers = {}
+
+    def authenticate(self, token):
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def request(self, method, path, data=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'GET':
+                resp = self.client.get(path, headers=self.headers)
+            else:
+                resp = self.client.generic(method, path, json.dumps(data or {}), 'application/json',
+                                           headers=self.headers)
+        return Result(resp.status_code, _decode(resp.content), len(queries))
+
+    def close(self):
+        from django.db import connection
+        connection.close()
+
+
+class HTTPTarget:
+    """A running server; one keep-alive connection per simulated user."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"unsupported target {base_url!r}")
+        self.name = base_url
+        self.parts = parts
+
+    def session(self):
+        return HTTPSession(self.parts)
+
+
+class HTTPSession:
+    def __init__(self, parts):
+        conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.conn = conn_class(parts.hostname, parts.port, timeout=30)
+        self.prefix = parts.path.rstrip('/')
+        self.headers = {'Content-Type': 'application/json'}
+
+    def authenticate(self, token):
+        self.headers['Authorization'] = f'Bearer {token}'
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data or {}) if method != 'GET' else None
+        try:
+            self.conn.request(method, self.prefix + path, body=body, headers=self.headers)
+            resp = self.conn.getresponse()
+            payload = resp.read()
+        except (http.client.HTTPException, OSError):
+            # server closed the keep-alive connection; count it and reconnect on the next call
+            self.conn.close()
+            return Result(599, None)
+        queries = resp.getheader('X-DB-Query-Count')  # set by fantasy.middleware.QueryInstrumentationMiddleware
+        return Result(resp.status, _decode(payload), int(queries) if queries is not None else None)
+
+    def close(self):
+        self.conn.close()
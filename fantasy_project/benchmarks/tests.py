@@ -0,0 +1,114 @@
+import os
+
+import pytest
+from django.core.management import call_command
+
+from .orderbook import run_engine, run_settled
+from .report import compare, percentile
+from .runner import run_load
+from .revaluation import run_revaluation
+from .serializers import run_serializers
+from .servers import PeakMemory, mint_tokens, process_rss, run_servers
+from .targets import ClientTarget
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_load_against_test_client_reports_every_endpoint():
+    call_command('seed_league', users=6, seed=3, prefix='bench', listed=0.5, verbosity=0)
+    usernames = [f"bench{i:07d}" for i in range(4)]
+    mix = {'market': 1, 'buy': 1, 'transactions': 1, 'teams_me': 1, 'players': 1, 'register': 1}
+
+    result = run_load(ClientTarget(), usernames, duration=1.5, mix=mix, hot=2)
+
+    assert result['meta']['users'] == 4
+    assert set(result['endpoints']) == set(mix)
+    for name, stats in result['endpoints'].items():
+        assert stats['errors'] == 0, (name, stats['statuses'])
+        if stats['requests']:
+            assert stats['latency_ms']['p50'] <= stats['latency_ms']['p95'] <= stats['latency_ms']['p99']
+            assert stats['queries_per_request'] >= 1
+    assert result['total']['requests'] == sum(s['requests'] for s in result['endpoints'].values())
+    assert 'market' in compare(result, result)
+
+
+def test_order_book_engine_benchmark_reports_throughput():
+    result = run_engine(2000, players=50, teams=10, seed=2)
+    assert result['orders'] == 2000 and 0 < result['fills'] < 1000
+    assert result['orders_per_s'] > 0
+    assert result['add_latency_us']['p50'] <= result['add_latency_us']['p99'] <= result['add_latency_us']['max']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_order_book_settled_benchmark_keeps_the_books_balanced():
+    from fantasy.models import Order, Team
+
+    call_command('seed_league', users=20, seed=4, prefix='book', listed=0, verbosity=0)
+    money = sum(Team.objects.values_list('capital', flat=True))
+
+    result = run_settled(400, seed=4, batch_size=25)
+
+    assert result['fills'] > 0
+    assert Order.objects.filter(status=Order.FILLED).count() == 2 * result['fills']
+    assert sum(Team.objects.values_list('capital', flat=True)) == money
+    assert Team.objects.filter(capital__lt=0).count() == 0
+    call_command('rebuild_team_values', '--verify', verbosity=0)
+
+
+@pytest.mark.django_db
+def test_serializers_benchmark_renders_identical_bytes():
+    call_command('seed_league', users=5, seed=5, prefix='ser', listed=0.2, history=20, verbosity=0)
+
+    result = run_serializers(rows=100, repeat=1)
+
+    assert [r['response'] for r in result['results']] == ['players', 'transactions', 'teams']
+    players, transactions, teams = (r['rows'] for r in result['results'])
+    assert (players, teams) == (100, 5) and 0 < transactions <= 100
+    for r in result['results']:
+        assert r['identical'], r['response']
+        assert r['drf_us_per_row'] > 0 and r['fast_us_per_row'] > 0
+
+
+@pytest.mark.django_db
+def test_revaluation_benchmark_revalues_every_player_consistently():
+    call_command('seed_league', users=10, seed=7, prefix='reval', listed=0.1, history=10, history_days=30,
+                 verbosity=0)
+
+    result = run_revaluation(chunk_size=35)
+
+    assert result['players'] == 200 and 0 < result['changed'] <= 200
+    assert result['trades'] > 0
+    assert result['squads_consistent']
+
+
+def test_peak_memory_follows_the_process_tree():
+    pytest.importorskip('psutil')
+    before = process_rss(os.getpid())
+    with PeakMemory(os.getpid(), interval=0.01) as memory:
+        ballast = b'x' * (32 * 2 ** 20)
+    assert memory.peak >= before + len(ballast) // 2
+    del ballast
+
+
+@pytest.mark.django_db(transaction=True)
+def test_servers_benchmark_drives_both_gunicorn_profiles():
+    pytest.importorskip('gunicorn')
+    pytest.importorskip('uvicorn_worker')
+    from django.db import connection
+
+    call_command('seed_league', users=4, seed=5, prefix='bench', listed=0.5, verbosity=0)
+    usernames = [f"bench{i:07d}" for i in range(4)]
+    result = run_servers(usernames, connections=(2, 4), duration=1.0, workers=1,
+                         env={'DB_NAME': connection.settings_dict['NAME']}, tokens=mint_tokens(usernames))
+
+    assert [profile['profile'] for profile in result['profiles']] == ['gthread', 'asgi']
+    for profile in result['profiles']:
+        for level in profile['levels']:
+            assert level['requests'] > 0 and level['errors'] == 0, (profile['profile'], level)
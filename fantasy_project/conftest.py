@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets(settings):
+    # every API call made by a test must stay within its view's declared query_budgets
+    settings.QUERY_BUDGET_ENFORCE = True
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # cache keys embed DB versions, which restart with every test database
+    # (the auth versions too)
+    from django.core.cache import cache
+    from fantasy.authentication import user_versions
+    cache.clear()
+    user_versions.clear()
+    yield
+    cache.clear()
+    user_versions.clear()
@@ -1,8 +1,23 @@
 from django.contrib import admin
-from .models import Team, Player, TransferListing, Transaction
+from .models import Team, Player, TransferListing, Transaction, Order, OutboxMessage
+
+
+class TeamAdmin(admin.ModelAdmin):
+    # squad_value is maintained from player saves; show it, never edit it
+    list_display = ('name', 'user', 'capital', 'squad_value')
+    readonly_fields = ('squad_value',)
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    # given-up messages (failed_at set) stay here for inspection
+    list_display = ('id', 'topic', 'created_at', 'available_at', 'attempts', 'failed_at')
+    list_filter = ('topic', ('failed_at', admin.EmptyFieldListFilter))
+
 
 # admin.site.register(User)
-admin.site.register(Team)
+admin.site.register(Team, TeamAdmin)
 admin.site.register(Player)
 admin.site.register(TransferListing)
-admin.site.register(Transaction)
\ No newline at end of file
+admin.site.register(Transaction)
+admin.site.register(Order)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
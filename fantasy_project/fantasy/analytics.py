@@ -0,0 +1,157 @@
+"""
+Market analytics: transfer volume per day, average price per position and
+the most traded players, for any range of days, read from rollup tables.
+
+Settlement passes its new Transactions to ``record()`` in the same
+transaction, which adds them to PositionDay (a row per day and position) and
+PlayerDay (a row per day and player). A dashboard then sums a row per
+position, or per player traded, per day instead of scanning and joining the
+transaction history. Days are dates in the current time zone, as TruncDate
+sees created_at.
+
+``rebuild()`` recomputes a range of days from the history, a chunk of days
+per transaction, deleting and re-inserting the chunk's rows. Days before
+yesterday take no more trades, so they are rewritten without blocking
+anyone; a chunk from yesterday on locks both tables against settlement's
+upserts while it recounts, so a trade settling meanwhile is counted exactly
+once. The history does not record a trade's position, so a rebuild counts
+trades under the player's position now, and drops those of deleted players.
+"""
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .fast_serializers import decimal
+from .models import POSITION_CHOICES, Player, PlayerDay, PositionDay, TransactionHistory
+
+# per rollup: its key column, the key's SQL type, and what the history is grouped by for it
+ROLLUPS = {
+    PositionDay: ('position', 'text', 'p.position'),
+    PlayerDay: ('player_id', 'bigint', 't.player_id'),
+}
+CENT = Decimal('0.01')
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def record(trades):
+    """Add ``(created_at, position, player_id, amount)`` trades to the rollups; call it inside their transaction."""
+    rollups = {PositionDay: {}, PlayerDay: {}}
+    for created_at, position, player_id, amount in trades:
+        day = timezone.localdate(created_at)
+        for model, key in ((PositionDay, position), (PlayerDay, player_id)):
+            trades_, volume = rollups[model].get((day, key), (0, 0))
+            rollups[model][day, key] = (trades_ + 1, volume + amount)
+    if not rollups[PositionDay]:
+        return
+    # both upserts in one statement. Position rows are hot and taken in key order; a player's rows
+    # are only written by whoever holds the player's lock
+    (position_sql, position_params), (player_sql, player_params) = (
+        _add(model, rows) for model, rows in rollups.items())
+    with connection.cursor() as cursor:
+        cursor.execute(f"WITH positions AS ({position_sql}) {player_sql}", position_params + player_params)
+
+
+def _add(model, rows):
+    # the upsert of {(day, key): (trades, volume)} into model, whatever the number of rows
+    key, key_type, _ = ROLLUPS[model]
+    table, keys = _table(model), sorted(rows)
+    return (f"INSERT INTO {table} (day, {key}, trades, volume) "
+            f"SELECT * FROM unnest(%s::date[], %s::{key_type}[], %s::bigint[], %s::numeric[]) "
+            f"ON CONFLICT (day, {key}) DO UPDATE SET trades = {table}.trades + EXCLUDED.trades, "
+            f"volume = {table}.volume + EXCLUDED.volume",
+            [[day for day, _ in keys], [k for _, k in keys], [rows[k][0] for k in keys], [rows[k][1] for k in keys]])
+
+
+def _history(model, first, last):
+    """The ``SELECT day, key, trades, volume`` of ``model``'s rows for days ``first`` to ``last``, from the history."""
+    _, _, key = ROLLUPS[model]
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(first, time.min), tz)
+    stop = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min), tz)
+    return (f"SELECT (t.created_at AT TIME ZONE %s)::date, {key}, count(*), sum(t.amount) "
+            f"FROM {_table(TransactionHistory)} t JOIN {_table(Player)} p ON p.id = t.player_id "
+            f"WHERE t.created_at >= %s AND t.created_at < %s GROUP BY 1, 2",
+            [timezone.get_current_timezone_name(), start, stop])
+
+
+def rebuild_days(first, last):
+    """Recompute the rollups of days ``first`` to ``last`` (inclusive) in one transaction."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if last >= timezone.localdate() - timedelta(days=1):
+                # settlements wait here, not in between the count and the insert
+                cursor.execute(f"LOCK TABLE {_table(PositionDay)}, {_table(PlayerDay)} IN SHARE ROW EXCLUSIVE MODE")
+            for model, (key, _, _) in ROLLUPS.items():
+                model.objects.filter(day__range=(first, last)).delete()
+                sql, params = _history(model, first, last)
+                cursor.execute(f"INSERT INTO {_table(model)} (day, {key}, trades, volume) {sql}", params)
+
+
+def rebuild(first, last, days_per_chunk=7, progress=None):
+    """Recompute the rollups of days ``first`` to ``last``, oldest first; ``progress(last_day_done)`` after each chunk."""
+    if days_per_chunk < 1:
+        raise ValueError("days_per_chunk must be >= 1.")
+    day = first
+    while day <= last:
+        end = min(day + timedelta(days=days_per_chunk - 1), last)
+        rebuild_days(day, end)
+        if progress is not None:
+            progress(end)
+        day = end + timedelta(days=1)
+
+
+def drift(first, last):
+    """``(model, day, key, stored, counted)`` for each rollup row of days ``first`` to ``last`` the history disagrees with."""
+    found = []
+    for model, (key, _, _) in ROLLUPS.items():
+        sql, params = _history(model, first, last)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            counted = {(day, k): (trades, volume) for day, k, trades, volume in cursor.fetchall()}
+        stored = {(day, k): (trades, volume) for day, k, trades, volume in
+                  model.objects.filter(day__range=(first, last)).values_list('day', key, 'trades', 'volume')}
+        found += [(model, day, k, stored.get((day, k)), counted.get((day, k)))
+                  for day, k in sorted(stored.keys() | counted.keys()) if stored.get((day, k)) != counted.get((day, k))]
+    return found
+
+
+def _stats(trades, volume):
+    average = decimal((volume / trades).quantize(CENT, ROUND_HALF_UP)) if trades else None
+    return {'trades': trades, 'volume': decimal(volume), 'average_price': average}
+
+
+def daily(first, last, position=None):
+    """Trades and volume of every day from ``first`` to ``last``, of one position or all."""
+    rows = PositionDay.objects.filter(day__range=(first, last))
+    if position is not None:
+        rows = rows.filter(position=position)
+    totals = {day: (trades, volume) for day, trades, volume in
+              rows.values('day').annotate(t=Sum('trades'), v=Sum('volume')).order_by().values_list('day', 't', 'v')}
+    return [{'day': day.isoformat(), **_stats(*totals.get(day, (0, Decimal('0.00'))))}
+            for day in (first + timedelta(days=n) for n in range((last - first).days + 1))]
+
+
+def positions(first, last):
+    """Trades, volume and average price of each position over days ``first`` to ``last``."""
+    totals = {position: (trades, volume) for position, trades, volume in
+              PositionDay.objects.filter(day__range=(first, last)).values('position')
+              .annotate(t=Sum('trades'), v=Sum('volume')).order_by().values_list('position', 't', 'v')}
+    return [{'position': position, **_stats(*totals.get(position, (0, Decimal('0.00'))))}
+            for position, _ in POSITION_CHOICES]
+
+
+def top_players(first, last, limit):
+    """The ``limit`` players traded most over days ``first`` to ``last``: by trades, then volume."""
+    ranked = list(PlayerDay.objects.filter(day__range=(first, last)).values('player')
+                  .annotate(t=Sum('trades'), v=Sum('volume')).order_by('-t', '-v', 'player')
+                  .values_list('player', 't', 'v')[:limit])
+    players = {pk: (name, position) for pk, name, position in
+               Player.objects.filter(pk__in=[pk for pk, _, _ in ranked]).values_list('pk', 'name', 'position')}
+    return [{'id': pk, 'name': players[pk][0], 'position': players[pk][1], **_stats(trades, volume)}
+            for pk, trades, volume in ranked if pk in players]
@@ -7,3 +7,4 @@ class FantasyConfig(AppConfig):
 
     def ready(self):
         import fantasy.signals
+        import fantasy.db_pool  # counts connections from the first one on
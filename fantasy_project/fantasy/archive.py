@@ -0,0 +1,78 @@
+"""
+Hot and cold transfer history. Every purchase adds a Transaction, settled
+from the start and never changed again, so the table and its three
+(created_at, id) indexes would grow forever while almost every read wants
+the last few days.
+
+``manage.py archive_transactions`` moves the settled Transactions older
+than TRANSACTION_ARCHIVE_DAYS to ArchivedTransaction, ids included, oldest
+first. Each batch is one ``DELETE ... RETURNING`` feeding an ``INSERT`` in
+its own short transaction: a row is in exactly one of the tables in any
+snapshot, no row is locked for long, and a run that stops half-way has
+lost nothing and is resumed by running it again. A VACUUM of
+the hot table afterwards makes the space of the moved rows reusable, so
+the table and its indexes stay the size of TRANSACTION_ARCHIVE_DAYS of
+trading instead of all of it.
+
+Readers go through TransactionHistory, the UNION ALL view of both tables:
+/transactions/ (list, detail, cursor pages and export), the analytics
+rebuild and the revaluation see one history wherever its rows are.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedTransaction, Transaction
+
+COLUMNS = ('id', 'buyer_id', 'seller_id', 'player_id', 'amount', 'created_at', 'active')
+
+
+def max_age():
+    return timedelta(days=getattr(settings, 'TRANSACTION_ARCHIVE_DAYS', 90))
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def archive_batch(before, batch_size):
+    """Move the oldest ``batch_size`` settled Transactions created before ``before``; returns how many moved."""
+    hot, cold = _table(Transaction), _table(ArchivedTransaction)
+    columns = ', '.join(COLUMNS)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # walks tx_created_id_idx from its old end
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {hot} WHERE id IN ("
+                f"SELECT id FROM {hot} WHERE created_at < %s AND NOT active ORDER BY created_at, id LIMIT %s"
+                f") RETURNING {columns}) "
+                f"INSERT INTO {cold} ({columns}) SELECT {columns} FROM moved",
+                [before, batch_size])
+            return cursor.rowcount
+
+
+def archive(before=None, batch_size=5000, progress=None):
+    """
+    Move every settled Transaction created before ``before`` (default:
+    TRANSACTION_ARCHIVE_DAYS ago), ``batch_size`` per transaction;
+    ``progress(moved_so_far)`` after each batch. Returns how many moved.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be >= 1.")
+    before = before or timezone.now() - max_age()
+    moved = 0
+    while True:
+        count = archive_batch(before, batch_size)
+        moved += count
+        if count and progress is not None:
+            progress(moved)
+        if count < batch_size:
+            return moved
+
+
+def vacuum():
+    """VACUUM (ANALYZE) the hot table, outside any transaction, so the moved rows' space is reused."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"VACUUM (ANALYZE) {_table(Transaction)}")
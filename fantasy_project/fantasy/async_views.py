@@ -0,0 +1,169 @@
+"""
+Async versions of the read-heavy endpoints, for ASGI workers.
+
+The market, the transaction history, the players list and teams/me are
+served here when the app runs under ASGI (``fantasy_project.asgi_urls``).
+Each view fetches through Django's async ORM and cache APIs but reuses the
+sync viewset for everything else (filters, ordering, paginator choice,
+serializers), so a response body is byte for byte the one the sync view
+would have sent for the same request.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseBase
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from . import etags, fast_serializers, market_cache
+from .authentication import ClaimsJWTAuthentication
+from .models import Team, TransferListing
+from .pagination import MarketCursorPagination
+from .views import SQUAD, MarketFilter, PlayerViewSet, TeamViewSet, TransactionViewSet
+
+
+class AsyncReadView(View):
+    """
+    GET-only async view with the API's JWT authentication and DRF's error
+    format. Subclasses implement ``read(request)`` and return the payload,
+    sent with ``self.headers``, or a response of their own (a 304).
+    """
+    authentication = ClaimsJWTAuthentication
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # bearer tokens, not cookies: exempt from CSRF like DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request)
+        self.headers = {}
+        try:
+            request.user = await self.authenticate(request)
+            payload = await self.read(request)
+        except Exception as exc:
+            return self.handle_exception(request, exc)
+        if isinstance(payload, HttpResponseBase):
+            return payload
+        return self.render(payload, headers=self.headers)
+
+    async def authenticate(self, request):
+        result = await self.authentication().aauthenticate(request._request)
+        if result is None:
+            raise NotAuthenticated()
+        return result[0]
+
+    async def read(self, request):
+        raise NotImplementedError
+
+    def viewset(self, viewset_class, request, action):
+        """The sync viewset, set up as DRF would for ``action``; only used to build querysets and serializers."""
+        return viewset_class(request=request, format_kwarg=None, action=action, args=(), kwargs={})
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            exc.auth_header = self.authentication().authenticate_header(request)
+        response = exception_handler(exc, {'view': self, 'request': request})
+        if response is None:
+            raise exc
+        headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+        return self.render(response.data, status=response.status_code, headers=headers)
+
+    def render(self, payload, status=200, headers=None):
+        return HttpResponse(JSONRenderer().render(payload), status=status, content_type='application/json',
+                            headers=headers)
+
+
+class MarketView(AsyncReadView):
+    query_budgets = {'get': PlayerViewSet.query_budgets['market']}
+
+    async def read(self, request):
+        version = await market_cache.acurrent_version()
+        etag = etags.market_etag(version, request)
+        not_modified = etags.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        self.headers.update(etags.headers(etag))
+
+        payload = await market_cache.aget_page(version, request)
+        if payload is not None:
+            self.headers['X-Market-Cache'] = 'hit'
+            return payload
+
+        filterset = MarketFilter(request.query_params, queryset=TransferListing.objects.filter(active=True),
+                                 request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        paginator = MarketCursorPagination()
+        page = await paginator.apaginate_queryset(filterset.qs.only('id', 'price', 'created_at'), request, view=self)
+        rows = await market_cache.arender_listings(version, [l.pk for l in page], {'request': request})
+        payload = paginator.get_paginated_response(rows).data
+        await market_cache.aset_page(version, request, payload)
+        self.headers['X-Market-Cache'] = 'miss'
+        return payload
+
+
+class AsyncListView(AsyncReadView):
+    """``list`` of a sync viewset: its filters and paginator, the page fetched through the async ORM."""
+    viewset_class = None
+
+    async def read(self, request):
+        view = self.viewset(self.viewset_class, request, 'list')
+        # filter validation may look up a model choice (?buyer=<id>), so it runs in a thread
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+        paginator = view.paginator
+        if fast_serializers.enabled():
+            fast = view.fast_serializer_class()
+            page = await paginator.apaginate_queryset(fast.values(queryset), request, view=view)
+            return paginator.get_paginated_response(fast.rows(page)).data
+        page = await paginator.apaginate_queryset(queryset, request, view=view)
+        return paginator.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+class PlayerListView(AsyncListView):
+    viewset_class = PlayerViewSet
+    query_budgets = {'get': PlayerViewSet.query_budgets['list']}
+    create_view = staticmethod(PlayerViewSet.as_view({'post': 'create'}))
+
+    async def post(self, request, *args, **kwargs):
+        # creating players stays with the sync viewset
+        return await sync_to_async(self.create_view)(request, *args, **kwargs)
+
+
+class TransactionListView(AsyncListView):
+    viewset_class = TransactionViewSet
+    query_budgets = {'get': TransactionViewSet.query_budgets['list']}
+
+
+class TeamMeView(AsyncReadView):
+    query_budgets = {'get': TeamViewSet.query_budgets['me']}
+
+    async def read(self, request):
+        versioned = await etags.ateam_version(request.user.pk)
+        if versioned is None:
+            raise Http404("No Team matches the given query.")  # get_object_or_404's message
+        team_id, version = versioned
+        etag = etags.team_etag(team_id, version)
+        not_modified = etags.not_modified(request, etag, per_user=True)
+        if not_modified is not None:
+            return not_modified
+        self.headers.update(etags.headers(etag, per_user=True))
+
+        if fast_serializers.enabled():
+            return await self.read_fast(team_id)
+        view = self.viewset(TeamViewSet, request, 'me')
+        try:
+            team = await Team.objects.select_related('user').prefetch_related(SQUAD).aget(pk=team_id)
+        except Team.DoesNotExist:
+            raise Http404("No Team matches the given query.")
+        return view.get_serializer(team).data
+
+    async def read_fast(self, team_id):
+        fast = fast_serializers.FastTeamSerializer()
+        team = await fast.values(Team.objects.filter(pk=team_id)).afirst()
+        if team is None:
+            raise Http404("No Team matches the given query.")
+        squad = [row async for row in fast.squads([team_id])]
+        return fast.rows([team], squad)[0]
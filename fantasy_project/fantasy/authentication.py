@@ -0,0 +1,170 @@
+"""
+Stateless JWT authentication: no user lookup on every request.
+
+Tokens issued by ``auth/login`` carry the user id, their team id and the
+user's auth version (``CacheVersion['auth:<user id>']``). The version is
+bumped whenever the user is deactivated, changes password or username, is
+deleted, or loses their team, which revokes every token issued before.
+
+``ClaimsJWTAuthentication`` checks the token's version against a small
+in-process TTL cache of current versions (one query per user per TTL, per
+process) and hands the view a ``ClaimsUser``: ``pk``/``id``/``team_id`` come
+from the claims and the User row is only loaded when something else is asked
+of it. A revocation takes effect at once in the process that made it and
+within ``AUTH_VERSION_TTL`` seconds everywhere else.
+
+Tokens without the version claim (issued before this scheme) fall back to the
+stock lookup.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import CacheVersion, Team
+
+TEAM_CLAIM = 'team_id'
+VERSION_CLAIM = 'ver'
+
+
+def auth_version_key(user_id):
+    return f"auth:{user_id}"
+
+
+class VersionCache:
+    """user id -> (auth version, expiry), least recently used dropped past ``maxsize``."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        version = self._cached(user_id)
+        if version is None:
+            version = CacheVersion.current(auth_version_key(user_id))
+            self.set(user_id, version)
+        return version
+
+    async def aget(self, user_id):
+        version = self._cached(user_id)
+        if version is None:
+            version = await (CacheVersion.objects.filter(key=auth_version_key(user_id))
+                             .values_list('version', flat=True).afirst()) or 0
+            self.set(user_id, version)
+        return version
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return entry[0]
+        return None
+
+    def set(self, user_id, version):
+        ttl = getattr(settings, 'AUTH_VERSION_TTL', 30)
+        maxsize = getattr(settings, 'AUTH_VERSION_CACHE_SIZE', 10_000)
+        with self._lock:
+            self._entries[user_id] = (version, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_versions = VersionCache()
+
+
+def revoke_tokens(user_id):
+    """Invalidate every token issued to ``user_id`` so far; call inside the transaction making the change."""
+    CacheVersion.bump(auth_version_key(user_id))
+    transaction.on_commit(partial(user_versions.discard, user_id))
+
+
+def _load_user(user_id):
+    try:
+        return get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except get_user_model().DoesNotExist:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+
+
+class ClaimsUser(SimpleLazyObject):
+    """request.user backed by token claims; any attribute other than pk/id/team_id loads the User."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, team_id):
+        super().__init__(partial(_load_user, user_id))
+        # set on the proxy itself: LazyObject.__setattr__ would load the user
+        self.__dict__.update(pk=user_id, id=user_id, team_id=team_id)
+
+    def __bool__(self):
+        # permission checks do `request.user and ...`
+        return True
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        user_id = self.claimed_user_id(validated_token)
+        return self.claims_user(validated_token, user_versions.get(user_id))
+
+    async def aauthenticate(self, request):
+        """authenticate() for the async views: same checks, the version lookup through the async ORM."""
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if VERSION_CLAIM not in validated_token:
+            return await sync_to_async(super().get_user)(validated_token), validated_token
+        version = await user_versions.aget(self.claimed_user_id(validated_token))
+        return self.claims_user(validated_token, version), validated_token
+
+    @staticmethod
+    def claimed_user_id(validated_token):
+        # simplejwt writes the id claim as a string
+        return get_user_model()._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+
+    def claims_user(self, validated_token, current_version):
+        if current_version != validated_token[VERSION_CLAIM]:
+            raise AuthenticationFailed("Token has been revoked.", code="token_revoked")
+        return ClaimsUser(self.claimed_user_id(validated_token), validated_token.get(TEAM_CLAIM))
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[TEAM_CLAIM] = Team.objects.filter(user=user).values_list('pk', flat=True).first()
+        version = CacheVersion.current(auth_version_key(user.pk))
+        user_versions.set(user.pk, version)
+        token[VERSION_CLAIM] = version
+        return token
+
+
+def team_id_of(user):
+    """The requesting user's team id: from the token when it has one, looked up otherwise (None: no team)."""
+    team_id = getattr(user, 'team_id', None)
+    if team_id is None:
+        team_id = Team.objects.filter(user_id=user.pk).values_list('pk', flat=True).first()
+    return team_id
@@ -0,0 +1,69 @@
+"""
+How this worker process gets its database connections, and what it costs.
+
+settings.DATABASES picks one of three modes from the environment: a new
+connection per request, persistent connections (CONN_MAX_AGE, with health
+checks) or psycopg 3's connection pool (OPTIONS['pool']). ``stats()``
+reports per alias:
+
+- ``connects``: connections the process has set up (Django's
+  ``connection_created``; with the pool that fires on every checkout).
+- with the pool: ``checkouts``; ``waited``, the checkouts that found every
+  connection busy and had to queue (the overflow past ``max_size``);
+  ``wait_ms`` spent queueing in total and per checkout; ``timeouts``, the
+  checkouts that gave up after DB_POOL_TIMEOUT; and the pool's size.
+
+Counters are per process: each gunicorn worker answers for itself.
+"""
+import os
+import threading
+from collections import Counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_connects = Counter()
+_lock = threading.Lock()
+
+
+@receiver(connection_created)
+def count_connect(sender, connection, **kwargs):
+    with _lock:
+        _connects[connection.alias] += 1
+
+
+def mode(settings_dict):
+    if settings_dict.get('OPTIONS', {}).get('pool'):
+        return 'pool'
+    # CONN_MAX_AGE None keeps connections for good
+    return 'per-request' if settings_dict.get('CONN_MAX_AGE') == 0 else 'persistent'
+
+
+def alias_stats(connection):
+    entry = {'mode': mode(connection.settings_dict), 'connects': _connects[connection.alias]}
+    if entry['mode'] == 'persistent':
+        entry['max_age'] = connection.settings_dict['CONN_MAX_AGE']
+        entry['health_checks'] = connection.settings_dict.get('CONN_HEALTH_CHECKS', False)
+    elif entry['mode'] == 'pool':
+        pool = connection.pool.get_stats()  # counters only appear once non-zero
+        checkouts = pool.get('requests_num', 0)
+        entry.update({
+            'min_size': pool['pool_min'],
+            'max_size': pool['pool_max'],
+            'size': pool['pool_size'],
+            'idle': pool['pool_available'],
+            'checkouts': checkouts,
+            'waited': pool.get('requests_queued', 0),
+            'waiting_now': pool.get('requests_waiting', 0),
+            'wait_ms': pool.get('requests_wait_ms', 0),
+            'wait_ms_per_checkout': round(pool.get('requests_wait_ms', 0) / checkouts, 3) if checkouts else 0,
+            'timeouts': pool.get('requests_errors', 0),
+            'connections_opened': pool.get('connections_num', 0),
+            'connections_lost': pool.get('connections_lost', 0),
+        })
+    return entry
+
+
+def stats():
+    return {'pid': os.getpid(), 'databases': {alias: alias_stats(connections[alias]) for alias in connections}}
@@ -0,0 +1,149 @@
+"""
+Read replicas, with read-your-writes.
+
+``ReplicaRouter`` sends reads to one of settings.DATABASE_REPLICAS and the
+rest to ``default``. Writes, and ``select_for_update()`` (which Django
+routes as a write), always go to ``default``. So does every read:
+
+- made outside a request (management commands, the matching engine, the
+  outbox worker), where reads are followed by the writes they decide;
+- of a request that is not a GET, HEAD or OPTIONS;
+- made inside a transaction on ``default``, which must see its own writes;
+- of a user who wrote within the last READ_YOUR_WRITES_SECONDS.
+
+``ReadReplicaMiddleware`` (fantasy/middleware.py) hands the router each
+request and picks its replica, one per request so its reads agree with
+each other, including those of a streamed body (the /export/ endpoints),
+read after the view has returned. A write by an authenticated user (an unsafe request that did
+not fail) pins that user to ``default`` for READ_YOUR_WRITES_SECONDS, to
+cover replication lag: a buy, a listing or a cancellation shows up in
+their next reads. Pins are kept in the cache. With several workers, set
+REDIS_URL so all of them see a pin.
+
+With no replicas configured every query goes to ``default``.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from .authentication import ClaimsUser
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_route = ContextVar('fantasy_db_route', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_key(user_id):
+    return f"db:pin:{user_id}"
+
+
+def user_id(request):
+    """The request's user id once authentication has set it; None before, without setting it off."""
+    user = request.__dict__.get('user')
+    if isinstance(user, ClaimsUser):
+        return user.__dict__['pk']  # from the token's claims; the User row stays unloaded
+    if isinstance(user, SimpleLazyObject):
+        # evaluating it would run the session's user lookup, which would come back here to be routed
+        user = None if user._wrapped is empty else user._wrapped
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def pin(user_id):
+    """Read ``user_id``'s next READ_YOUR_WRITES_SECONDS of requests from the primary."""
+    cache.set(pin_key(user_id), True, getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5))
+
+
+class Route:
+    """Where one request's reads may go."""
+
+    def __init__(self, request):
+        self.request = request
+        self.replica = random.choice(replicas()) if replicas() and request.method in SAFE_METHODS else None
+        self.pinned = None  # looked up once the user is known
+
+    def read_alias(self):
+        if self.replica is None:
+            return DEFAULT_DB_ALIAS
+        if self.pinned is None:
+            pk = user_id(self.request)
+            if pk is not None:
+                self.pinned = bool(cache.get(pin_key(pk)))
+        return DEFAULT_DB_ALIAS if self.pinned else self.replica
+
+
+def enter(request):
+    """Route ``request``'s queries until ``leave(token)``."""
+    return _route.set(Route(request))
+
+
+def leave(token):
+    _route.reset(token)
+
+
+def routed(content, is_async):
+    """
+    A streaming response's ``content`` read under the current request's
+    route, chunk by chunk: its body is iterated after the middleware is done.
+    """
+    route = _route.get()
+    if is_async:
+        async def content_routed():
+            iterator = aiter(content)
+            try:
+                while True:
+                    token = _route.set(route)
+                    try:
+                        chunk = await anext(iterator, None)
+                    finally:
+                        _route.reset(token)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                if hasattr(iterator, 'aclose'):
+                    await iterator.aclose()
+        return content_routed()
+
+    def content_routed():
+        iterator = iter(content)
+        try:
+            while True:
+                token = _route.set(route)
+                try:
+                    chunk = next(iterator, None)
+                finally:
+                    _route.reset(token)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+    return content_routed()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        route = _route.get()
+        if route is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return route.read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema by replication
+        return False if db in replicas() else None
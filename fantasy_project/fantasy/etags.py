@@ -0,0 +1,68 @@
+"""
+Conditional GETs for the endpoints clients poll: teams/me and the market.
+
+Their strong ETags are built from version markers (CacheVersion) that
+writers bump in the same transaction as every change to what the endpoint
+shows: ``team:<id>`` on buys, sales, listings, cancellations and edits of
+the team or its players; ``market`` on every market change. A matching
+``If-None-Match`` is answered 304 after the one version lookup: no page
+cache, no serializers, no player queries.
+
+The version is read before the data. A write landing in between gives a
+response newer than its ETag, which costs one extra full response; the
+reverse, an ETag newer than its response, cannot happen.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.utils.cache import get_conditional_response
+
+from .models import CacheVersion, Team
+
+
+def _team_version(user_id):
+    # (team id, team version) in one query; the key is models.team_version_key()
+    key = Concat(Value('team:'), Cast(OuterRef('pk'), CharField()))
+    version = CacheVersion.objects.filter(key=key).values('version')[:1]
+    return Team.objects.filter(user_id=user_id).annotate(
+        version=Coalesce(Subquery(version), Value(0))).values_list('pk', 'version')
+
+
+def team_version(user_id):
+    """``(team_id, version)`` of the user's team, or None without one."""
+    return _team_version(user_id).first()
+
+
+async def ateam_version(user_id):
+    return await _team_version(user_id).afirst()
+
+
+def team_etag(team_id, version, output='json'):
+    # the renderer is part of it: the browsable API's HTML is not the JSON
+    return f'"team-{team_id}-{version}.{output}"'
+
+
+def market_etag(version, request, output='json'):
+    # a page is the market version plus the URL it was asked for: its filters, cursor and links
+    params = urlencode(sorted((k, v) for k, values in request.query_params.lists() for v in values))
+    digest = hashlib.md5(f"{request.get_host()}{request.path}?{params}".encode()).hexdigest()[:16]
+    return f'"market-{version}-{digest}.{output}"'
+
+
+def headers(etag, per_user=False):
+    """The ETag and the caching headers that make clients revalidate it on every poll."""
+    result = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if per_user:
+        result['Vary'] = 'Authorization'
+    return result
+
+
+def not_modified(request, etag, per_user=False):
+    """A 304 when ``request``'s If-None-Match has ``etag``; None when the full response is needed."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        for name, value in headers(etag, per_user).items():
+            response[name] = value
+    return response
@@ -0,0 +1,143 @@
+"""
+Streaming exports of the players, listings and transactions tables.
+
+Each export is a flat row per record, as NDJSON (one JSON object per line)
+or CSV with a header. ``stream`` reads the filtered queryset through
+``.values().iterator(chunk_size)``, a server-side cursor on PostgreSQL, and
+yields one chunk of formatted rows at a time: a worker holds ``chunk_size``
+rows, however large the table. The API's ``export`` actions wrap it in a
+StreamingHttpResponse; ``manage.py export`` writes it to a file.
+
+Under ASGI the response streams ``astream``, the same chunks fetched one at
+a time through ``sync_to_async``: given a sync iterator, Django's ASGI
+handler would read the whole export into a list before sending any of it.
+"""
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .fast_serializers import datetime_formatter, decimal, team_label
+from .models import Player, TeamTransaction, TransactionHistory, TransferListing
+
+OUTPUTS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+class Export:
+    """A table's flat rows: ``header`` names what ``row(values)`` returns, from the ``columns`` lookups."""
+    name = None
+    model = None
+    header = ()
+    columns = ()
+
+    def __init__(self):
+        self.datetime = datetime_formatter()
+
+    def queryset(self, params=None):
+        # every row, primary key order; the endpoint's filters, ``params``, narrow it down
+        return self.model.objects.order_by('pk')
+
+    def row(self, values):
+        raise NotImplementedError
+
+
+class PlayerExport(Export):
+    name = 'players'
+    model = Player
+    header = ('id', 'name', 'position', 'owner_id', 'owner', 'value', 'created_at')
+    columns = ('id', 'name', 'position', 'owner_id', 'owner__name', 'owner__user__username', 'value', 'created_at')
+
+    def row(self, v):
+        return (v['id'], v['name'], v['position'], v['owner_id'],
+                team_label(v['owner__name'], v['owner__user__username']), decimal(v['value']),
+                self.datetime(v['created_at']))
+
+
+class ListingExport(Export):
+    name = 'listings'
+    model = TransferListing
+    header = ('id', 'player_id', 'player', 'position', 'price', 'seller_id', 'seller', 'created_at', 'active')
+    columns = ('id', 'player_id', 'player__name', 'player__position', 'price', 'seller_id', 'seller__name',
+               'seller__user__username', 'created_at', 'active')
+
+    def row(self, v):
+        return (v['id'], v['player_id'], v['player__name'], v['player__position'], decimal(v['price']),
+                v['seller_id'], team_label(v['seller__name'], v['seller__user__username']),
+                self.datetime(v['created_at']), v['active'])
+
+
+class TransactionExport(Export):
+    name = 'transactions'
+    model = TransactionHistory
+    header = ('id', 'buyer_id', 'buyer', 'seller_id', 'seller', 'player_id', 'player', 'amount', 'created_at',
+              'active')
+    columns = ('id', 'buyer_id', 'buyer__name', 'buyer__user__username', 'seller_id', 'seller__name',
+               'seller__user__username', 'player_id', 'player__name', 'amount', 'created_at', 'active')
+
+    def row(self, v):
+        return (v['id'], v['buyer_id'], team_label(v['buyer__name'], v['buyer__user__username']),
+                v['seller_id'], team_label(v['seller__name'], v['seller__user__username']),
+                v['player_id'], v['player__name'], decimal(v['amount']), self.datetime(v['created_at']), v['active'])
+
+    def queryset(self, params=None):
+        # ?team= is one team's side of each deal (TransactionFilter.filter_team)
+        model = TeamTransaction if params and params.get('team') else self.model
+        return model.objects.order_by('pk')
+
+
+EXPORTS = {export.name: export for export in (PlayerExport, ListingExport, TransactionExport)}
+
+
+class Lines(list):
+    """A file csv.writer can write to, holding the lines until they are sent."""
+    write = list.append
+
+
+def stream(export, queryset, output, size=None):
+    """``queryset``'s rows in ``output`` format, as text chunks of ``size`` rows (EXPORT_CHUNK_SIZE)."""
+    size = size or chunk_size()
+    lines = Lines()
+    if output == 'csv':
+        writer = csv.writer(lines)
+        writer.writerow(export.header)
+        write = writer.writerow
+    else:
+        header = export.header
+        encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+        def write(row):
+            lines.append(encode(dict(zip(header, row))) + '\n')
+
+    for count, values in enumerate(queryset.values(*export.columns).iterator(chunk_size=size), 1):
+        write(export.row(values))
+        if count % size == 0:
+            yield ''.join(lines)
+            lines.clear()
+    if lines:
+        yield ''.join(lines)
+
+
+async def astream(export, queryset, output, size=None):
+    """``stream()`` for the ASGI handler: each chunk is read on the thread the request's queries run on."""
+    chunks = stream(export, queryset, output, size)
+    fetch = sync_to_async(next)
+    try:
+        while (chunk := await fetch(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # the server-side cursor is closed on its connection's thread too
+        await sync_to_async(chunks.close)()
+
+
+def response(export, queryset, output, asynchronous=False):
+    """A StreamingHttpResponse downloading the export as ``<name>.<output>``; ``asynchronous`` under ASGI."""
+    content = (astream if asynchronous else stream)(export, queryset, output)
+    streaming = StreamingHttpResponse(content, content_type=OUTPUTS[output])
+    streaming['Content-Disposition'] = f'attachment; filename="{export.name}.{output}"'
+    return streaming
@@ -0,0 +1,133 @@
+"""
+Flat serializers for the hot read paths, built from ``.values()`` rows.
+
+PlayerSerializer, TransactionSerializer and TeamSerializer build a model
+instance per row, then run DRF's field machinery over it; their
+StringRelatedFields call ``Team.__str__``, which needs the team's user. With
+``settings.FAST_SERIALIZERS`` on, the players, transactions and teams lists
+and teams/me fetch just the columns they show, related names joined in,
+and format them here.
+
+The JSON is byte for byte what the DRF serializers produce (fantasy/tests.py
+compares the two), so a change to one of those serializers must be made here
+too. ``python -m benchmarks serializers`` times both per row.
+"""
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+
+from .models import Player
+
+PLAYER_COLUMNS = ('id', 'name', 'position', 'owner__name', 'owner__user__username', 'value', 'created_at')
+
+
+def enabled():
+    return getattr(settings, 'FAST_SERIALIZERS', False)
+
+
+def team_label(name, username):
+    # Team.__str__, from joined columns; None for a missing team like StringRelatedField
+    return None if name is None else f"{name} ({username})"
+
+
+def decimal(value):
+    # DecimalField(decimal_places=2) on numeric(20, 2) columns: already quantized, just formatted
+    return format(value, 'f')
+
+
+def datetime_formatter():
+    """DateTimeField.to_representation, with the format and timezone settings looked up once."""
+    if not settings.USE_TZ or api_settings.DATETIME_FORMAT is None or api_settings.DATETIME_FORMAT.lower() != ISO_8601:
+        return serializers.DateTimeField().to_representation
+    tz = timezone.get_current_timezone()
+
+    def iso_8601(value):
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return iso_8601
+
+
+class FastSerializer:
+    """``values(queryset)`` narrows a viewset's queryset to the columns ``rows(values)`` renders."""
+    columns = ()
+
+    def __init__(self):
+        self.datetime = datetime_formatter()
+
+    def values(self, queryset):
+        # prefetches are for model instances; the rows join what they need
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def rows(self, values):
+        raise NotImplementedError
+
+    def player(self, row, columns):
+        """PlayerSerializer's dict for the player in ``columns`` (PLAYER_COLUMNS, maybe prefixed); None if unset."""
+        pk, name, position, owner_name, owner_username, value, created_at = columns
+        if row[pk] is None:
+            return None
+        return {'id': row[pk], 'name': row[name], 'position': row[position],
+                'owner': team_label(row[owner_name], row[owner_username]),
+                'value': decimal(row[value]), 'created_at': self.datetime(row[created_at])}
+
+
+class FastPlayerSerializer(FastSerializer):
+    """PlayerSerializer."""
+    columns = PLAYER_COLUMNS
+
+    def rows(self, values):
+        return [self.player(row, PLAYER_COLUMNS) for row in values]
+
+
+class FastTransactionSerializer(FastSerializer):
+    """TransactionSerializer."""
+    player_columns = tuple(f'player__{column}' for column in PLAYER_COLUMNS)
+    columns = ('id', 'buyer__name', 'buyer__user__username', 'seller__name', 'seller__user__username',
+               *player_columns, 'amount', 'created_at', 'active')
+
+    def rows(self, values):
+        return [{
+            'id': row['id'],
+            'buyer': team_label(row['buyer__name'], row['buyer__user__username']),
+            'seller': team_label(row['seller__name'], row['seller__user__username']),
+            'player': self.player(row, self.player_columns),
+            'amount': decimal(row['amount']),
+            'created_at': self.datetime(row['created_at']),
+            'active': row['active'],
+        } for row in values]
+
+
+class FastTeamSerializer(FastSerializer):
+    """
+    TeamSerializer. The squads take a second query, like the prefetch does:
+    ``rows(teams)`` runs it, async callers fetch ``squads(team_ids)``
+    themselves and pass the rows in.
+    """
+    columns = ('id', 'name', 'user__username', 'capital', 'created_at', 'squad_value')
+    squad_columns = ('owner_id', 'id', 'name', 'position', 'value', 'created_at')
+
+    def squads(self, team_ids):
+        # in id order, like views.SQUAD
+        return Player.objects.filter(owner_id__in=team_ids).order_by('pk').values(*self.squad_columns)
+
+    def rows(self, values, squads=None):
+        teams = list(values)
+        if squads is None:
+            squads = self.squads([team['id'] for team in teams]) if teams else ()
+        labels = {team['id']: team_label(team['name'], team['user__username']) for team in teams}
+        players = {team_id: [] for team_id in labels}
+        for row in squads:
+            players[row['owner_id']].append({
+                'id': row['id'], 'name': row['name'], 'position': row['position'], 'owner': labels[row['owner_id']],
+                'value': decimal(row['value']), 'created_at': self.datetime(row['created_at']),
+            })
+        return [{
+            'id': team['id'],
+            'name': team['name'],
+            'user': team['user__username'],
+            'capital': decimal(team['capital']),
+            'players': players[team['id']],
+            'created_at': self.datetime(team['created_at']),
+            'total_value': decimal(team['squad_value'] + team['capital']),  # Team.total_value
+        } for team in teams]
@@ -0,0 +1,117 @@
+"""
+Idempotency-Key for the POSTs mobile clients retry on timeouts: buying a
+listing or a batch, listing a player and creating a team.
+
+A keyed request runs in one transaction. It first claims (user, key) with
+``INSERT ... ON CONFLICT`` and last stores its response in the claimed
+row, so the work and the stored response commit together or not at all.
+A retry of a committed request finds the row and gets the stored response
+back, marked ``Idempotent-Replayed: true``; no listing, player or team is
+locked or even read. A duplicate arriving while the first still runs
+blocks in its INSERT on the first's uncommitted row, taking no other lock,
+and then replays the first's response, or runs itself if the first rolled
+back.
+
+The responses a view returns are stored, including a refused purchase's
+4xx. A request that raises, with a validation error or a server error,
+rolls its key back with everything else, and a retry runs again. A key
+reused for a different request (method, path or body) is answered 422.
+Keys live IDEMPOTENCY_KEY_TTL seconds: an expired key is claimed afresh,
+and ``manage.py purge_idempotency_keys`` deletes them.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .middleware import extend_query_budget
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+
+def fingerprint(request):
+    """SHA-256 of the request's method, path and body: what a retry must repeat exactly."""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.digest()
+
+
+def claim(user_id, key, digest):
+    """
+    Claim ``key`` for ``user_id`` in the current transaction: ``(pk, None)``
+    when the request is to run, ``(None, stored)`` when a committed request
+    holds it. Waits while a concurrent request holds it.
+    """
+    quote = connection.ops.quote_name
+    table = quote(IdempotencyKey._meta.db_table)
+    user, key_, created_at = quote('user_id'), quote('key'), quote('created_at')
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        # an expired key is taken over in place: reset, it belongs to this request
+        cursor.execute(
+            f"INSERT INTO {table} ({user}, {key_}, fingerprint, {created_at}) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT ({user}, {key_}) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, "
+            f"{created_at} = EXCLUDED.{created_at}, status_code = NULL, response = NULL "
+            f"WHERE {table}.{created_at} < %s RETURNING id",
+            [user_id, key, digest, now, now - ttl()])
+        row = cursor.fetchone()
+    if row is not None:
+        return row[0], None
+    return None, IdempotencyKey.objects.get(user_id=user_id, key=key)
+
+
+def replay(stored, digest):
+    if bytes(stored.fingerprint) != digest:
+        return Response({'detail': f"This {HEADER} was used for a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(json.loads(stored.response), status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """Honour the Idempotency-Key header on a viewset action (see the module docstring)."""
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return view(self, request, *args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: [f"Must be 1 to {MAX_KEY_LENGTH} characters."]})
+        digest = fingerprint(request)
+        extend_query_budget(request, 2)  # the claim and the stored response
+        with transaction.atomic():
+            pk, stored = claim(request.user.pk, key, digest)
+            if stored is not None:
+                return replay(stored, digest)
+            response = view(self, request, *args, **kwargs)
+            IdempotencyKey.objects.filter(pk=pk).update(status_code=response.status_code,
+                                                        response=json.dumps(response.data, cls=JSONEncoder))
+        return response
+    return wrapper
+
+
+def purge(batch_size=10_000):
+    """Delete the expired keys, ``batch_size`` per statement; returns how many."""
+    purged = 0
+    while True:
+        cutoff = timezone.now() - ttl()
+        expired = IdempotencyKey.objects.filter(created_at__lt=cutoff).values('pk')[:batch_size]
+        # checked again on the row itself: a key claimed afresh while the DELETE waited on its lock
+        # still matches the subquery's snapshot, but belongs to a running request now
+        deleted, _ = IdempotencyKey.objects.filter(pk__in=expired, created_at__lt=cutoff).delete()
+        purged += deleted
+        if deleted < batch_size:
+            return purged
@@ -0,0 +1,113 @@
+"""
+Team rankings by total value (capital plus squad value).
+
+Ranks are read from a Fenwick tree of team counts per value bucket, kept in
+LeaderboardNode rows by statement-level triggers on the team table
+(migration 0008). Every INSERT, UPDATE and DELETE of teams nets the buckets
+its rows left and entered, then adds the difference along the tree, in the
+same transaction. That covers buys, order-book fills, drafting, revaluation,
+admin edits and deletes, whichever code wrote the rows. The nodes are
+upserted highest first. The root is in every update, so the first lock a
+writer takes is the root's, and two writers cannot deadlock on the tree.
+
+Buckets split values the way floats do: one per cent below 256 cents, then
+128 per power of two, so a bucket is under 1% of its values wide.
+``bucket()`` here and ``fantasy_leaderboard_bucket()`` in the database must
+agree.
+
+A team's rank is 1, plus the teams in higher buckets, plus the teams in its
+own bucket that are worth more. The higher buckets are the root's count less
+a prefix sum of at most 13 nodes. The own-bucket count is a range scan of
+team_total_value_idx. Teams with equal totals share a rank; the top list
+breaks ties by id.
+"""
+from decimal import Decimal
+
+from django.db.models import F
+
+from .fast_serializers import decimal
+from .models import LeaderboardNode, Team
+
+MANTISSA_BITS = 7
+SIZE = 2 ** 13  # buckets, enough for totals up to 2**63 cents
+MAX_CENTS = 2 ** 63 - 1
+TOTAL = F('capital') + F('squad_value')  # Team.total_value
+COLUMNS = ('pk', 'name', 'user__username', 'total')
+
+
+def cents(total):
+    return min(max(int(total * 100), 0), MAX_CENTS)
+
+
+def bucket(value):
+    """The bucket, 0 to SIZE - 1, of a total value in cents."""
+    if value < 2 ** (MANTISSA_BITS + 1):
+        return value
+    shift = value.bit_length() - 1 - MANTISSA_BITS
+    return (shift << MANTISSA_BITS) + (value >> shift)
+
+
+def bounds(b):
+    """The lowest and highest total value in cents of bucket ``b``."""
+    if b < 2 ** (MANTISSA_BITS + 1):
+        return b, b
+    shift = (b >> MANTISSA_BITS) - 1
+    mantissa = b - (shift << MANTISSA_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+def prefix_nodes(b):
+    """The tree nodes whose counts add up to the teams in buckets 0 to ``b``."""
+    nodes, i = [], b + 1
+    while i > 0:
+        nodes.append(i)
+        i -= i & -i
+    return nodes
+
+
+def entry(rank, row):
+    pk, name, username, total = row
+    return {'rank': rank, 'id': pk, 'name': name, 'user': username, 'total_value': decimal(total)}
+
+
+def team_count():
+    # the root node counts every team
+    return LeaderboardNode.objects.filter(node=SIZE).values_list('teams', flat=True).first() or 0
+
+
+def top(limit):
+    """The ``limit`` most valuable teams, highest first, ranked."""
+    rows = Team.objects.annotate(total=TOTAL).order_by('-total', 'pk').values_list(*COLUMNS)[:limit]
+    ranked, rank, previous = [], 0, None
+    for position, row in enumerate(rows, 1):
+        if row[-1] != previous:
+            rank, previous = position, row[-1]
+        ranked.append(entry(rank, row))
+    return ranked
+
+
+def standing(team_id):
+    """``(entry, teams)``: the team's rank among all ``teams``; None when there is no such team."""
+    row = Team.objects.filter(pk=team_id).annotate(total=TOTAL).values_list(*COLUMNS).first()
+    if row is None:
+        return None
+    total = row[-1]
+    b = bucket(cents(total))
+    path = prefix_nodes(b)
+    counts = dict(LeaderboardNode.objects.filter(node__in=[*path, SIZE]).values_list('node', 'teams'))
+    teams = counts.get(SIZE, 0)
+    higher = teams - sum(counts.get(node, 0) for node in path)
+    same_bucket = (Team.objects.alias(total=TOTAL)
+                   .filter(total__gt=total, total__lte=Decimal(bounds(b)[1]).scaleb(-2)).count())
+    return entry(1 + higher + same_bucket, row), teams
+
+
+def expected_nodes():
+    """``{node: teams}`` as the team table says the tree should be, for verifying it."""
+    nodes = {}
+    for total in Team.objects.annotate(total=TOTAL).values_list('total', flat=True).iterator():
+        i = bucket(cents(total)) + 1
+        while i <= SIZE:
+            nodes[i] = nodes.get(i, 0) + 1
+            i += i & -i
+    return nodes
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from fantasy import archive
+
+
+class Command(BaseCommand):
+    help = ("Move settled transactions older than TRANSACTION_ARCHIVE_DAYS from the hot table to the archive, a "
+            "batch per transaction, then VACUUM the hot table. Safe to run while the market trades, and to "
+            "re-run after an interruption: it carries on with what is left.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive transactions older than this many days "
+                                                     "(default: TRANSACTION_ARCHIVE_DAYS).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per transaction (default: 5000).")
+        parser.add_argument('--no-vacuum', action='store_true', help="Leave the hot table to autovacuum.")
+
+    def handle(self, *args, days=None, batch_size=5000, no_vacuum=False, **options):
+        if days is not None and days < 0:
+            raise CommandError("--days must be >= 0.")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be >= 1.")
+        before = timezone.now() - (archive.max_age() if days is None else timedelta(days=days))
+        started = time.monotonic()
+
+        def progress(moved):
+            self.stdout.write(f"archived {moved} ({time.monotonic() - started:.1f}s)")
+
+        moved = archive.archive(before, batch_size, progress)
+        if moved and not no_vacuum:
+            archive.vacuum()
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} transactions created before {before:%Y-%m-%d %H:%M}."))
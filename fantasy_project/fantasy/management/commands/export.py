@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+from fantasy.exports import EXPORTS, OUTPUTS, stream
+from fantasy.views import ListingFilter, PlayerFilter, TransactionFilter
+
+# the filters of each table's /export/ endpoint
+FILTERS = {'players': PlayerFilter, 'listings': ListingFilter, 'transactions': TransactionFilter}
+
+
+class Command(BaseCommand):
+    help = ("Stream a whole table (players, listings or transactions) as NDJSON or CSV, the rows the "
+            "/export/ endpoints send, without holding more than a chunk of them in memory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(EXPORTS))
+        parser.add_argument('--output', choices=sorted(OUTPUTS), default='ndjson', help="Format (default: ndjson).")
+        parser.add_argument('--filter', action='append', default=[], dest='filters', metavar='NAME=VALUE',
+                            help="The endpoint's query filters, e.g. --filter position=MID (repeatable).")
+        parser.add_argument('--file', help="Write here instead of stdout.")
+        parser.add_argument('--chunk-size', type=int, help="Rows per fetch and write (default: EXPORT_CHUNK_SIZE).")
+
+    def handle(self, *args, table, output, filters, file=None, chunk_size=None, **options):
+        if chunk_size is not None and chunk_size < 1:
+            raise CommandError("--chunk-size must be >= 1.")
+        params = QueryDict(mutable=True)
+        for item in filters:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"--filter takes NAME=VALUE, got {item!r}.")
+            params.appendlist(name, value)
+
+        export = EXPORTS[table]()
+        filterset = FILTERS[table](params, queryset=export.queryset(params))
+        if not filterset.is_valid():
+            raise CommandError(f"Invalid filters: {dict(filterset.errors)}")
+        chunks = stream(export, filterset.qs, output, chunk_size)
+        if file is None:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(file, 'w', encoding='utf-8', newline='') as out:
+            for chunk in chunks:
+                out.write(chunk)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from fantasy.idempotency import purge
+
+
+class Command(BaseCommand):
+    help = "Delete the Idempotency-Keys older than IDEMPOTENCY_KEY_TTL, in batches; run it from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10_000, help="Keys per DELETE (default: 10000).")
+
+    def handle(self, *args, batch_size=10_000, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be >= 1.")
+        self.stdout.write(self.style.SUCCESS(f"Purged {purge(batch_size)} expired idempotency key(s)."))
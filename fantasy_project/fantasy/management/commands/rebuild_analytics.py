@@ -0,0 +1,58 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from fantasy import analytics
+from fantasy.models import TransactionHistory
+
+
+def day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Not a YYYY-MM-DD date: {value!r}.")
+
+
+class Command(BaseCommand):
+    help = ("Recompute the market analytics rollups from the transaction history, a chunk of days per "
+            "transaction, or verify them with --verify. Safe to run, and to re-run from --since, while "
+            "the market trades.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=day, help="First day, YYYY-MM-DD (default: the first trade's).")
+        parser.add_argument('--until', type=day, help="Last day, YYYY-MM-DD (default: today).")
+        parser.add_argument('--days-per-chunk', type=int, default=7, help="Days per transaction (default: 7).")
+        parser.add_argument('--verify', action='store_true',
+                            help="Only report rollup rows the history disagrees with; exit non-zero if any.")
+
+    def handle(self, *args, since=None, until=None, days_per_chunk=7, verify=False, **options):
+        if days_per_chunk < 1:
+            raise CommandError("--days-per-chunk must be >= 1.")
+        until = until or timezone.localdate()
+        if since is None:
+            first = TransactionHistory.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            since = timezone.localdate(first) if first is not None else until
+        if since > until:
+            raise CommandError("--since must not be after --until.")
+
+        if verify:
+            return self.verify(since, until)
+
+        started = time.monotonic()
+
+        def progress(done):
+            # a failed run resumes with --since the day after the last one reported
+            self.stdout.write(f"rebuilt {since} to {done} ({time.monotonic() - started:.1f}s)")
+
+        analytics.rebuild(since, until, days_per_chunk, progress)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the analytics of {since} to {until}."))
+
+    def verify(self, since, until):
+        drifted = analytics.drift(since, until)
+        for model, d, key, stored, counted in drifted:
+            self.stdout.write(f"{model.__name__} {d} {key}: stored {stored}, counted {counted}")
+        if drifted:
+            raise CommandError(f"{len(drifted)} rollup row(s) disagree with the history; run rebuild_analytics.")
+        self.stdout.write(self.style.SUCCESS(f"The analytics of {since} to {until} match the history."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from fantasy.leaderboard import expected_nodes, team_count
+from fantasy.models import LeaderboardNode
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the leaderboard tree from the teams' total values, or verify it with --verify. The team "
+            "table's triggers keep it current; this is for restores made with triggers disabled.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Only report tree nodes with a wrong count; exit non-zero if any.")
+
+    def handle(self, *args, verify=False, **options):
+        if verify:
+            return self.verify()
+        with transaction.atomic(), connection.cursor() as cursor:
+            # no team total moves while the tree is rebuilt from them
+            cursor.execute("LOCK TABLE fantasy_team IN SHARE MODE")
+            LeaderboardNode.objects.all().delete()
+            cursor.execute("SELECT fantasy_leaderboard_apply(ARRAY(SELECT fantasy_leaderboard_bucket("
+                           "capital + squad_value) FROM fantasy_team), '{}')")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the leaderboard of {team_count()} team(s)."))
+
+    def verify(self):
+        expected = expected_nodes()
+        stored = dict(LeaderboardNode.objects.exclude(teams=0).values_list('node', 'teams'))
+        wrong = sorted(node for node in expected.keys() | stored.keys() if expected.get(node) != stored.get(node))
+        for node in wrong:
+            self.stdout.write(f"node {node}: stored {stored.get(node, 0)}, actual {expected.get(node, 0)}")
+        if wrong:
+            raise CommandError(f"{len(wrong)} leaderboard node(s) are wrong; run rebuild_leaderboard.")
+        self.stdout.write(self.style.SUCCESS("The leaderboard is consistent."))
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum, Value, F
+from django.db.models.functions import Coalesce
+
+from fantasy.models import CacheVersion, Team, Player, team_version_keys
+
+
+def squad_value_subquery():
+    totals = (Player.objects.filter(owner=OuterRef('pk')).order_by()
+              .values('owner').annotate(total=Sum('value')).values('total'))
+    return Coalesce(Subquery(totals), Value(Decimal('0.00')))
+
+
+class Command(BaseCommand):
+    help = "Recompute Team.squad_value from the players table, or verify it with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Only report teams whose stored value is wrong; exit non-zero if any.")
+        parser.add_argument('--team', type=int, action='append', dest='team_ids',
+                            help="Restrict to this team id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Teams per UPDATE when rebuilding (default: 1000).")
+
+    def handle(self, *args, verify=False, team_ids=None, batch_size=1000, **options):
+        teams = Team.objects.order_by('pk')
+        if team_ids:
+            teams = teams.filter(pk__in=team_ids)
+
+        if verify:
+            return self.verify(teams)
+
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            # walk the teams by primary key so each batch is a short transaction
+            batch = list(teams.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                # the teams whose total_value changes: their teams/me ETag must too
+                drifted = list(Team.objects.filter(pk__in=batch).annotate(actual=squad_value_subquery())
+                               .exclude(squad_value=F('actual')).values_list('pk', flat=True))
+                rebuilt += Team.objects.filter(pk__in=batch).update(squad_value=squad_value_subquery())
+                if drifted:
+                    CacheVersion.bump(*team_version_keys(drifted))
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt squad value for {rebuilt} team(s)."))
+
+    def verify(self, teams):
+        drifted = (teams.annotate(actual=squad_value_subquery())
+                   .exclude(squad_value=F('actual'))
+                   .values_list('pk', 'squad_value', 'actual'))
+        count = 0
+        for pk, stored, actual in drifted.iterator():
+            count += 1
+            self.stdout.write(f"team {pk}: stored {stored}, actual {actual}")
+        if count:
+            raise CommandError(f"{count} team(s) have a stale squad value; run rebuild_team_values.")
+        self.stdout.write(self.style.SUCCESS("All team squad values are consistent."))
@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fantasy.revaluation import Revaluation
+
+
+class Command(BaseCommand):
+    help = ("Revalue every player from the market: recent sale prices and demand per position. Players are "
+            "walked in chunks, one transaction each, with their teams' squad values kept in step.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=float, default=30,
+                            help="Transactions this recent make the market (default: 30).")
+        parser.add_argument('--anchor', type=float, default=0.5,
+                            help="How far a sold player moves toward their last sale price, 0-1 (default: 0.5).")
+        parser.add_argument('--sensitivity', type=float, default=0.25,
+                            help="How strongly a position's demand scales its values (default: 0.25).")
+        parser.add_argument('--max-change', type=float, default=0.2,
+                            help="Largest move of any value in one run, as a fraction (default: 0.2).")
+        parser.add_argument('--chunk-size', type=int, default=20_000, help="Players per transaction.")
+
+    def handle(self, *args, window_days=30, anchor=0.5, sensitivity=0.25, max_change=0.2, chunk_size=20_000,
+               **options):
+        try:
+            revaluation = Revaluation(window=timedelta(days=window_days), anchor=anchor, sensitivity=sensitivity,
+                                      max_change=max_change, chunk_size=chunk_size)
+        except ValueError as e:
+            raise CommandError(str(e))
+        started = time.monotonic()
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats['players']} players, {stats['changed']} changed "
+                                  f"({time.monotonic() - started:.1f}s)")
+
+        stats = revaluation.run(progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Revalued {stats['players']} player(s): {stats['changed']} changed across {stats['teams']} team "
+            f"update(s), from {stats['trades']} recent trade(s) ({time.monotonic() - started:.1f}s)."))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from fantasy.matching import MatchingEngine
+
+# pg_advisory_lock key: "FANT" in ASCII; only one engine may own the book
+ENGINE_LOCK = 0x46414E54
+
+
+class Command(BaseCommand):
+    help = ("Run the order-book matching engine: rebuild the book from open orders, then keep matching "
+            "new ones and settling the fills in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Match what is open now and exit.")
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help="Seconds to sleep when a poll found nothing to do (default: 0.5).")
+        parser.add_argument('--batch-size', type=int, default=500, help="Fills per settlement transaction.")
+
+    def handle(self, *args, once=False, interval=0.5, batch_size=500, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be >= 1.")
+        self.lock(True)
+        engine = MatchingEngine(batch_size=batch_size)
+        try:
+            started = time.monotonic()
+            settled = engine.poll()
+            self.stdout.write(f"book rebuilt: {len(engine.book)} resting orders, {settled} fills settled "
+                              f"({time.monotonic() - started:.1f}s)")
+            while not once:
+                settled = engine.poll()
+                if settled:
+                    self.stdout.write(f"{settled} fills settled; book {len(engine.book)}, totals {dict(engine.stats)}")
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.lock(False)
+        self.stdout.write(self.style.SUCCESS(f"Matching stopped: {dict(engine.stats)}"))
+
+    def lock(self, acquire):
+        # two engines with their own books would match the same orders twice over
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            if not acquire:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [ENGINE_LOCK])
+                return
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [ENGINE_LOCK])
+            if not cursor.fetchone()[0]:
+                raise CommandError("Another run_matching process is already running.")
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fantasy.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = ("Drain the outbox: claim due messages in batches (SELECT ... FOR UPDATE SKIP LOCKED, so run as many "
+            "workers as needed), run their topic's handlers and retry failures with exponential backoff.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Handle what is due now and exit.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep when a poll found nothing to do (default: 1).")
+        parser.add_argument('--batch-size', type=int, default=100, help="Messages per transaction (default: 100).")
+        parser.add_argument('--max-attempts', type=int, default=10,
+                            help="Attempts before a message is given up on (default: 10).")
+        parser.add_argument('--backoff', type=float, default=1.0,
+                            help="Seconds before the first retry, doubled for each one after (default: 1).")
+        parser.add_argument('--max-backoff', type=float, default=600.0,
+                            help="Longest wait between two attempts, in seconds (default: 600).")
+
+    def handle(self, *args, once=False, interval=1.0, batch_size=100, max_attempts=10, backoff=1.0,
+               max_backoff=600.0, **options):
+        if batch_size < 1 or max_attempts < 1:
+            raise CommandError("--batch-size and --max-attempts must be >= 1.")
+        if backoff < 0 or max_backoff < backoff:
+            raise CommandError("--backoff must be >= 0 and --max-backoff >= --backoff.")
+        worker = OutboxWorker(batch_size=batch_size, max_attempts=max_attempts, backoff=backoff,
+                              max_backoff=max_backoff)
+        try:
+            while True:
+                claimed = worker.poll()
+                if claimed:
+                    self.stdout.write(f"{claimed} messages; totals {dict(worker.stats)}")
+                elif once:
+                    break
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Outbox stopped: {dict(worker.stats)}"))
@@ -0,0 +1,152 @@
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from fantasy import analytics
+from fantasy.models import Team, Player, TransferListing, Transaction, CacheVersion, MARKET_VERSION
+
+# GK: 2, DEF: 6, MID: 6, ATT: 6 (total 20), as enforced by TeamCreateSerializer.validate
+SQUAD = [('GK', 2), ('DEF', 6), ('MID', 6), ('ATT', 6)]
+INITIAL_CAPITAL = Decimal('5000000.00')
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the created_at we set instead of stamping now()."""
+    fields = [m._meta.get_field('created_at') for m in models]
+    for f in fields:
+        f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f in fields:
+            f.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ("Generate a league of N users with teams, 20-player squads, listings and transaction history "
+            "using batched bulk inserts. Output is deterministic for a given --seed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Users (and teams) to create.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; same seed, same league.")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Users generated and committed per chunk (default: 1000).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT (default: 5000).")
+        parser.add_argument('--listed', type=float, default=0.05,
+                            help="Fraction of owned players put on the transfer market (default: 0.05).")
+        parser.add_argument('--history', type=int, default=5,
+                            help="Settled transactions generated per team (default: 5).")
+        parser.add_argument('--history-days', type=int, default=365,
+                            help="Spread transaction timestamps over this many past days (default: 365).")
+        parser.add_argument('--free-agents', type=int, default=0, help="Unowned players to add for drafting.")
+        parser.add_argument('--prefix', default='seed', help="Username prefix (default: 'seed').")
+        parser.add_argument('--password', default='StrongPass123!', help="Password shared by all seeded users.")
+
+    def handle(self, *args, **opts):
+        users, chunk_size, prefix = opts['users'], opts['chunk_size'], opts['prefix']
+        if users < 0 or chunk_size < 1 or opts['batch_size'] < 1:
+            raise CommandError("--users must be >= 0, --chunk-size and --batch-size >= 1.")
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Users with prefix '{prefix}' already exist; pass a different --prefix.")
+
+        self.opts = opts
+        self.password = make_password(opts['password'])  # hashing once, not per user, is most of the speedup
+        self.now = timezone.now()
+        # team pk per user index, for picking historical sellers; 8 bytes a team
+        self.team_ids = array('q')
+
+        started = time.monotonic()
+        with explicit_timestamps(Transaction):
+            for start in range(0, users, chunk_size):
+                stop = min(start + chunk_size, users)
+                with transaction.atomic():
+                    counts = self.seed_chunk(start, stop)
+                self.stdout.write(f"users {stop}/{users}: +{counts[0]} players, +{counts[1]} listings, "
+                                  f"+{counts[2]} transactions ({time.monotonic() - started:.1f}s)")
+            if opts['free_agents']:
+                self.seed_free_agents(opts['free_agents'])
+        CacheVersion.bump(MARKET_VERSION)  # bulk-created listings bypass TransferListing.save()
+        if users and opts['history']:
+            # and the bulk-created history bypasses settlement's rollups
+            analytics.rebuild(timezone.localdate(self.now - timedelta(days=opts['history_days'])),
+                              timezone.localdate(self.now), days_per_chunk=31)
+            self.stdout.write(f"analytics rebuilt ({time.monotonic() - started:.1f}s)")
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded {users} users in {time.monotonic() - started:.1f}s."))
+
+    def rng(self, *key):
+        # one generator per entity, so output does not depend on --chunk-size
+        return random.Random(":".join(str(k) for k in (self.opts['seed'],) + key))
+
+    def seed_chunk(self, start, stop):
+        batch_size, prefix = self.opts['batch_size'], self.opts['prefix']
+        created = User.objects.bulk_create(
+            [User(username=f"{prefix}{i:07d}", email=f"{prefix}{i:07d}@example.com", password=self.password)
+             for i in range(start, stop)],
+            batch_size=batch_size,
+        )
+
+        squads = []
+        for i in range(start, stop):
+            rng = self.rng('squad', i)
+            squads.append([(pos, n, Decimal(rng.randint(5_000, 25_000) * 10)) for pos, count in SQUAD
+                           for n in range(count)])
+
+        teams = Team.objects.bulk_create(
+            [Team(user=u, name=f"{u.username} FC", capital=INITIAL_CAPITAL - sum(v for *_, v in squad),
+                  squad_value=sum(v for *_, v in squad))
+             for u, squad in zip(created, squads)],
+            batch_size=batch_size,
+        )
+        self.team_ids.extend(t.pk for t in teams)
+
+        players = Player.objects.bulk_create(
+            [Player(name=f"{pos}-{i:07d}-{n + 1}", position=pos, owner=team, value=value)
+             for i, team, squad in zip(range(start, stop), teams, squads) for pos, n, value in squad],
+            batch_size=batch_size,
+        )
+
+        listings, txs = [], []
+        per_team = sum(count for _, count in SQUAD)
+        for offset, i in enumerate(range(start, stop)):
+            rng = self.rng('market', i)
+            squad = players[offset * per_team:(offset + 1) * per_team]
+            for p in squad:
+                if rng.random() < self.opts['listed']:
+                    price = (p.value * Decimal(str(round(rng.uniform(0.9, 1.5), 2)))).quantize(Decimal('0.01'))
+                    listings.append(TransferListing(player=p, seller_id=p.owner_id, price=price))
+            if i == 0:
+                continue  # the first team has nobody to have bought from
+            for _ in range(self.opts['history']):
+                p = rng.choice(squad)
+                seconds = rng.randrange(self.opts['history_days'] * 86400 or 1)
+                txs.append(Transaction(buyer_id=p.owner_id, seller_id=self.team_ids[rng.randrange(i)], player=p,
+                                       amount=p.value, active=False,
+                                       created_at=self.now - timedelta(seconds=seconds)))
+
+        TransferListing.objects.bulk_create(listings, batch_size=batch_size)
+        Transaction.objects.bulk_create(txs, batch_size=batch_size)
+        return len(players), len(listings), len(txs)
+
+    def seed_free_agents(self, count):
+        batch_size = self.opts['batch_size']
+        positions = [pos for pos, n in SQUAD for _ in range(n)]
+        for start in range(0, count, batch_size):
+            with transaction.atomic():
+                Player.objects.bulk_create(
+                    [Player(name=f"FA-{self.opts['prefix']}-{i:07d}", position=positions[i % len(positions)],
+                            value=Decimal(self.rng('free', i).randint(5_000, 25_000) * 10))
+                     for i in range(start, min(start + batch_size, count))],
+                    batch_size=batch_size,
+                )
+        self.stdout.write(f"free agents: +{count}")
@@ -0,0 +1,130 @@
+"""
+Read-through cache for the transfer market.
+
+Both page and per-listing fragment keys embed the market version
+(``CacheVersion['market']``), which is bumped in the same transaction as
+every listing create, cancel, edit and purchase. A reader only sees the new
+version once that transaction has committed, so it can never pick up a page
+that still shows a sold player. Fragments let differently filtered or
+sorted pages of the same version share rendered rows. A page's key also
+has the scheme and host it was asked under: its next/previous links are
+absolute.
+
+Uses Django's cache framework: locmem in tests and development, a shared
+backend (REDIS_URL) in production. The ``a``-prefixed functions are the same
+steps for the async market view, through the async cache and ORM APIs.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CacheVersion, MARKET_VERSION, TransferListing
+from .serializers import MarketListingSerializer
+
+STAT_KEYS = ('page_hits', 'page_misses', 'fragment_hits', 'fragment_misses')
+
+
+def current_version():
+    return CacheVersion.current(MARKET_VERSION)
+
+
+async def acurrent_version():
+    return await CacheVersion.objects.filter(key=MARKET_VERSION).values_list('version', flat=True).afirst() or 0
+
+
+def ttl():
+    return getattr(settings, 'MARKET_CACHE_TTL', 300)
+
+
+def page_key(version, request):
+    params = urlencode(sorted((k, v) for k, values in request.query_params.lists() for v in values))
+    digest = hashlib.md5(f"{request.scheme}://{request.get_host()}?{params}".encode()).hexdigest()
+    return f"market:v{version}:page:{digest}"
+
+
+def fragment_key(version, listing_id):
+    return f"market:v{version}:listing:{listing_id}"
+
+
+def get_page(version, request):
+    payload = cache.get(page_key(version, request))
+    record('page_hits' if payload is not None else 'page_misses')
+    return payload
+
+
+def set_page(version, request, payload):
+    cache.set(page_key(version, request), payload, ttl())
+
+
+async def aget_page(version, request):
+    payload = await cache.aget(page_key(version, request))
+    await arecord('page_hits' if payload is not None else 'page_misses')
+    return payload
+
+
+async def aset_page(version, request, payload):
+    await cache.aset(page_key(version, request), payload, ttl())
+
+
+def render_listings(version, listing_ids, context):
+    """Rendered market rows for ``listing_ids``, in order; only fragment misses hit the DB."""
+    keys = {listing_id: fragment_key(version, listing_id) for listing_id in listing_ids}
+    cached = cache.get_many(list(keys.values()))
+    missing = [listing_id for listing_id, key in keys.items() if key not in cached]
+    record('fragment_hits', len(listing_ids) - len(missing))
+    record('fragment_misses', len(missing))
+
+    rows = {listing_id: cached[key] for listing_id, key in keys.items() if key in cached}
+    if missing:
+        listings = TransferListing.objects.filter(pk__in=missing).select_related('player__owner__user', 'seller')
+        fresh = {row['listing_id']: row for row in MarketListingSerializer(listings, many=True, context=context).data}
+        cache.set_many({keys[listing_id]: row for listing_id, row in fresh.items()}, ttl())
+        rows.update(fresh)
+    return [rows[listing_id] for listing_id in listing_ids if listing_id in rows]
+
+
+async def arender_listings(version, listing_ids, context):
+    keys = {listing_id: fragment_key(version, listing_id) for listing_id in listing_ids}
+    cached = await cache.aget_many(list(keys.values()))
+    missing = [listing_id for listing_id, key in keys.items() if key not in cached]
+    await arecord('fragment_hits', len(listing_ids) - len(missing))
+    await arecord('fragment_misses', len(missing))
+
+    rows = {listing_id: cached[key] for listing_id, key in keys.items() if key in cached}
+    if missing:
+        listings = [listing async for listing in TransferListing.objects.filter(pk__in=missing)
+                    .select_related('player__owner__user', 'seller')]
+        fresh = {row['listing_id']: row for row in MarketListingSerializer(listings, many=True, context=context).data}
+        await cache.aset_many({keys[listing_id]: row for listing_id, row in fresh.items()}, ttl())
+        rows.update(fresh)
+    return [rows[listing_id] for listing_id in listing_ids if listing_id in rows]
+
+
+def record(stat, n=1):
+    # counters live in the cache too, so a shared backend aggregates them across workers
+    if n:
+        key = f"market:stats:{stat}"
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, n)
+        except ValueError:  # evicted between add() and incr()
+            cache.set(key, n, timeout=None)
+
+
+async def arecord(stat, n=1):
+    if n:
+        key = f"market:stats:{stat}"
+        await cache.aadd(key, 0, timeout=None)
+        try:
+            await cache.aincr(key, n)
+        except ValueError:
+            await cache.aset(key, n, timeout=None)
+
+
+def stats():
+    values = cache.get_many([f"market:stats:{stat}" for stat in STAT_KEYS])
+    result = {stat: values.get(f"market:stats:{stat}", 0) for stat in STAT_KEYS}
+    result['version'] = current_version()
+    return result
@@ -0,0 +1,90 @@
+"""
+The order-book matching engine: one process owns the in-memory book.
+
+``MatchingEngine.poll()`` books every OPEN order placed since the last poll
+(the first poll rebuilds the whole book from the database), collects the
+fills and writes them through ``settlement.settle_fills`` in batches. When a
+fill is rejected the order that failed is dropped and its counterparty goes
+back into the book to match again; an ask whose seller no longer owns the
+player takes the player's other resting asks with it.
+
+Order ids are handed out before their transactions commit, so a poll looks
+back ``lookback`` ids behind the highest one it has seen and skips the ids it
+already booked; an order that commits later than that is only picked up when
+the engine restarts.
+"""
+import logging
+from collections import Counter
+
+from .models import Order
+from .orderbook import BookOrder, OrderBook
+from .settlement import SELLER_GONE, settle_fills
+
+logger = logging.getLogger('fantasy.matching')
+
+_COLUMNS = ('pk', 'team_id', 'side', 'player_id', 'position', 'price')
+
+
+class MatchingEngine:
+    def __init__(self, batch_size=500, chunk_size=5000, lookback=1000):
+        self.book = OrderBook()
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.lookback = lookback
+        self.last_id = 0
+        self.seen = set()
+        self.stats = Counter()
+
+    def poll(self):
+        """Book new orders and settle every cross they make; returns the number of fills settled."""
+        settled = 0
+        pending = []
+        cursor = max(self.last_id - self.lookback, 0)
+        while True:
+            rows = list(Order.objects.filter(status=Order.OPEN, pk__gt=cursor).order_by('pk')
+                        .values_list(*_COLUMNS)[:self.chunk_size])
+            if not rows:
+                break
+            cursor = rows[-1][0]
+            for row in rows:
+                if row[0] in self.seen:
+                    continue
+                self.seen.add(row[0])
+                self.stats['booked'] += 1
+                fill = self.book.add(BookOrder(*row))
+                if fill is not None:
+                    pending.append(fill)
+                if len(pending) >= self.batch_size:
+                    settled += self.settle(pending)
+                    pending = []
+        settled += self.settle(pending)
+
+        self.last_id = max(self.last_id, cursor)
+        floor = self.last_id - self.lookback
+        self.seen = {order_id for order_id in self.seen if order_id > floor}
+        return settled
+
+    def settle(self, fills):
+        """Write ``fills``; re-book the survivors of rejected ones until nothing more crosses."""
+        settled = 0
+        while fills:
+            retry = []
+            for start in range(0, len(fills), self.batch_size):
+                batch = fills[start:start + self.batch_size]
+                txs, rejected = settle_fills(batch)
+                for fill, tx in zip(batch, txs):
+                    if tx is not None:
+                        settled += 1
+                        continue
+                    for order in (fill.bid, fill.ask):
+                        if order.id in rejected:
+                            self.stats['rejected'] += 1
+                            logger.info("order %s dropped: %s", order.id, rejected[order.id])
+                            if rejected[order.id] == SELLER_GONE:
+                                # one ask per player is open at a time, so the others left on it are dead too
+                                self.book.drop_player_asks(order.player_id)
+                        else:
+                            retry.append(order)
+            fills = [fill for fill in map(self.book.add, retry) if fill is not None]
+        self.stats['filled'] += settled
+        return settled
@@ -0,0 +1,193 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import db_router
+
+logger = logging.getLogger('fantasy.db')
+
+# transaction bookkeeping, not data access; left out so budgets are the same in and outside tests
+_BOOKKEEPING = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    """execute_wrapper that records every statement run on a connection during one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.startswith(_BOOKKEEPING):
+                self.duration += time.perf_counter() - started
+                self.count += 1
+                self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+
+def resolve_query_budget(view_func, method):
+    """
+    Look up the view's declared budget. Views declare ``query_budgets`` as
+    ``{action_or_method: max_queries}``; viewset actions are keyed by action
+    name (``list``, ``market``, ``buy``), plain APIViews and the async
+    Django views by HTTP method.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    budgets = getattr(view_class, 'query_budgets', None)
+    if not budgets:
+        return None
+    actions = getattr(view_func, 'actions', None) or {}
+    return budgets.get(actions.get(method.lower(), method.lower()))
+
+
+def extend_query_budget(request, queries):
+    """Allow this request ``queries`` more than its view's budget, for work only some requests do."""
+    request = getattr(request, '_request', request)  # a DRF Request wraps the HttpRequest the middleware sees
+    if getattr(request, '_query_budget', None) is not None:
+        request._query_budget += queries
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Counts the queries, DB time and repeated SQL of each request, reports them
+    as ``X-DB-*`` response headers and one structured ``fantasy.db`` log line,
+    and checks them against the view's ``query_budgets``. With
+    ``QUERY_BUDGET_ENFORCE`` on (the test suite) going over budget raises
+    QueryBudgetExceeded; otherwise it is logged as a warning.
+
+    Works in both handler modes. Under ASGI the async ORM, like any sync view,
+    runs its queries on the request's thread-sensitive executor thread, so the
+    wrappers are installed on (and removed from) that thread's connections.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        with ExitStack() as stack:
+            self.instrument(stack, stats)
+            response = self.get_response(request)
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        stack = ExitStack()
+        await sync_to_async(self.instrument)(stack, stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, stats)
+
+    def instrument(self, stack, stats):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+
+    def report(self, request, response, stats):
+        budget = getattr(request, '_query_budget', None)
+        response['X-DB-Query-Count'] = str(stats.count)
+        response['X-DB-Time-Ms'] = f"{stats.duration * 1000:.2f}"
+        response['X-DB-Duplicate-Queries'] = str(stats.duplicates)
+        if budget is not None:
+            response['X-DB-Query-Budget'] = str(budget)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'duplicates': stats.duplicates,
+            'budget': budget,
+        }
+        if stats.duplicates:
+            sql, times = stats.statements.most_common(1)[0]
+            record['most_repeated'] = {'sql': sql[:200], 'times': times}
+        over_budget = budget is not None and stats.count > budget
+        logger.log(logging.WARNING if over_budget else logging.INFO, json.dumps(record))
+
+        if over_budget and getattr(settings, 'QUERY_BUDGET_ENFORCE', False):
+            raise QueryBudgetExceeded(
+                f"{request.method} {request.path} ran {stats.count} queries, budget is {budget}"
+                + (f"; most repeated ({record['most_repeated']['times']}x): {record['most_repeated']['sql']}"
+                   if stats.duplicates else "")
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = resolve_query_budget(view_func, request.method)
+
+
+class ReadReplicaMiddleware:
+    """
+    Routes each request's reads through fantasy.db_router: safe requests read
+    from a replica, and an authenticated user's successful write pins their
+    reads to the primary for READ_YOUR_WRITES_SECONDS. Goes after
+    AuthenticationMiddleware; DRF authenticates later, in the view, which is
+    when the router first looks at the user.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = db_router.enter(request)
+        try:
+            response = self.route_stream(self.get_response(request))
+        finally:
+            db_router.leave(token)
+        self.pin_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = db_router.enter(request)
+        try:
+            response = self.route_stream(await self.get_response(request))
+        finally:
+            db_router.leave(token)
+        await sync_to_async(self.pin_writer)(request, response)
+        return response
+
+    def route_stream(self, response):
+        # an export's rows are read as its body is sent, from the replica its request was given
+        if response.streaming:
+            response.streaming_content = db_router.routed(response.streaming_content, response.is_async)
+        return response
+
+    def pin_writer(self, request, response):
+        if not db_router.replicas() or request.method in db_router.SAFE_METHODS or response.status_code >= 400:
+            return
+        user_id = db_router.user_id(request)
+        if user_id is not None:
+            db_router.pin(user_id)
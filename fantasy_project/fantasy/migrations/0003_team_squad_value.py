@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:20
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_squad_value(apps, schema_editor):
+    Team = apps.get_model('fantasy', 'Team')
+    Player = apps.get_model('fantasy', 'Player')
+    totals = (Player.objects.filter(owner=OuterRef('pk')).order_by()
+              .values('owner').annotate(total=Sum('value')).values('total'))
+    Team.objects.update(squad_value=Coalesce(Subquery(totals), Value(Decimal('0.00'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0002_alter_player_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='squad_value',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=20),
+        ),
+        migrations.RunPython(backfill_squad_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:24
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; the ledger is
+    # large, so build the indexes without blocking writes.
+    atomic = False
+
+    dependencies = [
+        ('fantasy', '0003_team_squad_value'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['created_at', 'id'], name='tx_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['buyer', 'created_at', 'id'], name='tx_buyer_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['seller', 'created_at', 'id'], name='tx_seller_created_id_idx'),
+        ),
+        # the single-column FK indexes are prefixes of the ones above
+        migrations.AlterField(
+            model_name='transaction',
+            name='buyer',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchases', to='fantasy.team'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='seller',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='fantasy.team'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:33
+
+from django.db import migrations, models
+
+
+def create_market_version(apps, schema_editor):
+    apps.get_model('fantasy', 'CacheVersion').objects.get_or_create(key='market')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0004_transaction_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_market_version, migrations.RunPython.noop),
+    ]
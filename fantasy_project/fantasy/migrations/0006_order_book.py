@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0005_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('BID', 'Bid'), ('ASK', 'Ask')], max_length=3)),
+                ('position', models.CharField(choices=[('GK', 'Goalkeeper'), ('DEF', 'Defender'), ('MID', 'Midfielder'), ('ATT', 'Attacker')], max_length=4)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('status', models.CharField(choices=[('OPEN', 'Open'), ('FILLED', 'Filled'), ('CANCELLED', 'Cancelled')], default='OPEN', max_length=9)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('player', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='fantasy.player')),
+                ('team', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='fantasy.team')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='fantasy.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['team', 'id'], name='order_team_id_idx'), models.Index(condition=models.Q(('status', 'OPEN')), fields=['id'], name='order_open_id_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('side', 'ASK'), ('status', 'OPEN')), fields=('player',), name='order_one_open_ask_per_player')],
+            },
+        ),
+    ]
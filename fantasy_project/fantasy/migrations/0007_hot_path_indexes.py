@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 22:48
+
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # like 0004: build on live tables without blocking listing, buying or drafting
+    atomic = False
+
+    dependencies = [
+        ('fantasy', '0006_order_book'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='player',
+            index=models.Index(django.db.models.functions.text.Upper('position'), models.F('owner'), name='player_upper_pos_owner_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transferlisting',
+            index=models.Index(condition=models.Q(('active', True)), fields=['price', 'id'], name='listing_active_price_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transferlisting',
+            index=models.Index(condition=models.Q(('active', True)), fields=['created_at', 'id'], name='listing_active_created_idx'),
+        ),
+    ]
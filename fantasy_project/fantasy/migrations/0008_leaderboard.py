@@ -0,0 +1,100 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:07
+
+from django.db import migrations, models
+
+# fantasy/leaderboard.py: buckets split values like floats, one per cent below 256 cents and then 128
+# per power of two; the tree has 2**13 of them. bucket() there must agree with the function here.
+LEADERBOARD_SQL = """
+CREATE FUNCTION fantasy_leaderboard_bucket(total numeric) RETURNS integer AS $$
+    -- shift: bit length - 1 - 7 mantissa bits
+    SELECT CASE WHEN cents < 256 THEN cents::integer ELSE (shift << 7) + (cents >> shift)::integer END
+    FROM (SELECT cents, length(ltrim(cents::bit(64)::text, '0')) - 8 AS shift
+          FROM (SELECT LEAST(GREATEST(total * 100, 0), 9223372036854775807)::bigint AS cents) AS c) AS s
+$$ LANGUAGE sql IMMUTABLE;
+
+-- add 1 along the tree for every team that entered a bucket, -1 for every one that left it; the
+-- nodes are upserted highest first, so the root, in every update, is always the first lock taken
+CREATE FUNCTION fantasy_leaderboard_apply(entered integer[], departed integer[]) RETURNS void AS $$
+BEGIN
+    WITH RECURSIVE moves(bucket, teams) AS (
+        SELECT bucket, sum(teams) FROM (
+            SELECT unnest(entered) AS bucket, 1 AS teams
+            UNION ALL
+            SELECT unnest(departed), -1
+        ) AS m GROUP BY bucket HAVING sum(teams) <> 0
+    ), path(node, teams) AS (
+        SELECT bucket + 1, teams FROM moves
+        UNION ALL
+        SELECT node + (node & -node), teams FROM path WHERE node + (node & -node) <= 8192
+    )
+    INSERT INTO fantasy_leaderboardnode (node, teams)
+    SELECT node, sum(teams) FROM path GROUP BY node HAVING sum(teams) <> 0 ORDER BY node DESC
+    ON CONFLICT (node) DO UPDATE SET teams = fantasy_leaderboardnode.teams + EXCLUDED.teams;
+END
+$$ LANGUAGE plpgsql;
+
+-- plpgsql, not sql: its statements' plans are kept for the session instead of made on every call
+CREATE FUNCTION fantasy_leaderboard_move() RETURNS trigger AS $$
+DECLARE
+    entered integer[];
+    departed integer[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        entered := ARRAY(SELECT fantasy_leaderboard_bucket(capital + squad_value) FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        departed := ARRAY(SELECT fantasy_leaderboard_bucket(capital + squad_value) FROM old_rows);
+    ELSE
+        -- most writes move a total within its bucket and leave the tree alone
+        SELECT array_agg(m.entered), array_agg(m.departed) INTO entered, departed FROM (
+            SELECT fantasy_leaderboard_bucket(n.capital + n.squad_value) AS entered,
+                   fantasy_leaderboard_bucket(o.capital + o.squad_value) AS departed
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.capital + n.squad_value <> o.capital + o.squad_value
+        ) AS m WHERE m.entered <> m.departed;
+    END IF;
+    IF cardinality(entered) > 0 OR cardinality(departed) > 0 THEN
+        PERFORM fantasy_leaderboard_apply(COALESCE(entered, '{}'), COALESCE(departed, '{}'));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER fantasy_leaderboard_insert AFTER INSERT ON fantasy_team
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION fantasy_leaderboard_move();
+CREATE TRIGGER fantasy_leaderboard_update AFTER UPDATE ON fantasy_team
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION fantasy_leaderboard_move();
+CREATE TRIGGER fantasy_leaderboard_delete AFTER DELETE ON fantasy_team
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION fantasy_leaderboard_move();
+
+-- the teams already there; no team changes between this and the triggers
+LOCK TABLE fantasy_team IN SHARE MODE;
+SELECT fantasy_leaderboard_apply(
+    ARRAY(SELECT fantasy_leaderboard_bucket(capital + squad_value) FROM fantasy_team), '{}');
+"""
+
+DROP_LEADERBOARD_SQL = """
+DROP TRIGGER fantasy_leaderboard_insert ON fantasy_team;
+DROP TRIGGER fantasy_leaderboard_update ON fantasy_team;
+DROP TRIGGER fantasy_leaderboard_delete ON fantasy_team;
+DROP FUNCTION fantasy_leaderboard_move();
+DROP FUNCTION fantasy_leaderboard_apply(integer[], integer[]);
+DROP FUNCTION fantasy_leaderboard_bucket(numeric);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardNode',
+            fields=[
+                ('node', models.IntegerField(primary_key=True, serialize=False)),
+                ('teams', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(LEADERBOARD_SQL, DROP_LEADERBOARD_SQL),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:07
+
+import django.db.models.expressions
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # like 0007: build on a live table without blocking buys or drafting
+    atomic = False
+
+    dependencies = [
+        ('fantasy', '0008_leaderboard'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='team',
+            index=models.Index(models.OrderBy(django.db.models.expressions.CombinedExpression(models.F('capital'), '+', models.F('squad_value')), descending=True), models.F('id'), name='team_total_value_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:19
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0009_team_total_value_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('position', models.CharField(choices=[('GK', 'Goalkeeper'), ('DEF', 'Defender'), ('MID', 'Midfielder'), ('ATT', 'Attacker')], max_length=4)),
+                ('trades', models.BigIntegerField(default=0)),
+                ('volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=24)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'position'), name='position_day_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PlayerDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('trades', models.BigIntegerField(default=0)),
+                ('volume', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=24)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='fantasy.player')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'player'), name='player_day_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLUMNS = "id, buyer_id, seller_id, player_id, amount, created_at, active"
+HISTORY_SQL = f"""
+CREATE VIEW fantasy_transactionhistory AS
+    SELECT {COLUMNS} FROM fantasy_transaction
+    UNION ALL
+    SELECT {COLUMNS} FROM fantasy_archivedtransaction
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField()),
+                ('active', models.BooleanField()),
+            ],
+            options={
+                'verbose_name_plural': 'transaction history',
+                'db_table': 'fantasy_transactionhistory',
+                'managed': False,
+            },
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='transaction',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='fantasy.transaction'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField()),
+                ('active', models.BooleanField(default=False)),
+                ('buyer', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='fantasy.team')),
+                ('player', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='fantasy.player')),
+                ('seller', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='fantasy.team')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'id'], name='txa_created_id_idx'), models.Index(fields=['buyer', 'created_at', 'id'], name='txa_buyer_created_id_idx'), models.Index(fields=['seller', 'created_at', 'id'], name='txa_seller_created_id_idx')],
+            },
+        ),
+        migrations.RunSQL(HISTORY_SQL, "DROP VIEW fantasy_transactionhistory"),
+    ]
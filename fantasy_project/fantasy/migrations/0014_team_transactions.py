@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:54
+
+from django.db import migrations, models
+
+COLUMNS = "id, buyer_id, seller_id, player_id, amount, created_at, active"
+# straight off both tables, with no condition of its own: PostgreSQL merges the ordered index walks of
+# a flat UNION ALL, but not those of one nested in another view or of a branch with its own WHERE
+TEAM_SQL = "CREATE VIEW fantasy_teamtransaction AS\n" + "\nUNION ALL\n".join(
+    f"SELECT {side}_id AS team_id, '{side}' AS side, {COLUMNS} FROM {table}"
+    for table in ('fantasy_transaction', 'fantasy_archivedtransaction') for side in ('buyer', 'seller')
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fantasy', '0013_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamTransaction',
+            fields=[
+                ('side', models.CharField(max_length=6)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField()),
+                ('active', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'fantasy_teamtransaction',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(TEAM_SQL, "DROP VIEW fantasy_teamtransaction"),
+    ]
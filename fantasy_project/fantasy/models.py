@@ -1,6 +1,8 @@
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.contrib.postgres.indexes import BrinIndex
 from django.utils import timezone
 import random
 from decimal import Decimal
@@ -22,20 +24,119 @@ def default_player_value():
 #     def __str__(self):
 #         return self.username
 
+class CacheVersion(models.Model):
+    """
+    Version markers for cached read models (e.g. the transfer market, a
+    team's page). Writers bump them inside the transaction that changes the
+    underlying rows, so a reader never sees a new version before the data it
+    stands for is committed. Always bump last, and all of a transaction's
+    keys in one ``bump()``: rows are locked in key order, and the market row
+    is a single point of contention.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key}@{self.version}"
+
+    @classmethod
+    def bump(cls, *keys):
+        # one upsert whatever the number of keys; a missing row starts at 1
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        quote = connection.ops.quote_name
+        table, key, version = quote(cls._meta.db_table), quote('key'), quote('version')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({key}, {version}) VALUES {', '.join(['(%s, 1)'] * len(keys))} "
+                f"ON CONFLICT ({key}) DO UPDATE SET {version} = {table}.{version} + 1", keys)
+
+    @classmethod
+    def current(cls, key):
+        return cls.objects.filter(key=key).values_list('version', flat=True).first() or 0
+
+
+MARKET_VERSION = 'market'
+
+
+def team_version_key(team_id):
+    # what teams/me shows for the team: bumped by every write to its name, capital, players or listings
+    return f"team:{team_id}"
+
+
+def team_version_keys(team_ids):
+    return [team_version_key(team_id) for team_id in team_ids if team_id is not None]
+
+
 class Team(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='team')
     name = models.CharField(max_length=100)
     capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('5000000.00'))  # $5,000,000
     created_at = models.DateTimeField(auto_now_add=True)
+    # sum of players.value, maintained by adjust_squad_values() in the same transaction as every
+    # owner/value change; `manage.py rebuild_team_values` recomputes or verifies it
+    squad_value = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('0.00'), editable=False)
     # owner = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='team', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # the leaderboard: the top teams by total_value, and the teams ahead of one inside its bucket
+            models.Index((models.F('capital') + models.F('squad_value')).desc(), models.F('id'),
+                         name='team_total_value_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.user.username})"
 
+    def save(self, *args, **kwargs):
+        # squad_value is only ever written with F() deltas; a plain save() must not
+        # write back the (possibly stale) copy this instance was loaded with
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'squad_value'
+            ]
+        with transaction.atomic():
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if not adding:
+                # market rows show the seller's name
+                market = [MARKET_VERSION] if self.listings.filter(active=True).exists() else []
+                CacheVersion.bump(team_version_key(self.pk), *market)
+
     @property
     def total_value(self):
-        players_value = self.players.aggregate(total=models.Sum('value'))['total'] or Decimal('0.00')
-        return players_value + self.capital
+        return self.squad_value + self.capital
+
+
+class LeaderboardNode(models.Model):
+    """
+    A node of the leaderboard's Fenwick tree (fantasy/leaderboard.py): how many
+    teams have a total value in the node's range of buckets. Written only by
+    the triggers on the team table (migration 0008).
+    """
+    node = models.IntegerField(primary_key=True)
+    teams = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"node {self.node}: {self.teams}"
+
+
+def adjust_squad_values(deltas):
+    """
+    Apply ``{team_id: Decimal}`` deltas to Team.squad_value.
+
+    Teams are locked in ascending id order so concurrent callers always lock
+    team rows in the same order, all of them before the first write: each
+    write's trigger takes the leaderboard tree. Must be called inside the
+    transaction that changes the players' owner/value.
+    """
+    team_ids = sorted(t for t, delta in deltas.items() if t is not None and delta)
+    if len(team_ids) > 1:
+        list(Team.objects.select_for_update().filter(pk__in=team_ids).order_by('pk').values_list('pk', flat=True))
+    for team_id in team_ids:
+        Team.objects.filter(pk=team_id).update(squad_value=models.F('squad_value') + deltas[team_id])
 
 class Player(models.Model):
     name = models.CharField(max_length=120)
@@ -44,9 +145,46 @@ class Player(models.Model):
     value = models.DecimalField(max_digits=20, decimal_places=2, default=default_player_value)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # PlayerFilter's position__iexact compiles to UPPER(position) = UPPER(%s); with the owner
+            # the same index finds the free agents of a position for drafting
+            models.Index(Upper('position'), models.F('owner'), name='player_upper_pos_owner_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.position}) - {self.owner}"
 
+    def save(self, *args, **kwargs):
+        # Keeps Team.squad_value in sync for single-row saves (admin, shell, fixtures).
+        # Bulk QuerySet.update() callers must call adjust_squad_values() themselves.
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            adding = self._state.adding
+            if adding:
+                old_owner_id, old_value = None, Decimal('0.00')
+            else:
+                old_owner_id, old_value = (
+                    Player.objects.select_for_update().filter(pk=self.pk).values_list('owner_id', 'value').first()
+                    or (None, Decimal('0.00'))
+                )
+            super().save(*args, **kwargs)
+
+            new_owner_id = self.owner_id if update_fields is None or 'owner' in update_fields else old_owner_id
+            new_value = Decimal(str(self.value)).quantize(Decimal('0.01')) if update_fields is None or 'value' in update_fields else old_value
+            if (old_owner_id, old_value) != (new_owner_id, new_value):
+                deltas = {}
+                deltas[old_owner_id] = deltas.get(old_owner_id, 0) - old_value
+                deltas[new_owner_id] = deltas.get(new_owner_id, 0) + new_value
+                adjust_squad_values(deltas)
+
+            keys = team_version_keys({old_owner_id, new_owner_id})
+            # a listed player's row on the market changed
+            if not adding and TransferListing.objects.filter(player_id=self.pk, active=True).exists():
+                keys.append(MARKET_VERSION)
+            if keys:
+                CacheVersion.bump(*keys)
+
 class TransferListing(models.Model):
     player = models.OneToOneField(Player, on_delete=models.CASCADE, related_name='listing')
     price = models.DecimalField(max_digits=20, decimal_places=2)
@@ -54,16 +192,251 @@ class TransferListing(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(default=True)  # active until bought or cancelled
 
+    class Meta:
+        # every read of the market is of active listings, in one of MarketCursorPagination's orderings;
+        # sold and cancelled listings pile up and stay out of these
+        indexes = [
+            models.Index(fields=['price', 'id'], condition=models.Q(active=True), name='listing_active_price_idx'),
+            models.Index(fields=['created_at', 'id'], condition=models.Q(active=True),
+                         name='listing_active_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.player} listed for {self.price}"
 
+    def save(self, *args, **kwargs):
+        # create / cancel / edit all change the market and the seller's team; bulk update() callers
+        # bump them themselves
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            CacheVersion.bump(team_version_key(self.seller_id), MARKET_VERSION)
+
 class Transaction(models.Model):
-    buyer = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='purchases')
-    seller = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='sales')
+    # buyer/seller lookups are served by the (team, created_at, id) indexes below
+    buyer = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='purchases', db_index=False)
+    seller = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='sales', db_index=False)
     player = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True, related_name='transactions')
     amount = models.DecimalField(max_digits=20, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     active = models.BooleanField(default=True)  # mark inactive after settlement to indicate immutable record
 
+    class Meta:
+        # keyset pagination of the history walks (created_at, id), globally or per team
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='tx_created_id_idx'),
+            models.Index(fields=['buyer', 'created_at', 'id'], name='tx_buyer_created_id_idx'),
+            models.Index(fields=['seller', 'created_at', 'id'], name='tx_seller_created_id_idx'),
+        ]
+
     def __str__(self):
         return f"Tx {self.id}: {self.player} {self.seller} -> {self.buyer} for {self.amount}"
+
+
+class ArchivedTransaction(models.Model):
+    """
+    Settled Transactions older than TRANSACTION_ARCHIVE_DAYS, moved out of the
+    hot table with their ids by `manage.py archive_transactions`
+    (fantasy/archive.py), so that table and its indexes only hold recent
+    trades. Read along with them through TransactionHistory.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    buyer = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='+', db_index=False)
+    seller = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, related_name='+', db_index=False)
+    player = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True, related_name='+')
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField()
+    active = models.BooleanField(default=False)
+
+    class Meta:
+        # the same keyset walks as Transaction's, which reach here once they run past the hot rows
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='txa_created_id_idx'),
+            models.Index(fields=['buyer', 'created_at', 'id'], name='txa_buyer_created_id_idx'),
+            models.Index(fields=['seller', 'created_at', 'id'], name='txa_seller_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived tx {self.id}: {self.player_id} {self.seller_id} -> {self.buyer_id} for {self.amount}"
+
+
+class TransactionHistory(models.Model):
+    """
+    Every Transaction, hot or archived: a read-only view of the two tables
+    (UNION ALL, created in migration 0013). Ordered reads take a few rows off
+    each table's indexes and merge them, so recent pages barely touch the
+    archive.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    buyer = models.ForeignKey(Team, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    seller = models.ForeignKey(Team, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    player = models.ForeignKey(Player, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField()
+    active = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'fantasy_transactionhistory'
+        verbose_name_plural = 'transaction history'
+
+    def __str__(self):
+        return f"Tx {self.id}: {self.player} {self.seller} -> {self.buyer} for {self.amount}"
+
+
+class TeamTransaction(models.Model):
+    """
+    TransactionHistory once per side: a row for the buyer and one for the
+    seller, with that side as ``team``. Filtered on a team, its newest-first
+    reads merge that team's walks of the (buyer, created_at, id) and
+    (seller, created_at, id) indexes instead of sorting everything the team
+    ever traded. Read-only view, migration 0014; see ``for_team()``.
+    """
+    team = models.ForeignKey(Team, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    side = models.CharField(max_length=6)  # 'buyer' or 'seller'
+    id = models.BigIntegerField(primary_key=True)
+    buyer = models.ForeignKey(Team, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    seller = models.ForeignKey(Team, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    player = models.ForeignKey(Player, on_delete=models.DO_NOTHING, null=True, related_name='+')
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField()
+    active = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'fantasy_teamtransaction'
+
+    @classmethod
+    def for_team(cls, queryset, team_id):
+        """
+        ``queryset`` of TeamTransactions narrowed to ``team_id``'s deals, once
+        each: a self-trade's seller row is left out, in a filter on the row
+        rather than in the view, which would cost the walks their order.
+        """
+        return queryset.filter(models.Q(side='buyer') | ~models.Q(buyer_id=team_id), team_id=team_id)
+
+    def __str__(self):
+        return f"Tx {self.id} of team {self.team_id}: {self.player} {self.seller} -> {self.buyer} for {self.amount}"
+
+
+class PositionDay(models.Model):
+    """
+    Trades and their total price per day and position (the player's when
+    traded), rolled up by settlement in the same transaction as the
+    Transactions; `manage.py rebuild_analytics` recomputes them from history.
+    See fantasy/analytics.py.
+    """
+    day = models.DateField()
+    position = models.CharField(max_length=4, choices=POSITION_CHOICES)
+    trades = models.BigIntegerField(default=0)
+    volume = models.DecimalField(max_digits=24, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'position'], name='position_day_unique')]
+
+    def __str__(self):
+        return f"{self.day} {self.position}: {self.trades} for {self.volume}"
+
+
+class PlayerDay(models.Model):
+    """Trades and their total price per day and player, rolled up like PositionDay."""
+    day = models.DateField()
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    trades = models.BigIntegerField(default=0)
+    volume = models.DecimalField(max_digits=24, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        # (day, player) is also the index the top-players query walks for a range of days
+        constraints = [models.UniqueConstraint(fields=['day', 'player'], name='player_day_unique')]
+
+    def __str__(self):
+        return f"{self.day} {self.player_id}: {self.trades} for {self.volume}"
+
+
+class Order(models.Model):
+    """
+    A standing bid or ask on the transfer order book, for one player. Asks name
+    a player the team owns; bids name either a player or a whole position.
+    Matching happens out of process (``manage.py run_matching``), so an order
+    stays OPEN until the engine fills it or its team cancels it.
+    """
+    BID, ASK = 'BID', 'ASK'
+    SIDE_CHOICES = ((BID, 'Bid'), (ASK, 'Ask'))
+    OPEN, FILLED, CANCELLED = 'OPEN', 'FILLED', 'CANCELLED'
+    STATUS_CHOICES = ((OPEN, 'Open'), (FILLED, 'Filled'), (CANCELLED, 'Cancelled'))
+
+    # per-team lookups are served by the (team, id) index below
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    side = models.CharField(max_length=3, choices=SIDE_CHOICES)
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='orders', null=True, blank=True)
+    position = models.CharField(max_length=4, choices=POSITION_CHOICES)  # the player's, for player orders
+    price = models.DecimalField(max_digits=20, decimal_places=2)  # most a bid pays, least an ask takes
+    status = models.CharField(max_length=9, choices=STATUS_CHOICES, default=OPEN)
+    # no database constraint: archiving moves the transaction to ArchivedTransaction, id and all
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='orders', db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['team', 'id'], name='order_team_id_idx'),
+            # the matching engine's "new open orders since" scan
+            models.Index(fields=['id'], condition=models.Q(status='OPEN'), name='order_open_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['player'], condition=models.Q(side='ASK', status='OPEN'),
+                                    name='order_one_open_ask_per_player'),
+        ]
+
+    def __str__(self):
+        target = self.player.name if self.player_id else self.position
+        return f"{self.side} {target} @ {self.price} ({self.status})"
+
+
+class OutboxMessage(models.Model):
+    """
+    Work to do once a write has committed (fantasy/outbox.py): written in the
+    write's own transaction, handled later by ``manage.py run_outbox``, and
+    deleted when handled. A message that keeps failing is given up on after
+    the worker's last attempt: failed_at is set and it stays for inspection.
+    """
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)  # not handled before; pushed back by each retry
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the workers' "due now" scan; given-up messages drop out of it
+            models.Index(fields=['available_at', 'id'], condition=models.Q(failed_at__isnull=True),
+                         name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({self.attempts} attempts)"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key and the response its request got, replayed to
+    retries for IDEMPOTENCY_KEY_TTL seconds (fantasy/idempotency.py). The
+    request itself is kept as a 32-byte SHA-256 of its method, path and
+    body; `manage.py purge_idempotency_keys` deletes the expired rows.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', db_index=False)
+    key = models.CharField(max_length=255)
+    fingerprint = models.BinaryField(max_length=32)
+    status_code = models.PositiveSmallIntegerField(null=True)  # null until the first request's response is stored
+    # the view's response.data as DRF renders it to JSON; text, not jsonb, which would reorder its keys
+    response = models.TextField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique')]
+        # rows arrive in created_at order: a BRIN index finds the expired ones at a fraction of a B-tree's size
+        indexes = [BrinIndex(fields=['created_at'], name='idempotency_created_brin')]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status_code})"
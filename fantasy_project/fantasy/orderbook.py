@@ -0,0 +1,136 @@
+"""
+In-memory bid/ask matching for the transfer order book.
+
+Pure Python, no Django: the book is rebuilt from the open ``Order`` rows by
+``fantasy.matching.MatchingEngine`` and everything it matches is written by
+``fantasy.settlement.settle_fills``.
+
+Every order is for one player, so an incoming order fills at most once, in
+full. Asks always name a player and rest in two heaps, the player's and its
+position's; a bid rests in the heap of the player or position it names.
+Price-time priority: the best price wins, then the lowest order id, and the
+trade happens at the resting order's price. Orders from the same team never
+match each other. Cancelled and filled orders are dropped from ``orders``
+and their heap entries are discarded lazily when they reach the top.
+"""
+from collections import defaultdict
+from heapq import heappop, heappush
+
+BID, ASK = 'BID', 'ASK'
+
+
+class BookOrder:
+    __slots__ = ('id', 'team_id', 'side', 'player_id', 'position', 'price', 'cents')
+
+    def __init__(self, id, team_id, side, player_id, position, price):
+        self.id = id
+        self.team_id = team_id
+        self.side = side
+        self.player_id = player_id
+        self.position = position
+        self.price = price
+        self.cents = int(price * 100)  # heap keys compare as ints, much cheaper than Decimal
+
+    def __repr__(self):
+        target = f"player {self.player_id}" if self.player_id is not None else self.position
+        return f"<{self.side} #{self.id} team {self.team_id} {target} @ {self.price}>"
+
+
+class Fill:
+    __slots__ = ('bid', 'ask', 'price')
+
+    def __init__(self, bid, ask, price):
+        self.bid = bid
+        self.ask = ask
+        self.price = price
+
+    @property
+    def player_id(self):
+        return self.ask.player_id
+
+    def __repr__(self):
+        return f"<Fill bid #{self.bid.id} ask #{self.ask.id} player {self.player_id} @ {self.price}>"
+
+
+class OrderBook:
+    def __init__(self):
+        self.orders = {}  # live (resting) orders by id
+        self._asks_by_player = defaultdict(list)    # (cents, id)
+        self._asks_by_position = defaultdict(list)  # (cents, id)
+        self._bids_by_player = defaultdict(list)    # (-cents, id)
+        self._bids_by_position = defaultdict(list)  # (-cents, id)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders
+
+    def add(self, order):
+        """Match ``order`` against the book; returns the Fill, or None once the order rests."""
+        if order.id in self.orders:
+            raise ValueError(f"order {order.id} is already in the book")
+        fill = self._match_bid(order) if order.side == BID else self._match_ask(order)
+        if fill is None:
+            self._rest(order)
+        return fill
+
+    def cancel(self, order_id):
+        return self.orders.pop(order_id, None) is not None
+
+    def drop_player_asks(self, player_id):
+        """Forget the resting asks on a player who changed hands outside the book."""
+        for _, order_id in self._asks_by_player.pop(player_id, ()):
+            self.orders.pop(order_id, None)
+
+    def _match_bid(self, bid):
+        if bid.player_id is not None:
+            ask = self._best(self._asks_by_player.get(bid.player_id), bid.team_id)
+        else:
+            ask = self._best(self._asks_by_position.get(bid.position), bid.team_id)
+        if ask is None or ask.cents > bid.cents:
+            return None
+        del self.orders[ask.id]
+        return Fill(bid, ask, ask.price)
+
+    def _match_ask(self, ask):
+        best = None
+        for heap in (self._bids_by_player.get(ask.player_id), self._bids_by_position.get(ask.position)):
+            bid = self._best(heap, ask.team_id)
+            if bid is not None and (best is None or (-bid.cents, bid.id) < (-best.cents, best.id)):
+                best = bid
+        if best is None or best.cents < ask.cents:
+            return None
+        del self.orders[best.id]
+        return Fill(best, ask, best.price)
+
+    def _rest(self, order):
+        self.orders[order.id] = order
+        if order.side == BID:
+            key = (-order.cents, order.id)
+            if order.player_id is not None:
+                heappush(self._bids_by_player[order.player_id], key)
+            else:
+                heappush(self._bids_by_position[order.position], key)
+        else:
+            key = (order.cents, order.id)
+            heappush(self._asks_by_player[order.player_id], key)
+            heappush(self._asks_by_position[order.position], key)
+
+    def _best(self, heap, exclude_team_id):
+        """Best live order in ``heap`` not placed by ``exclude_team_id``, left in place."""
+        if not heap:
+            return None
+        skipped, best = [], None
+        while heap:
+            order = self.orders.get(heap[0][1])
+            if order is None:
+                heappop(heap)  # filled or cancelled
+            elif order.team_id == exclude_team_id:
+                skipped.append(heappop(heap))
+            else:
+                best = order
+                break
+        for key in skipped:
+            heappush(heap, key)
+        return best
@@ -0,0 +1,115 @@
+"""
+The transactional outbox: side effects of a write (notifications, audit,
+cache warming...) are not run inline while the write holds its row locks.
+The write adds an OutboxMessage in its own transaction instead, so the
+message exists exactly when the write committed, and a worker
+(``manage.py run_outbox``) handles it afterwards.
+
+Handlers are configured per topic in settings.OUTBOX_HANDLERS, as dotted
+paths of callables taking the message. Delivery is at least once: a
+message whose handlers fail is retried, every handler again, so handlers
+must be idempotent (the message id makes a good key).
+
+``OutboxWorker.poll()`` claims a batch of due messages with ``SELECT ... FOR
+UPDATE SKIP LOCKED``, so any number of workers share the queue without
+handing out a message twice, and a crashed worker's batch is released with
+its transaction. Each message runs in a savepoint; handled messages are
+deleted, failed ones pushed back by an exponential backoff with jitter,
+and given up on after ``max_attempts``, all in the batch's transaction.
+"""
+import logging
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage
+
+logger = logging.getLogger('fantasy.outbox')
+
+TRANSFER_SETTLED = 'transfer.settled'
+
+
+def enqueue(topic, payloads):
+    """Add a ``topic`` message per payload; call it inside the transaction whose side effects they are."""
+    return OutboxMessage.objects.bulk_create([OutboxMessage(topic=topic, payload=p) for p in payloads])
+
+
+def transfer_settled(txs):
+    """The transfer.settled messages of settled Transactions."""
+    return enqueue(TRANSFER_SETTLED, [
+        {'transaction_id': tx.pk, 'player_id': tx.player_id, 'buyer_id': tx.buyer_id, 'seller_id': tx.seller_id,
+         'amount': str(tx.amount), 'created_at': tx.created_at.isoformat()}
+        for tx in txs
+    ])
+
+
+def log_transfer(message):
+    # the audit trail of the market, one line per transfer
+    logger.info("transfer %(transaction_id)s: player %(player_id)s from team %(seller_id)s to team %(buyer_id)s "
+                "for %(amount)s", message.payload)
+
+
+def handlers():
+    return {topic: [import_string(path) for path in paths]
+            for topic, paths in getattr(settings, 'OUTBOX_HANDLERS', {}).items()}
+
+
+class OutboxWorker:
+    def __init__(self, batch_size=100, max_attempts=10, backoff=1.0, max_backoff=600.0):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.handlers = handlers()
+        self.stats = Counter()
+
+    def delay(self, attempts):
+        """Seconds before attempt ``attempts + 1``: doubling from ``backoff``, capped, then jittered down to half."""
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    def handle(self, message):
+        handlers = self.handlers.get(message.topic)
+        if not handlers:
+            raise LookupError(f"No handler for topic {message.topic!r}.")
+        for handler in handlers:
+            handler(message)
+
+    def poll(self):
+        """Handle one batch of due messages; returns how many were claimed."""
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                         .filter(failed_at__isnull=True, available_at__lte=now)
+                         .order_by('available_at', 'pk')[:self.batch_size])
+            done, failed = [], []
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        self.handle(message)
+                except Exception as exc:
+                    message.attempts += 1
+                    message.last_error = f"{type(exc).__name__}: {exc}"
+                    if message.attempts >= self.max_attempts:
+                        message.failed_at = timezone.now()
+                        logger.error("outbox %s #%s given up after %s attempts: %s", message.topic, message.pk,
+                                     message.attempts, message.last_error)
+                    else:
+                        message.available_at = timezone.now() + timedelta(seconds=self.delay(message.attempts))
+                        logger.warning("outbox %s #%s attempt %s failed: %s", message.topic, message.pk,
+                                       message.attempts, message.last_error)
+                    failed.append(message)
+                else:
+                    done.append(message.pk)
+            if done:
+                OutboxMessage.objects.filter(pk__in=done).delete()
+            if failed:
+                OutboxMessage.objects.bulk_update(failed, ['attempts', 'last_error', 'available_at', 'failed_at'])
+        self.stats.update(handled=len(done), retried=sum(m.failed_at is None for m in failed),
+                          given_up=sum(m.failed_at is not None for m in failed))
+        return len(batch)
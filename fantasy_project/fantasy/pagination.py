@@ -0,0 +1,100 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination, _reverse_ordering
+
+
+class AsyncCursorPaginationMixin:
+    """
+    ``apaginate_queryset``: CursorPagination.paginate_queryset for the async
+    views, step for step, with the page fetched through the async ORM.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor if self.cursor is not None else (0, False, None)
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            order = self.ordering[0]
+            # (cursor reversed) XOR (queryset reversed)
+            lookup = 'lt' if self.cursor.reverse != order.startswith('-') else 'gt'
+            queryset = queryset.filter(**{f"{order.lstrip('-')}__{lookup}": current_position})
+
+        # one extra row tells whether a page follows
+        results = [obj async for obj in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = (self._get_position_from_instance(results[-1], self.ordering)
+                              if has_following_position else None)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+        return self.page
+
+
+class AsyncLimitOffsetPagination(LimitOffsetPagination):
+    """The default LIMIT/OFFSET pagination, with ``apaginate_queryset`` for the async views."""
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [obj async for obj in queryset[self.offset:self.offset + self.limit]]
+
+
+class MarketCursorPagination(AsyncCursorPaginationMixin, CursorPagination):
+    """
+    Keyset pagination for the transfer market.
+
+    Pages are fetched with ``WHERE <key> > <cursor> ORDER BY <key>, id`` so
+    there is no COUNT(*) and no OFFSET scan, however deep the client pages.
+    The sort key is picked with ``?ordering=`` from a fixed whitelist.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'created_at'
+    ordering_param = 'ordering'
+    allowed_orderings = ('price', '-price', 'created_at', '-created_at')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param, self.ordering)
+        if ordering not in self.allowed_orderings:
+            ordering = self.ordering
+        # id breaks ties between listings with the same price / timestamp
+        tie_breaker = '-id' if ordering.startswith('-') else 'id'
+        return (ordering, tie_breaker)
+
+
+class TransactionCursorPagination(AsyncCursorPaginationMixin, CursorPagination):
+    """
+    Keyset pagination for the transaction history, newest first, walking the
+    (created_at, id) indexes. Opt in with ``/transactions/?pagination=cursor``.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
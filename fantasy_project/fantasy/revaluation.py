@@ -0,0 +1,180 @@
+"""
+League-wide player revaluation from the market.
+
+``Revaluation.run()`` re-prices every player. A player sold within the last
+``window`` moves ``anchor`` of the way from their value toward their latest
+sale price. Each position is then scaled by its demand: its trades per player
+over the window against the league's, damped by ``sensitivity``. No value
+moves more than ``max_change`` either way in one run.
+
+The players are walked in primary-key chunks, one transaction each, taking
+settlement's locks in settlement's order: the chunk's active listings, its
+players, their teams, then the cache versions. Values are loaded into NumPy
+arrays as integer cents and repriced with integer arithmetic that rounds half
+up to the cent, so no float ever touches a value. Only the changed rows are
+written, in one ``UPDATE ... FROM unnest(...)`` taking the ids and the cents
+as two array parameters, and their owners' squad_value moves by the same
+deltas in the same transaction.
+"""
+from collections import Counter
+from datetime import timedelta
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import (CacheVersion, MARKET_VERSION, POSITION_CHOICES, Player, Team, TransactionHistory, TransferListing,
+                     team_version_keys)
+
+POSITIONS = tuple(code for code, _ in POSITION_CHOICES)
+BASIS = 10_000  # rates are integers in basis points
+MAX_CENTS = 2 ** 62 // (4 * BASIS)  # the int64 arithmetic below cannot overflow under this
+
+
+def cents(field):
+    # numeric(20, 2) * 100 is a whole number: exact as bigint
+    return Cast(F(field) * 100, BigIntegerField())
+
+
+def write_cents(model, column, pks, amounts, increment=False):
+    """
+    Set (or, with ``increment``, add to) the money ``column`` of rows ``pks``
+    (ascending) from cents. Two array parameters however many rows: a VALUES
+    list takes a placeholder per value, which psycopg takes longer to parse
+    than PostgreSQL to run. The id range keeps the join to the rows' part of
+    the primary key index instead of the table's whole head.
+    """
+    quote = connection.ops.quote_name
+    table, name = quote(model._meta.db_table), quote(model._meta.get_field(column).column)
+    pk = f"{table}.{quote(model._meta.pk.column)}"
+    value = f"{table}.{name} + v.amount / 100" if increment else "v.amount / 100"
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {table} SET {name} = {value} "
+                       f"FROM unnest(%s::bigint[], %s::numeric[]) AS v(pk, amount) "
+                       f"WHERE {pk} = v.pk AND {pk} BETWEEN %s AND %s", [pks, amounts, pks[0], pks[-1]])
+        return cursor.rowcount
+
+
+def round_div(numerator, denominator):
+    """``numerator / denominator`` rounded half up, elementwise, in integers."""
+    return np.floor_divide(2 * numerator + denominator, 2 * denominator)
+
+
+def demand_rates(trades, players, sensitivity, max_change):
+    """
+    Each position's multiplier in basis points, indexed like POSITIONS, from
+    ``{position: trades}`` and ``{position: players}``. There is one more slot
+    past the end for positions outside POSITION_CHOICES, left at 1.0.
+    """
+    rates = np.full(len(POSITIONS) + 1, BASIS, dtype=np.int64)
+    total_trades, total_players = sum(trades.values()), sum(players.values())
+    if not total_trades:
+        return rates
+    league = total_trades / total_players
+    for code, position in enumerate(POSITIONS):
+        if players.get(position):
+            demand = trades.get(position, 0) / players[position] / league
+            factor = min(max(1 + sensitivity * (demand - 1), 1 - max_change), 1 + max_change)
+            rates[code] = round(factor * BASIS)
+    return rates
+
+
+class Revaluation:
+    def __init__(self, window=timedelta(days=30), anchor=0.5, sensitivity=0.25, max_change=0.2,
+                 chunk_size=20_000):
+        if not 0 <= anchor <= 1:
+            raise ValueError("anchor must be between 0 and 1.")
+        if not 0 <= max_change < 1:
+            raise ValueError("max_change must be at least 0 and below 1.")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be >= 1.")
+        self.window = window
+        self.anchor = round(anchor * BASIS)
+        self.sensitivity = sensitivity
+        self.max_change = round(max_change * BASIS)
+        self.chunk_size = chunk_size
+        self.sold_ids = self.sold_cents = np.zeros(0, dtype=np.int64)
+        self.rates = np.full(len(POSITIONS) + 1, BASIS, dtype=np.int64)
+        self.stats = Counter()
+
+    def load(self):
+        """Read the market signal: the latest sale price of every player sold in the window, and the demand rates."""
+        recent = TransactionHistory.objects.filter(created_at__gte=timezone.now() - self.window, player__isnull=False)
+        sales = np.array(list(recent.order_by('player_id', '-created_at', '-pk').distinct('player_id')
+                              .values_list('player_id', cents('amount'))), dtype=np.int64).reshape(-1, 2)
+        if len(sales) and sales[:, 1].max() >= MAX_CENTS:
+            raise ValueError("A sale price is too large to revalue from.")
+        self.sold_ids, self.sold_cents = sales[:, 0], sales[:, 1]  # sorted by player id, as searchsorted needs
+        trades = dict(recent.order_by().values_list('player__position').annotate(n=Count('pk')))
+        players = dict(Player.objects.order_by().values_list('position').annotate(n=Count('pk')))
+        self.rates = demand_rates(trades, players, self.sensitivity, self.max_change / BASIS)
+        self.stats.update(sold=len(sales), trades=sum(trades.values()))
+
+    def reprice(self, pks, positions, values):
+        """New values in cents for players ``pks`` (ascending), their POSITIONS indexes and values in cents."""
+        if len(values) and values.max() >= MAX_CENTS:
+            raise ValueError("A player value is too large to revalue.")
+        target = values
+        if len(self.sold_ids):
+            at = np.searchsorted(self.sold_ids, pks).clip(max=len(self.sold_ids) - 1)
+            last = np.where(self.sold_ids[at] == pks, self.sold_cents[at], values)
+            # a weighted mean of non-negative terms: half up is ROUND_HALF_UP, as for every step here
+            target = round_div((BASIS - self.anchor) * values + self.anchor * last, BASIS)
+        repriced = round_div(target * self.rates[positions], BASIS)
+        low = round_div(values * (BASIS - self.max_change), BASIS)
+        high = round_div(values * (BASIS + self.max_change), BASIS)
+        return np.clip(repriced, low, high)
+
+    def revalue_chunk(self, last_pk):
+        """Revalue up to chunk_size players after ``last_pk`` in one transaction; the last pk done, None at the end."""
+        bound = list(Player.objects.filter(pk__gt=last_pk).order_by('pk')
+                     .values_list('pk', flat=True)[self.chunk_size - 1:self.chunk_size])
+        span = {'gt': last_pk, **({'lte': bound[0]} if bound else {})}
+        position = Case(*[When(position=p, then=Value(code)) for code, p in enumerate(POSITIONS)],
+                        default=Value(len(POSITIONS)), output_field=IntegerField())
+        owner = Coalesce('owner_id', Value(0), output_field=BigIntegerField())  # 0: a free agent
+
+        with transaction.atomic():
+            listed = list(TransferListing.objects.select_for_update().order_by('pk')
+                          .filter(active=True, **{f'player_id__{k}': v for k, v in span.items()})
+                          .values_list('player_id', flat=True))
+            rows = list(Player.objects.select_for_update().order_by('pk')
+                        .filter(**{f'pk__{k}': v for k, v in span.items()})
+                        .values_list('pk', owner, position, cents('value')))
+            if not rows:
+                return None
+            pks, owners, positions, values = np.array(rows, dtype=np.int64).T
+            new = self.reprice(pks, positions, values)
+            self.stats.update(players=len(rows), chunks=1)
+
+            changed = np.flatnonzero(new != values)
+            if len(changed):
+                write_cents(Player, 'value', pks[changed].tolist(), new[changed].tolist())
+
+                # every owner's squad moves by the sum of its players' deltas, exactly
+                owned = changed[owners[changed] != 0]
+                team_ids, at = np.unique(owners[owned], return_inverse=True)
+                deltas = np.zeros(len(team_ids), dtype=np.int64)
+                np.add.at(deltas, at, new[owned] - values[owned])
+                team_ids = team_ids.tolist()
+                list(Team.objects.select_for_update().filter(pk__in=team_ids).order_by('pk')
+                     .values_list('pk', flat=True))
+                moved = np.flatnonzero(deltas)
+                if len(moved):
+                    write_cents(Team, 'squad_value', [team_ids[i] for i in moved], deltas[moved].tolist(),
+                                increment=True)
+                market = np.isin(pks[changed], listed).any()
+                CacheVersion.bump(*team_version_keys(team_ids), *([MARKET_VERSION] if market else []))
+                self.stats.update(changed=len(changed), teams=len(team_ids))
+        return int(pks[-1])
+
+    def run(self, progress=None):
+        """Load the market signal and revalue every player; ``progress(stats)`` is called after each chunk."""
+        self.load()
+        last_pk = self.revalue_chunk(0)
+        while last_pk is not None:
+            if progress is not None:
+                progress(self.stats)
+            last_pk = self.revalue_chunk(last_pk)
+        return self.stats
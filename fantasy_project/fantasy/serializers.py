@@ -1,8 +1,13 @@
 from rest_framework import serializers
-from .models import Team, Player, TransferListing, Transaction
+from rest_framework.settings import api_settings
+from .models import Team, Player, TransferListing, Transaction, Order, POSITION_CHOICES
+from .settlement import MAX_BATCH
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Sum
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 import random
 
@@ -64,6 +69,10 @@ class TeamSerializer(serializers.ModelSerializer):
         fields = ('id','name','user','capital','players','created_at','total_value')
         read_only_fields = ('capital',)  # cannot modify via API
 
+def _non_field_error(message):
+    # for checks made in create(), shaped like the ones validate() raises
+    return serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
 class TeamCreateSerializer(serializers.ModelSerializer):
     players = serializers.ListField(
         child=serializers.IntegerField(),
@@ -73,20 +82,52 @@ class TeamCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Team
         fields = ('id','name','user','capital','players','created_at','total_value')
-        read_only_fields = ('capital',)  # cannot modify via API
+        # the team is always the requesting user's; capital cannot be modified via API
+        read_only_fields = ('capital', 'user')
 
     def validate(self, data):
         player_ids = data.get("players", [])
-        players = Player.objects.filter(id__in=player_ids, owner__isnull=True)
 
-        # Ensure all players are available
-        if players.count() != len(player_ids):
+        if len(player_ids) > 20:
+            raise serializers.ValidationError("A team must have exactly 20 players.")
+        if len(set(player_ids)) != len(player_ids):
             raise serializers.ValidationError("Some players are not available or already owned.")
 
+        # availability, composition and cost are checked in create(), on locked rows
+        return data
 
-        if len(player_ids) > 20:
-            raise serializers.ValidationError("A team must have exactly 20 players.")
+    def create(self, validated_data):
+        player_ids = validated_data.pop("players")
+        user = self.context["request"].user
+
+        # one team per user is enforced by the unique user_id on insert, not by a lookup up front
+        try:
+            with transaction.atomic():
+                # lock the free agents (lowest id first, like every other writer) and add them up by
+                # position in the same statement; a player drafted meanwhile no longer matches
+                free = (Player.objects.select_for_update().filter(id__in=player_ids, owner__isnull=True)
+                        .order_by('pk').values('pk'))
+                by_position = {row['position']: row for row in
+                               Player.objects.filter(pk__in=free).order_by().values('position')
+                               .annotate(count=Count('pk'), cost=Sum('value'))}
+                self.check_squad(player_ids, by_position)
+                total_cost = sum(row['cost'] for row in by_position.values())
+
+                # Deduct from capital; the squad value is stored with the team in the same insert
+                team = Team.objects.create(user_id=user.pk, name=validated_data["name"],
+                                           capital=5000000 - total_cost, squad_value=total_cost)
+
+                # Assign players to this team; the rows are locked, so all of them must still be free
+                if Player.objects.filter(id__in=player_ids, owner__isnull=True).update(owner=team) != len(player_ids):
+                    raise _non_field_error("Some players are not available or already owned.")
+        except IntegrityError:  # a concurrent request created this user's team first
+            raise serializers.ValidationError("You already have a team.")
 
+        return team
+
+    def check_squad(self, player_ids, by_position):
+        if sum(row['count'] for row in by_position.values()) != len(player_ids):
+            raise _non_field_error("Some players are not available or already owned.")
 
         required_positions = {
             "GK": 2,
@@ -95,49 +136,23 @@ class TeamCreateSerializer(serializers.ModelSerializer):
             "ATT": 6,
         }
 
-        position_counts = {pos: 0 for pos in required_positions}
-        for p in players:
-            if p.position in position_counts:
-                position_counts[p.position] += 1
-
         for pos, required_count in required_positions.items():
-            if position_counts[pos] > required_count:
-                raise serializers.ValidationError(
+            selected = by_position.get(pos, {}).get('count', 0)
+            if selected > required_count:
+                raise _non_field_error(
                     f"Invalid team composition: {pos} must have {required_count}, "
-                    f"but you selected {position_counts[pos]}."
+                    f"but you selected {selected}."
                 )
 
-        total_cost = sum(p.value for p in players)
+        total_cost = sum(row['cost'] for row in by_position.values())
         if total_cost > 5000000:  # initial budget
-            raise serializers.ValidationError("Selected players exceed initial budget of $5,000,000.")
-
-        return data
-
-    def create(self, validated_data):
-        player_ids = validated_data.pop("players")
-        user = self.context["request"].user
-
-        if hasattr(user, "team"):
-            raise serializers.ValidationError("You already have a team.")
-
-        team = Team.objects.create(user=user,name=validated_data["name"], capital=5000000)
-
-        players = Player.objects.filter(id__in=player_ids, owner__isnull=True)
-        total_cost = sum(p.value for p in players)
-
-        # Deduct from capital
-        team.capital -= total_cost
-        team.save()
-
-        # Assign players to this team
-        players.update(owner=team)
-
-        return team
+            raise _non_field_error("Selected players exceed initial budget of $5,000,000.")
 
 class TransferListingSerializer(serializers.ModelSerializer):
     seller = serializers.StringRelatedField(read_only=True)
     player = PlayerSerializer(read_only=True)
-    player_id = serializers.PrimaryKeyRelatedField(queryset=Player.objects.all(), write_only=True, source='player')
+    player_id = serializers.PrimaryKeyRelatedField(queryset=Player.objects.select_related('owner__user', 'listing'),
+                                                   write_only=True, source='player')
     class Meta:
         model = TransferListing
         fields = ('id','player','player_id','price','seller','created_at','active')
@@ -145,7 +160,7 @@ class TransferListingSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         player = attrs['player']
         request = self.context['request']
-        if player.owner.user != request.user:
+        if player.owner is None or player.owner.user_id != request.user.id:
             raise serializers.ValidationError("Only the owner can list this player.")
         # Ensure player isn't already listed
         if hasattr(player, 'listing') and player.listing.active:
@@ -156,10 +171,42 @@ class TransferListingSerializer(serializers.ModelSerializer):
         player = validated_data['player']
         seller = player.owner
         price = validated_data['price']
-        print("create",player,seller,price)
         listing = TransferListing.objects.create(player=player, seller=seller, price=price, active=True)
         return listing
 
+class MarketListingSerializer(serializers.ModelSerializer):
+    # expects listings fetched with select_related('player__owner__user', 'seller')
+    listing_id = serializers.IntegerField(source='id', read_only=True)
+    player = PlayerSerializer(read_only=True)
+    seller = serializers.CharField(source='seller.name', read_only=True)
+    class Meta:
+        model = TransferListing
+        fields = ('listing_id','player','price','seller')
+        read_only_fields = fields
+
+class BatchBuySerializer(serializers.Serializer):
+    listing_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                        max_length=MAX_BATCH)
+
+ANALYTICS_DAYS = 30  # the range when ?since= is not given
+MAX_ANALYTICS_DAYS = 366
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    # the query string of the /analytics/ endpoints: days since..until (inclusive), until defaulting to today
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    position = serializers.ChoiceField(choices=POSITION_CHOICES, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, data):
+        until = data.get('until') or timezone.localdate()
+        since = data.get('since') or until - timedelta(days=ANALYTICS_DAYS - 1)
+        if since > until:
+            raise serializers.ValidationError({'since': "Must not be after until."})
+        if (until - since).days >= MAX_ANALYTICS_DAYS:
+            raise serializers.ValidationError({'since': f"At most {MAX_ANALYTICS_DAYS} days at once."})
+        return {**data, 'since': since, 'until': until}
+
 class TransactionSerializer(serializers.ModelSerializer):
     buyer = serializers.StringRelatedField(read_only=True)
     seller = serializers.StringRelatedField(read_only=True)
@@ -168,3 +215,52 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = ('id','buyer','seller','player','amount','created_at','active')
         read_only_fields = fields  # transactions are read-only via API
+
+class OrderSerializer(serializers.ModelSerializer):
+    team = serializers.StringRelatedField(read_only=True)
+    player_id = serializers.PrimaryKeyRelatedField(queryset=Player.objects.all(), source='player',
+                                                   required=False, allow_null=True)
+    position = serializers.ChoiceField(choices=POSITION_CHOICES, required=False)
+    class Meta:
+        model = Order
+        fields = ('id','team','side','player_id','position','price','status','transaction','created_at')
+        read_only_fields = ('status','transaction','created_at')
+
+    def validate_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Price must be positive.")
+        return value
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        # str(team) in the response needs the user
+        team = Team.objects.select_related('user').filter(user_id=user.pk).first()
+        if team is None:
+            raise serializers.ValidationError("You need a team to trade players.")
+        player = attrs.get('player')
+        if attrs['side'] == Order.ASK:
+            # asks always name a player: a team can only offer what it owns
+            if player is None or player.owner_id != team.pk:
+                raise serializers.ValidationError("An ask must name one of your players.")
+            if Order.objects.filter(player=player, team=team, side=Order.ASK, status=Order.OPEN).exists():
+                raise serializers.ValidationError("This player already has an open ask.")
+        else:
+            if (player is None) == ('position' not in attrs):
+                raise serializers.ValidationError("A bid names either a player_id or a position.")
+            if player is not None and player.owner_id == team.pk:
+                raise serializers.ValidationError("Cannot bid on your own player.")
+        if player is not None:
+            attrs['position'] = player.position
+        attrs['team'] = team
+        return attrs
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                if validated_data['side'] == Order.ASK:
+                    # asks left behind by a previous owner can never fill
+                    Order.objects.filter(player=validated_data['player'], side=Order.ASK, status=Order.OPEN
+                                         ).exclude(team=validated_data['team']).update(status=Order.CANCELLED)
+                return Order.objects.create(**validated_data)
+        except IntegrityError:  # a concurrent ask on the same player won
+            raise serializers.ValidationError("This player already has an open ask.")
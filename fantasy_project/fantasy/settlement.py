@@ -0,0 +1,266 @@
+"""
+Settlement of transfer-market purchases.
+
+Every writer that touches more than one of these rows takes its locks in the
+same global order, so two teams buying from each other cannot deadlock:
+
+    0. order-book orders, in ascending id (settle_fills only)
+    1. transfer listings and their players, in ascending listing id
+       (one SELECT ... FOR UPDATE ... ORDER BY id); settle_fills locks the
+       active listings first, then the players, in ascending player id
+    2. teams, in ascending id (one SELECT ... FOR UPDATE ... ORDER BY id)
+    3. the leaderboard tree (LeaderboardNode), root first, taken by the team
+       table's triggers when the teams are written: every team lock must be
+       held by then
+    4. the analytics rollups (fantasy/analytics.py): PositionDay in key
+       order, with PlayerDay, in one statement
+    5. the cache versions (CacheVersion) of the teams and the market, in
+       one statement, always last
+
+A request with an Idempotency-Key holds its key's row (fantasy/idempotency.py)
+before any of these.
+
+Side effects of a settlement that need not hold these locks (notifications,
+audit...) are queued as outbox messages in the same transaction and run by
+``manage.py run_outbox`` after it commits (fantasy/outbox.py).
+
+Capital and ownership are checked by the conditional UPDATEs themselves
+(``WHERE capital >= total`` / ``WHERE owner_id = seller``) rather than by
+reading rows first and writing them back. Each table is written with one
+statement, so a batch costs the same number of round trips as one purchase.
+"""
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+
+from . import analytics, outbox
+from .models import (Team, Player, TransferListing, Transaction, Order, CacheVersion, MARKET_VERSION,
+                     team_version_keys)
+
+MAX_BATCH = 50
+SELLER_GONE = "Seller no longer owns player."
+_MONEY = DecimalField(max_digits=20, decimal_places=2)
+
+
+class SettlementError(Exception):
+    """A purchase that cannot go through; ``detail`` is safe to show the client."""
+    status_code = 400
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class ListingNotFound(SettlementError):
+    status_code = 404
+
+
+def bumped_value(value):
+    # Random value increase: e.g., between 5% and 15%
+    increase_pct = Decimal(random.uniform(0.05, 0.15))
+    return (value * (Decimal('1.0') + increase_pct)).quantize(Decimal('0.01'))
+
+
+def _per_row(values):
+    """CASE id WHEN ... THEN ... for a {pk: Decimal} mapping."""
+    return Case(*[When(pk=pk, then=Value(v, output_field=_MONEY)) for pk, v in values.items()], output_field=_MONEY)
+
+
+def _update_rows(model, columns, rows, increment=()):
+    """
+    One ``UPDATE ... FROM (VALUES ...)`` setting ``columns`` per primary key;
+    ``rows`` are ``(pk, *values)`` tuples, columns named in ``increment`` are
+    added to rather than replaced. CASE/WHEN does the same, but Django takes
+    longer to build it for a few hundred rows than the database takes to run it.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in columns]
+    names = [quote(f.column) for f in fields]
+    row = "(" + ", ".join([f"CAST(%s AS {model._meta.pk.cast_db_type(connection)})"]
+                          + [f"CAST(%s AS {f.cast_db_type(connection)})" for f in fields]) + ")"
+    assignments = ", ".join(
+        f"{name} = {table}.{name} + v.{name}" if f.name in increment else f"{name} = v.{name}"
+        for f, name in zip(fields, names)
+    )
+    sql = (f"UPDATE {table} SET {assignments} FROM (VALUES {', '.join([row] * len(rows))}) "
+           f"AS v(pk, {', '.join(names)}) WHERE {table}.{quote(model._meta.pk.column)} = v.pk")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for r in rows for value in r])
+        return cursor.rowcount
+
+
+def settle_listing(listing_id, buyer_team_id):
+    """Buy one active listing for ``buyer_team_id``; see settle_listings()."""
+    try:
+        listing_id = int(listing_id)
+    except (TypeError, ValueError):
+        raise ListingNotFound("No TransferListing matches the given query.")
+    return settle_listings([listing_id], buyer_team_id)[0]
+
+
+def settle_listings(listing_ids, buyer_team_id):
+    """
+    Buy every listing in ``listing_ids`` for ``buyer_team_id``, all or nothing.
+
+    Runs in one transaction of ten statements whatever the batch size: lock
+    listings+players, move the players, lock the teams, debit/credit them,
+    insert the settled Transactions, close the listings, add them to the
+    analytics rollups, queue their transfer.settled outbox messages and bump
+    the teams' and the market's versions. The buyer's capital is checked
+    once against the total. Returns the Transactions in listing id order;
+    raises SettlementError (nothing written) when any purchase is not
+    allowed.
+    """
+    listing_ids = sorted(set(listing_ids))
+    if not listing_ids:
+        raise SettlementError("No listings given.")
+    if len(listing_ids) > MAX_BATCH:
+        raise SettlementError(f"At most {MAX_BATCH} listings can be bought at once.")
+
+    with transaction.atomic():
+        listings = list(TransferListing.objects.select_for_update().select_related('player')
+                        .filter(pk__in=listing_ids, active=True).order_by('pk'))
+        if len(listings) != len(listing_ids):
+            if len(listing_ids) == 1:
+                raise ListingNotFound("No TransferListing matches the given query.")
+            missing = sorted(set(listing_ids) - {l.pk for l in listings})
+            raise ListingNotFound(f"Listings not active: {', '.join(map(str, missing))}.")
+        if any(l.seller_id == buyer_team_id for l in listings):
+            raise SettlementError("Cannot buy your own player.")
+
+        new_values = {l.player_id: bumped_value(l.player.value) for l in listings}
+        total = sum(l.price for l in listings)
+
+        # Change player owners, only where the seller still owns the player
+        still_owned = Q()
+        for l in listings:
+            still_owned |= Q(pk=l.player_id, owner_id=l.seller_id)
+        moved = Player.objects.filter(still_owned).update(owner_id=buyer_team_id, value=_per_row(new_values))
+        if moved != len(listings):
+            raise SettlementError(SELLER_GONE)
+
+        # Transfer money (and the players' value) between the teams
+        capital = {buyer_team_id: -total}
+        squad = {buyer_team_id: sum(new_values.values())}
+        for l in listings:
+            capital[l.seller_id] = capital.get(l.seller_id, 0) + l.price
+            squad[l.seller_id] = squad.get(l.seller_id, 0) - l.player.value
+        # lock every team involved, lowest id first, before writing any of them (evaluated for the locks)
+        list(Team.objects.select_for_update().filter(pk__in=capital).order_by('pk').values_list('pk', flat=True))
+        updated = Team.objects.filter(
+            Q(pk=buyer_team_id, capital__gte=total) | Q(pk__in=[t for t in capital if t != buyer_team_id])
+        ).update(capital=F('capital') + _per_row(capital), squad_value=F('squad_value') + _per_row(squad))
+        if updated != len(capital):
+            raise SettlementError("Insufficient capital.")
+
+        # As per constraint: "Once a transfer is completed, the corresponding transfer entry should be
+        # marked as inactive and cannot be deleted." The records are written already settled.
+        txs = Transaction.objects.bulk_create([
+            Transaction(buyer_id=buyer_team_id, seller_id=l.seller_id, player_id=l.player_id,
+                        amount=l.price, active=False)
+            for l in listings
+        ])
+
+        # Mark listings inactive (can't be reused)
+        TransferListing.objects.filter(pk__in=listing_ids).update(active=False)
+        analytics.record((tx.created_at, l.player.position, l.player_id, l.price) for tx, l in zip(txs, listings))
+        outbox.transfer_settled(txs)
+        CacheVersion.bump(*team_version_keys(capital), MARKET_VERSION)
+
+    return txs
+
+
+def settle_fills(fills):
+    """
+    Write order-book fills (``fantasy.orderbook.Fill``) in one transaction.
+
+    Unlike settle_listings() a batch is not all or nothing: each fill is
+    checked in turn against the locked rows - both orders still open, the
+    seller still owns the player, the buyer can afford it after the fills
+    before it - and the ones that pass are written together, with the same
+    constant number of statements whatever the batch size. An order that
+    fails a check is cancelled (unless it was no longer open anyway).
+
+    Returns ``(transactions, rejected)``: a list aligned with ``fills``
+    holding each fill's Transaction or None, and ``{order_id: reason}`` for
+    every order that can no longer trade.
+    """
+    if not fills:
+        return [], {}
+    player_ids = {f.player_id for f in fills}
+
+    with transaction.atomic():
+        open_ids = set(Order.objects.select_for_update().order_by('pk')
+                       .filter(pk__in=[o.id for f in fills for o in (f.bid, f.ask)], status=Order.OPEN)
+                       .values_list('pk', flat=True))
+        listings = list(TransferListing.objects.select_for_update().order_by('pk')
+                        .filter(player_id__in=player_ids, active=True).values_list('pk', 'player_id'))
+        players, positions = {}, {}
+        for pk, owner_id, value, position in (Player.objects.select_for_update().order_by('pk')
+                                              .filter(pk__in=player_ids)
+                                              .values_list('pk', 'owner_id', 'value', 'position')):
+            players[pk], positions[pk] = (owner_id, value), position
+        capital = dict(Team.objects.select_for_update().order_by('pk')
+                       .filter(pk__in={o.team_id for f in fills for o in (f.bid, f.ask)})
+                       .values_list('pk', 'capital'))
+
+        rejected, cancelled, settled = {}, set(), []
+        for f in fills:
+            bid, ask = f.bid, f.ask
+            owner_id, value = players.get(f.player_id, (None, None))
+            for order in (bid, ask):
+                if order.id not in open_ids:
+                    rejected[order.id] = "Order is no longer open."
+            if bid.id in rejected or ask.id in rejected:
+                continue
+            if owner_id != ask.team_id or ask.team_id not in capital:
+                rejected[ask.id] = SELLER_GONE
+            elif bid.team_id not in capital or capital[bid.team_id] < f.price:
+                rejected[bid.id] = "Insufficient capital."
+            else:
+                new_value = bumped_value(value)
+                capital[bid.team_id] -= f.price
+                capital[ask.team_id] += f.price
+                players[f.player_id] = (bid.team_id, new_value)
+                open_ids -= {bid.id, ask.id}
+                settled.append((f, value, new_value))
+                continue
+            cancelled.update(order_id for order_id in (bid.id, ask.id) if order_id in rejected)
+
+        txs = {}
+        if settled:
+            capital_delta, squad_delta = {}, {}
+            for f, old_value, new_value in settled:
+                for team_id, money, squad in ((f.bid.team_id, -f.price, new_value),
+                                              (f.ask.team_id, f.price, -old_value)):
+                    capital_delta[team_id] = capital_delta.get(team_id, 0) + money
+                    squad_delta[team_id] = squad_delta.get(team_id, 0) + squad
+            moved = {f.player_id: (f.bid.team_id, new_value) for f, _, new_value in settled}
+            _update_rows(Player, ('owner', 'value'), [(pk, *row) for pk, row in moved.items()])
+            _update_rows(Team, ('capital', 'squad_value'),
+                         [(pk, capital_delta[pk], squad_delta[pk]) for pk in capital_delta],
+                         increment=('capital', 'squad_value'))
+            created = Transaction.objects.bulk_create([
+                Transaction(buyer_id=f.bid.team_id, seller_id=f.ask.team_id, player_id=f.player_id,
+                            amount=f.price, active=False)
+                for f, _, _ in settled
+            ])
+            txs = {id(f): tx for (f, _, _), tx in zip(settled, created)}
+            _update_rows(Order, ('status', 'transaction'),
+                         [(o.id, Order.FILLED, txs[id(f)].pk) for f, _, _ in settled for o in (f.bid, f.ask)]
+                         + [(pk, Order.CANCELLED, None) for pk in cancelled])
+            # a player sold through the book is off the fixed-price market too
+            closed = [pk for pk, player_id in listings if player_id in moved]
+            if closed:
+                TransferListing.objects.filter(pk__in=closed).update(active=False)
+            analytics.record((tx.created_at, positions[f.player_id], f.player_id, f.price)
+                             for (f, _, _), tx in zip(settled, created))
+            outbox.transfer_settled(created)
+            CacheVersion.bump(*team_version_keys(capital_delta), *([MARKET_VERSION] if closed else []))
+        elif cancelled:
+            Order.objects.filter(pk__in=cancelled).update(status=Order.CANCELLED)
+
+    return [txs.get(id(f)) for f in fills], rejected
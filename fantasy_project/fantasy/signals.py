@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Team, Player
+from .authentication import revoke_tokens
+from .models import Team, Player, TransferListing, CacheVersion, MARKET_VERSION, adjust_squad_values, team_version_key
 import random
 from decimal import Decimal
 
@@ -20,3 +21,46 @@ from decimal import Decimal
 #                     owner=team,
 #                     value=Decimal('1000000.00')
 #                 )
+
+
+@receiver(post_delete, sender=Player)
+def remove_deleted_player_from_squad_value(sender, instance, **kwargs):
+    # runs inside the deletion's transaction; also covers admin bulk deletes
+    if instance.owner_id is not None:
+        adjust_squad_values({instance.owner_id: -instance.value})
+        CacheVersion.bump(team_version_key(instance.owner_id))
+
+
+# fields a token depends on: changing any of them revokes the user's tokens
+_AUTH_FIELDS = ('is_active', 'password', 'username')
+
+
+@receiver(pre_save, sender=User)
+def detect_auth_change(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    stored = User.objects.filter(pk=instance.pk).values_list(*_AUTH_FIELDS).first()
+    instance._revoke_tokens = stored is not None and stored != tuple(getattr(instance, f) for f in _AUTH_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_auth_change(sender, instance, **kwargs):
+    if getattr(instance, '_revoke_tokens', False):
+        instance._revoke_tokens = False
+        revoke_tokens(instance.pk)
+        # teams/me shows the username, and so do the market rows of the team's listings
+        team_id = Team.objects.filter(user_id=instance.pk).values_list('pk', flat=True).first()
+        if team_id is not None:
+            market = [MARKET_VERSION] if TransferListing.objects.filter(seller_id=team_id, active=True).exists() else []
+            CacheVersion.bump(team_version_key(team_id), *market)
+
+
+@receiver(post_delete, sender=User)
+def revoke_tokens_of_deleted_user(sender, instance, **kwargs):
+    revoke_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=Team)
+def revoke_tokens_of_deleted_team(sender, instance, **kwargs):
+    # their tokens still name the team
+    revoke_tokens(instance.user_id)
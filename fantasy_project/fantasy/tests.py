@@ -1,18 +1,48 @@
 import pytest
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
+import json
+import random
+import threading
+import time
+import tracemalloc
+import csv
+from datetime import timedelta
+from io import StringIO
+import numpy as np
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import Count, F, Sum
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import AsyncClient
 
 User = get_user_model()
 
-from .models import Team, Player, TransferListing, Transaction
+from .models import (Team, Player, TransferListing, Transaction, Order, CacheVersion, LeaderboardNode, PlayerDay,
+                     PositionDay, OutboxMessage, IdempotencyKey, ArchivedTransaction, MARKET_VERSION, POSITION_CHOICES)
+from .settlement import settle_listing, settle_listings, settle_fills, SettlementError
+from .orderbook import OrderBook, BookOrder, Fill, BID, ASK
+from .matching import MatchingEngine
+from .middleware import QueryBudgetExceeded
+from .views import TransferListingViewSet
+from . import analytics, archive, db_pool, db_router, exports, idempotency, leaderboard, outbox
+from .revaluation import Revaluation
+from .authentication import ClaimsTokenObtainPairSerializer
 
 # Helper constants
 INITIAL_TEAM_CAPITAL = Decimal('5000000.00')
 INITIAL_PLAYER_VALUE = Decimal('1000000.00')
 PLAYERS_PER_TEAM = 20
+POSITIONS_CYCLE = ('GK', 'DEF', 'MID', 'ATT')
 POSITIONS = {"GK": 2, "DEF": 6, "MID": 6, "ATT": 6}
 
 @pytest.mark.django_db
@@ -94,12 +124,39 @@ class TestFullFootballTransferFlow:
                 name=name,
                 user=user,
                 capital=INITIAL_TEAM_CAPITAL - sum(p.value for p in players),
+                squad_value=sum(p.value for p in players),
             )
             team.players.set(players)
             return team
 
         return make_team
 
+    @pytest.fixture
+    def bearer(self, db):
+        """Authorization headers for ``username``, with the claims a login would give."""
+        def _headers(username):
+            token = ClaimsTokenObtainPairSerializer.get_token(User.objects.get(username=username)).access_token
+            return {'Authorization': f"Bearer {token}"}
+
+        return _headers
+
+    @pytest.fixture
+    def sync_and_async(self, client, settings):
+        """
+        ``(sync, served)``: one GET through the WSGI urls and through the async
+        ones, each on an empty cache. The async urls stay in place, for
+        ``served.resolver_match`` (resolved on first use) and any request after.
+        """
+        def _get(path, headers):
+            settings.ROOT_URLCONF = 'fantasy_project.urls'
+            cache.clear()
+            sync = client.get(path, headers=headers)
+            settings.ROOT_URLCONF = 'fantasy_project.asgi_urls'
+            cache.clear()
+            return sync, async_to_sync(AsyncClient().get)(path, headers=headers)
+
+        return _get
+
     def test_registration_creates_user_team_and_players(self, client):
         url = reverse('user-list')
         payload = {
@@ -190,7 +247,7 @@ class TestFullFootballTransferFlow:
         resp_market = client.get(url_market)
         assert resp_market.status_code == status.HTTP_200_OK
         found = False
-        for item in resp_market.data:
+        for item in resp_market.data['results']:
             if str(item.get('listing_id')) == str(listing_id) or item.get('player', {}).get('id') == player.id:
                 found = True
                 assert Decimal(item['price']) == Decimal('1500000.00')
@@ -444,4 +501,1648 @@ class TestFullFootballTransferFlow:
 
         assert resp.status_code == status.HTTP_400_BAD_REQUEST
 
+    def test_team_creation_claims_free_agents_in_one_pass(self, client, create_user, create_players, create_team):
+        user = create_user("drafter")
+        client.force_authenticate(user=user)
+        squad = create_players(POSITIONS)
+        taken = create_team(user=create_user("early_bird")).players.first()
+        url = reverse("team-list")
+
+        # an owned player fails the whole draft, leaving the free agents free
+        resp = client.post(url, {"name": "Late XI", "players": [p.id for p in squad[:19]] + [taken.id]}, format="json")
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert resp.data == {"non_field_errors": ["Some players are not available or already owned."]}
+        assert not Team.objects.filter(user=user).exists()
+        assert Player.objects.filter(pk__in=[p.id for p in squad], owner__isnull=True).count() == 20
+
+        # one locking aggregate, the insert and the claiming update
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.post(url, {"name": "Dream XI", "players": [p.id for p in squad]}, format="json")
+        assert resp.status_code == status.HTTP_201_CREATED
+        assert resp.data["user"] == user.id
+        assert len([q for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]) == 3
+        team = Team.objects.get(user=user)
+        assert team.players.count() == 20
+        assert (team.capital, team.squad_value) == (INITIAL_TEAM_CAPITAL - Decimal('2000000.00'), Decimal('2000000.00'))
+
+        spare = create_players({"GK": 1})
+        resp = client.post(url, {"name": "Second XI", "players": [spare[0].id]}, format="json")
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert "You already have a team" in str(resp.data)
+        assert Player.objects.get(pk=spare[0].id).owner is None
+
+    def test_market_query_count_does_not_grow_with_listings(self, client, create_user, create_team):
+        seller = create_user('market_seller')
+        viewer = create_user('market_viewer')
+        team = create_team(user=seller, name="Sellers FC")
+        players = list(team.players.all())
+
+        client.force_authenticate(user=viewer)
+        url = reverse('player-market')
+
+        TransferListing.objects.create(player=players[0], seller=team, price=Decimal('1000000.00'))
+        with CaptureQueriesContext(connection) as one_listing:
+            resp = client.get(url)
+        assert resp.status_code == status.HTTP_200_OK
+        assert len(resp.data['results']) == 1
+
+        TransferListing.objects.bulk_create([
+            TransferListing(player=p, seller=team, price=Decimal('1000000.00')) for p in players[1:]
+        ])
+        CacheVersion.bump(MARKET_VERSION)  # bulk_create skips save(), which normally bumps it
+        with CaptureQueriesContext(connection) as many_listings:
+            resp = client.get(url)
+        assert resp.status_code == status.HTTP_200_OK
+        assert len(resp.data['results']) == PLAYERS_PER_TEAM
+
+        assert len(many_listings) == len(one_listing)
+
+    def test_market_filters_sorts_and_pages_with_cursor(self, client, create_user, create_team):
+        seller = create_user('market_seller2')
+        viewer = create_user('market_viewer2')
+        team = create_team(user=seller, name="Sellers FC")
+        for i, p in enumerate(team.players.filter(position='DEF')):
+            TransferListing.objects.create(player=p, seller=team, price=Decimal(100000 * (i + 1)))
+        TransferListing.objects.create(player=team.players.filter(position='GK').first(), seller=team,
+                                       price=Decimal('200000.00'))
+
+        client.force_authenticate(user=viewer)
+        url = reverse('player-market')
+        resp = client.get(url, {'position': 'def', 'min_price': 200000, 'max_price': 500000,
+                                'ordering': '-price', 'page_size': 2})
+        assert resp.status_code == status.HTTP_200_OK
+        assert [Decimal(r['price']) for r in resp.data['results']] == [Decimal('500000'), Decimal('400000')]
+        assert all(r['player']['position'] == 'DEF' for r in resp.data['results'])
+        assert resp.data['results'][0]['seller'] == team.name
+        assert resp.data['results'][0]['player']['owner'] == str(team)
+
+        resp_next = client.get(resp.data['next'])
+        assert [Decimal(r['price']) for r in resp_next.data['results']] == [Decimal('300000'), Decimal('200000')]
+        assert resp_next.data['next'] is None
+
+        resp_bad = client.get(url, {'min_price': 'cheap'})
+        assert resp_bad.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_team_squad_value_is_stored_and_kept_in_sync(self, client, create_user, create_players, create_team,
+                                                         monkeypatch):
+        user = create_user("squadowner")
+        client.force_authenticate(user=user)
+        players = create_players(POSITIONS, value=200_000)
+        resp = client.post(reverse("team-list"), {"user": user.id, "name": "Stored XI", "players": [p.id for p in players]},
+                           format="json")
+        assert resp.status_code == status.HTTP_201_CREATED
+        team = Team.objects.get(user=user)
+        assert team.squad_value == Decimal('4000000.00')
+        assert team.total_value == INITIAL_TEAM_CAPITAL
+
+        # buying moves the (bumped) value from the seller's squad to the buyer's
+        buyer = create_user("squadbuyer")
+        buyer_team = create_team(user=buyer, name="Buyers")
+        listing = TransferListing.objects.create(player=players[0], seller=team, price=Decimal('300000.00'))
+        monkeypatch.setattr('random.uniform', lambda a, b: 0.10)
+        client.force_authenticate(user=buyer)
+        resp_buy = client.post(reverse('listings-buy', args=[listing.id]), format='json')
+        assert resp_buy.status_code == status.HTTP_201_CREATED
+        team.refresh_from_db()
+        buyer_team.refresh_from_db()
+        assert team.squad_value == Decimal('3800000.00')
+        assert buyer_team.squad_value == Decimal('2000000.00') + Decimal('220000.00')
+
+        # single-row edits (admin, shell) and deletes keep it in sync too
+        player = players[1]
+        player.refresh_from_db()
+        player.value = Decimal('250000.00')
+        player.save()
+        team.refresh_from_db()
+        assert team.squad_value == Decimal('3850000.00')
+        player.delete()
+        team.refresh_from_db()
+        assert team.squad_value == Decimal('3600000.00')
+
+        # a stale capital edit never overwrites the stored squad value
+        stale = Team.objects.get(pk=team.pk)
+        Player.objects.get(pk=players[2].pk).delete()
+        stale.name = "Renamed XI"
+        stale.save()
+        team.refresh_from_db()
+        assert team.squad_value == Decimal('3400000.00')
+
+        call_command('rebuild_team_values', '--verify')
+
+    def test_rebuild_team_values_command_repairs_drift(self, create_user, create_team):
+        team = create_team(user=create_user('drifter'), name="Drift FC")
+        Team.objects.filter(pk=team.pk).update(squad_value=Decimal('1.00'))
+
+        with pytest.raises(CommandError):
+            call_command('rebuild_team_values', '--verify')
+
+        call_command('rebuild_team_values', '--batch-size', '1')
+        team.refresh_from_db()
+        assert team.squad_value == sum(p.value for p in team.players.all())
+        call_command('rebuild_team_values', '--verify')
+
+    def test_revalue_players_reprices_from_the_market_and_keeps_squads_in_step(self, create_user, create_team):
+        home, away = create_team('home', name="Home XI"), create_team('away', name="Away XI")
+        sold = home.players.filter(position='DEF').order_by('pk').first()
+        Transaction.objects.create(buyer=away, seller=home, player=sold, amount=Decimal('130000.00'), active=False)
+        stale = Transaction.objects.create(buyer=away, seller=home, player=home.players.filter(position='MID').first(),
+                                           amount=Decimal('500000.00'), active=False)
+        Transaction.objects.filter(pk=stale.pk).update(created_at=F('created_at') - timedelta(days=60))
+        keeper = away.players.filter(position='GK').first()
+        keeper.value = Decimal('10.05')
+        keeper.save()
+        free = Player.objects.create(name="Free Agent", position='ATT', value=Decimal('100.00'))
+        TransferListing.objects.create(player=away.players.filter(position='MID').first(), seller=away,
+                                       price=Decimal('150000.00'))
+        before = {key: CacheVersion.current(key) for key in (f"team:{home.pk}", f"team:{away.pk}", MARKET_VERSION)}
+
+        # 1 recent DEF trade for 12 of the 41 players: DEF demand 41/12 of the league's, the others none
+        call_command('revalue_players', '--sensitivity', '0.1', '--max-change', '0.5', '--chunk-size', '7',
+                     stdout=StringIO())
+
+        values = dict(Player.objects.values_list('pk', 'value'))
+        assert values[sold.pk] == Decimal('142795.50')  # halfway to its sale price, then * 1.2417
+        assert {values[p.pk] for p in home.players.filter(position='DEF').exclude(pk=sold.pk)} == {Decimal('124170.00')}
+        assert {values[p.pk] for p in home.players.filter(position='MID')} == {Decimal('90000.00')}
+        assert values[keeper.pk] == Decimal('9.05')  # 9.045, half up
+        assert values[free.pk] == Decimal('90.00')
+        home.refresh_from_db()
+        assert home.squad_value == Decimal('2023645.50')
+        call_command('rebuild_team_values', '--verify', stdout=StringIO())
+        assert all(CacheVersion.current(key) > version for key, version in before.items())
+
+        with pytest.raises(CommandError):
+            call_command('revalue_players', '--max-change', '1')
+
+    def test_team_me_uses_a_fixed_number_of_queries(self, client, create_user, create_team,
+                                                    django_assert_num_queries):
+        user = create_user('me_queries')
+        team = create_team(user=user, name="Query XI")
+        client.force_authenticate(user=user)
+        with django_assert_num_queries(3):  # team version (the ETag), team, players
+            resp = client.get(reverse('team-me'))
+        assert resp.status_code == status.HTTP_200_OK
+        assert Decimal(resp.data['total_value']) == INITIAL_TEAM_CAPITAL
+        assert len(resp.data['players']) == PLAYERS_PER_TEAM
+
+
+    def test_transaction_history_cursor_mode_and_team_filter(self, client, create_user, create_team):
+        seller = create_team(user=create_user('ledger_seller'), name="Ledger Sellers")
+        buyer = create_team(user=create_user('ledger_buyer'), name="Ledger Buyers")
+        other = create_team(user=create_user('ledger_other'), name="Ledger Others")
+        player = seller.players.first()
+        Transaction.objects.bulk_create(
+            [Transaction(buyer=buyer, seller=seller, player=player, amount=Decimal(i + 1), active=False)
+             for i in range(25)]
+            + [Transaction(buyer=other, seller=buyer, player=player, amount=Decimal('99'), active=False)
+               for _ in range(5)]
+        )
+        client.force_authenticate(user=buyer.user)
+        url = reverse('transaction-list')
+
+        with CaptureQueriesContext(connection) as first_page:
+            resp = client.get(url, {'pagination': 'cursor', 'page_size': 10})
+        assert resp.status_code == status.HTTP_200_OK
+        assert 'count' not in resp.data
+        assert not any('COUNT(' in q['sql'] for q in first_page.captured_queries)
+
+        seen = [tx['id'] for tx in resp.data['results']]
+        next_url = resp.data['next']
+        while next_url:
+            with CaptureQueriesContext(connection) as page:
+                resp = client.get(next_url)
+            assert len(page) == len(first_page)
+            seen += [tx['id'] for tx in resp.data['results']]
+            next_url = resp.data['next']
+        expected = list(Transaction.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        assert seen == expected
+
+        resp_sold = client.get(url, {'pagination': 'cursor', 'seller': seller.id})
+        assert len(resp_sold.data['results']) == 20
+        resp_team = client.get(url, {'team': buyer.id, 'limit': 50})
+        assert resp_team.data['count'] == 30
+        resp_other = client.get(url, {'team': other.id})
+        assert resp_other.data['count'] == 5
+        assert all(tx['buyer'] == str(other) for tx in resp_other.data['results'])
+
+    def test_seed_league_builds_valid_deterministic_league(self):
+        call_command('seed_league', users=5, seed=7, chunk_size=2, batch_size=3, listed=0.5, history=3,
+                     free_agents=4, prefix='alpha', verbosity=0)
+        call_command('seed_league', users=5, seed=7, chunk_size=5, prefix='beta', listed=0.5, history=3,
+                     verbosity=0)
+
+        alpha = Team.objects.filter(user__username__startswith='alpha').order_by('user__username')
+        beta = Team.objects.filter(user__username__startswith='beta').order_by('user__username')
+        assert alpha.count() == beta.count() == 5
+        for a, b in zip(alpha, beta):
+            # same seed, same squads -- whatever the chunking
+            assert a.capital == b.capital and a.squad_value == b.squad_value
+            assert a.capital + a.squad_value == INITIAL_TEAM_CAPITAL
+            positions = {pos: a.players.filter(position=pos).count() for pos in POSITIONS}
+            assert positions == POSITIONS
+            assert list(a.players.order_by('id').values_list('value', flat=True)) == \
+                list(b.players.order_by('id').values_list('value', flat=True))
+
+        assert Player.objects.filter(owner__isnull=True).count() == 4
+        assert TransferListing.objects.filter(seller__in=alpha).count() == \
+            TransferListing.objects.filter(seller__in=beta).count()
+        assert Transaction.objects.filter(buyer__in=alpha).count() == 4 * 3
+        assert not Transaction.objects.filter(buyer=F('seller')).exists()
+        call_command('rebuild_team_values', '--verify')
+
+        with pytest.raises(CommandError):
+            call_command('seed_league', users=1, prefix='alpha', verbosity=0)
+
+    def test_query_instrumentation_headers_and_budget_enforcement(self, client, create_user, create_team,
+                                                                  monkeypatch):
+        seller = create_team(user=create_user('budget_seller'), name="Budget Sellers")
+        TransferListing.objects.bulk_create([
+            TransferListing(player=p, seller=seller, price=Decimal('1000.00')) for p in seller.players.all()
+        ])
+        client.force_authenticate(user=seller.user)
+
+        resp = client.get(reverse('listings-list'))
+        assert resp.status_code == status.HTTP_200_OK
+        assert int(resp['X-DB-Query-Count']) <= int(resp['X-DB-Query-Budget']) == 2
+        assert resp['X-DB-Duplicate-Queries'] == '0'
+        assert float(resp['X-DB-Time-Ms']) >= 0
+
+        # a view that starts lazy-loading per row blows its budget and fails the request
+        monkeypatch.setattr(TransferListingViewSet, 'get_queryset',
+                            lambda self: TransferListing.objects.filter(active=True))
+        with pytest.raises(QueryBudgetExceeded, match="most repeated"):
+            client.get(reverse('listings-list'))
+
+    def test_market_cache_hits_and_never_serves_a_sold_player(self, client, create_user, create_team, monkeypatch,
+                                                              settings):
+        seller = create_team(user=create_user('cache_seller'), name="Cache Sellers")
+        buyer_user = create_user('cache_buyer')
+        create_team(user=buyer_user, name="Cache Buyers")
+        players = list(seller.players.filter(position='DEF'))
+        listings = [TransferListing.objects.create(player=p, seller=seller, price=Decimal('1000.00'))
+                    for p in players]
+        admin = User.objects.create_superuser('cache_admin', 'admin@example.com', 'StrongPass123!')
+        url = reverse('player-market')
+        client.force_authenticate(user=buyer_user)
+
+        first = client.get(url)
+        assert first['X-Market-Cache'] == 'miss'
+        with CaptureQueriesContext(connection) as hit_queries:
+            second = client.get(url)
+        assert second['X-Market-Cache'] == 'hit'
+        assert second.json() == first.json()
+        assert len(hit_queries) == 1  # just the version check
+
+        # a different view of the same market reuses the rendered rows
+        reordered = client.get(url, {'ordering': '-price'})
+        assert reordered['X-Market-Cache'] == 'miss'
+
+        client.post(reverse('listings-buy', args=[listings[0].id]), format='json')
+        after_buy = client.get(url)
+        assert after_buy['X-Market-Cache'] == 'miss'
+        assert listings[0].id not in [row['listing_id'] for row in after_buy.json()['results']]
+
+        client.force_authenticate(user=seller.user)
+        client.delete(reverse('listings-detail', args=[listings[1].id]))
+        client.force_authenticate(user=buyer_user)
+        assert listings[1].id not in [row['listing_id'] for row in client.get(url).json()['results']]
+
+        client.force_authenticate(user=admin)
+        stats = client.get(reverse('player-market-cache-stats')).json()
+        assert stats['page_hits'] == 1 and stats['page_misses'] == 4
+        assert stats['fragment_hits'] == len(players)
+        assert stats['version'] == CacheVersion.current(MARKET_VERSION)
+        client.force_authenticate(user=buyer_user)
+        assert client.get(reverse('player-market-cache-stats')).status_code == status.HTTP_403_FORBIDDEN
+
+        # a page's links are absolute: another host or scheme gets a page of its own
+        settings.ALLOWED_HOSTS = ['testserver', 'public.example.com']
+        internal = client.get(url, {'page_size': 2})
+        public = client.get(url, {'page_size': 2}, HTTP_HOST='public.example.com', secure=True)
+        assert public['X-Market-Cache'] == 'miss'
+        assert internal.json()['next'].startswith('http://testserver/')
+        assert public.json()['next'].startswith('https://public.example.com/')
+
+    def test_buy_batch_settles_all_or_nothing(self, client, create_user, create_team, monkeypatch):
+        seller_a = create_team(user=create_user('batch_seller_a'), name="Batch A")
+        seller_b = create_team(user=create_user('batch_seller_b'), name="Batch B")
+        buyer = create_team(user=create_user('batch_buyer'), name="Batch Buyers")
+        la = [TransferListing.objects.create(player=p, seller=seller_a, price=Decimal('400000.00'))
+              for p in seller_a.players.filter(position='MID')[:2]]
+        lb = TransferListing.objects.create(player=seller_b.players.first(), seller=seller_b, price=Decimal('300000.00'))
+        own = TransferListing.objects.create(player=buyer.players.first(), seller=buyer, price=Decimal('1.00'))
+        monkeypatch.setattr('random.uniform', lambda a, b: 0.10)
+        client.force_authenticate(user=buyer.user)
+        url = reverse('listings-buy-batch')
+
+        def unchanged():
+            buyer.refresh_from_db()
+            return (buyer.capital == Decimal('3000000.00')
+                    and TransferListing.objects.filter(active=True).count() == 4
+                    and not Transaction.objects.exists())
+
+        resp = client.post(url, {'listing_ids': [la[0].id, lb.id, own.id]}, format='json')
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Cannot buy your own player' in resp.data['detail']
+        assert unchanged()
+
+        Team.objects.filter(pk=buyer.pk).update(capital=Decimal('1000000.00'))
+        resp = client.post(url, {'listing_ids': [la[0].id, la[1].id, lb.id]}, format='json')
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Insufficient capital' in resp.data['detail']
+        Team.objects.filter(pk=buyer.pk).update(capital=Decimal('3000000.00'))
+        assert unchanged()
+
+        resp = client.post(url, {'listing_ids': [la[0].id, 999999]}, format='json')
+        assert resp.status_code == status.HTTP_404_NOT_FOUND
+        assert '999999' in resp.data['detail']
+        assert unchanged()
+
+        assert client.post(url, {'listing_ids': []}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+
+        resp = client.post(url, {'listing_ids': [lb.id, la[1].id, la[0].id, lb.id]}, format='json')
+        assert resp.status_code == status.HTTP_201_CREATED
+        assert [tx['amount'] for tx in resp.data] == ['400000.00', '400000.00', '300000.00']
+        assert all(tx['buyer'] == str(buyer) for tx in resp.data)
+
+        buyer.refresh_from_db()
+        seller_a.refresh_from_db()
+        seller_b.refresh_from_db()
+        assert buyer.capital == Decimal('1900000.00')
+        assert seller_a.capital == Decimal('3800000.00')
+        assert seller_b.capital == Decimal('3300000.00')
+        assert buyer.squad_value == Decimal('2000000.00') + 3 * Decimal('110000.00')
+        assert seller_a.squad_value == Decimal('1800000.00')
+        assert set(buyer.players.values_list('pk', flat=True)) >= {la[0].player_id, la[1].player_id, lb.player_id}
+        assert TransferListing.objects.filter(active=True).count() == 1
+        call_command('rebuild_team_values', '--verify')
+
+    def test_order_book_matches_bids_and_asks_through_the_engine(self, client, create_user, create_team,
+                                                                 monkeypatch):
+        seller = create_team(user=create_user('ob_seller'), name="Asks FC")
+        buyer = create_team(user=create_user('ob_buyer'), name="Bids FC")
+        poor = create_team(user=create_user('ob_poor'), name="Poor FC")
+        Team.objects.filter(pk=poor.pk).update(capital=Decimal('100.00'))
+        mid, mid2 = seller.players.get(name='MID_Player_0'), seller.players.get(name='MID_Player_1')
+        listing = TransferListing.objects.create(player=mid2, seller=seller, price=Decimal('999999.00'))
+        monkeypatch.setattr('random.uniform', lambda a, b: 0.10)
+        url = reverse('order-list')
+
+        def place(user, **data):
+            client.force_authenticate(user=user)
+            return client.post(url, data, format='json')
+
+        # validation
+        assert place(buyer.user, side='ASK', player_id=mid.pk, price='1.00').status_code == 400
+        assert place(seller.user, side='BID', player_id=mid.pk, price='1.00').status_code == 400
+        assert place(buyer.user, side='BID', player_id=mid.pk, position='MID', price='1.00').status_code == 400
+        assert place(buyer.user, side='BID', position='MID', price='0').status_code == 400
+
+        # the best bid wins; the poor team's higher bid fails settlement and is cancelled
+        poor_bid = place(poor.user, side='BID', position='MID', price='300000.00').data
+        low_bid = place(buyer.user, side='BID', position='MID', price='150000.00').data
+        high_bid = place(buyer.user, side='BID', player_id=mid.pk, price='200000.00').data
+        assert high_bid['position'] == 'MID' and high_bid['status'] == Order.OPEN
+        ask = place(seller.user, side='ASK', player_id=mid.pk, position='GK', price='120000.00').data
+        assert ask['position'] == 'MID'
+        assert place(seller.user, side='ASK', player_id=mid.pk, price='1.00').status_code == 400
+        mid2_ask = place(seller.user, side='ASK', player_id=mid2.pk, price='250000.00')
+        assert mid2_ask.status_code == 201
+
+        call_command('run_matching', '--once', stdout=StringIO())
+
+        orders = {o.pk: o for o in Order.objects.all()}
+        assert orders[poor_bid['id']].status == Order.CANCELLED
+        assert orders[high_bid['id']].status == Order.FILLED
+        assert orders[ask['id']].status == Order.FILLED
+        assert orders[low_bid['id']].status == Order.OPEN
+        assert orders[mid2_ask.data['id']].status == Order.OPEN
+        tx = orders[ask['id']].transaction
+        assert orders[high_bid['id']].transaction == tx
+        assert (tx.buyer, tx.seller, tx.player, tx.amount) == (buyer, seller, mid, Decimal('200000.00'))
+
+        mid.refresh_from_db()
+        buyer.refresh_from_db()
+        seller.refresh_from_db()
+        assert mid.owner == buyer and mid.value == Decimal('110000.00')
+        assert buyer.capital == Decimal('2800000.00')
+        assert seller.capital == Decimal('3200000.00')
+        call_command('rebuild_team_values', '--verify')
+
+        # a later ask crossing the resting position bid fills at the bid's price, and takes the
+        # player off the fixed-price market
+        version = CacheVersion.current(MARKET_VERSION)
+        client.force_authenticate(user=seller.user)
+        assert client.delete(reverse('order-detail', args=[mid2_ask.data['id']])).status_code == 204
+        assert client.delete(reverse('order-detail', args=[mid2_ask.data['id']])).status_code == 400
+        assert place(seller.user, side='ASK', player_id=mid2.pk, price='100000.00').status_code == 201
+        call_command('run_matching', '--once', stdout=StringIO())
+        mid2.refresh_from_db()
+        listing.refresh_from_db()
+        assert mid2.owner_id == buyer.pk
+        assert Order.objects.get(pk=low_bid['id']).transaction.amount == Decimal('150000.00')
+        assert not listing.active
+        assert CacheVersion.current(MARKET_VERSION) > version
+
+        client.force_authenticate(user=buyer.user)
+        resp = client.get(url, {'status': 'FILLED'})
+        assert {o['id'] for o in resp.data['results']} == {high_bid['id'], low_bid['id']}
+        call_command('rebuild_team_values', '--verify')
+
+    def test_settle_fills_checks_each_fill_against_locked_rows(self, create_user, create_team):
+        a = create_team(user=create_user('fill_a'), name="A")
+        b = create_team(user=create_user('fill_b'), name="B")
+        p1, p2 = a.players.all()[:2]
+        orders = [Order.objects.create(team=t, side=side, player=p, position=p.position, price=price)
+                  for t, side, p, price in [(a, 'ASK', p1, Decimal('10.00')), (b, 'BID', p1, Decimal('10.00')),
+                                            (a, 'ASK', p2, Decimal('10.00')), (b, 'BID', p2, Decimal('10.00'))]]
+        book = [BookOrder(o.pk, o.team_id, o.side, o.player_id, o.position, o.price) for o in orders]
+        ob = OrderBook()
+        assert ob.add(book[0]) is None and ob.add(book[2]) is None
+        fills = [ob.add(book[1]), ob.add(book[3])]
+        Order.objects.filter(pk=orders[2].pk).update(status=Order.CANCELLED)  # the seller pulled the second ask
+
+        with CaptureQueriesContext(connection) as queries:
+            txs, rejected = settle_fills(fills)
+        assert txs[0] is not None and txs[1] is None
+        assert rejected == {orders[2].pk: "Order is no longer open."}
+        assert len(queries) <= 13  # with the analytics rollups, the outbox and the teams' version bump
+        assert Order.objects.get(pk=orders[3].pk).status == Order.OPEN
+        p1.refresh_from_db()
+        assert p1.owner_id == b.pk
+
+    def test_engine_drops_the_asks_of_a_player_sold_outside_the_book(self, create_user, create_team):
+        a = create_team(user=create_user('gone_a'), name="A")
+        b = create_team(user=create_user('gone_b'), name="B")
+        c = create_team(user=create_user('gone_c'), name="C")
+        p = a.players.first()
+        engine = MatchingEngine()
+        pulled = Order.objects.create(team=a, side='ASK', player=p, position=p.position, price=Decimal('20.00'))
+        engine.poll()
+        Order.objects.filter(pk=pulled.pk).update(status=Order.CANCELLED)  # still resting in the book
+        ask = Order.objects.create(team=a, side='ASK', player=p, position=p.position, price=Decimal('10.00'))
+        engine.poll()
+        settle_listing(TransferListing.objects.create(player=p, seller=a, price=Decimal('5.00')).pk, c.pk)
+
+        bid = Order.objects.create(team=b, side='BID', player=p, position=p.position, price=Decimal('30.00'))
+        assert engine.poll() == 0
+        # the rejected ask takes the pulled one with it instead of costing the bid another round
+        assert engine.stats['rejected'] == 1 and len(engine.book) == 1 and bid.pk in engine.book
+        assert Order.objects.get(pk=ask.pk).status == Order.CANCELLED
+
+    def test_stateless_jwt_skips_the_user_lookup_until_revoked(self, client, create_user, create_team,
+                                                               django_capture_on_commit_callbacks, monkeypatch):
+        user = create_user('stateless')
+        team = create_team(user=user, name="Stateless XI")
+        login = client.post(reverse('token_obtain_pair'), {'username': 'stateless', 'password': 'StrongPass123!'},
+                            format='json')
+        token = AccessToken(login.data['access'])
+        assert (token['team_id'], token['ver']) == (team.pk, 0)
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {login.data['access']}")
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(reverse('team-me'))
+        assert resp.status_code == status.HTTP_200_OK and resp.data['id'] == team.pk
+        assert not [q for q in queries if 'FROM "auth_user"' in q['sql']]
+        assert resp['X-DB-Query-Count'] == '3'  # team version, team, players
+        # a view that needs the user row still gets it, loaded on first use
+        assert client.get(reverse('auth_profile')).data['username'] == 'stateless'
+
+        # another worker's revocation is honoured once this one's cached version expires
+        CacheVersion.bump('auth:%s' % user.pk)
+        assert client.get(reverse('team-me')).status_code == status.HTTP_200_OK
+        later = time.monotonic() + settings.AUTH_VERSION_TTL + 1
+        monkeypatch.setattr('fantasy.authentication.time.monotonic', lambda: later)
+        assert client.get(reverse('team-me')).status_code == status.HTTP_401_UNAUTHORIZED
+
+        # a password change revokes at once in this process
+        login = client.post(reverse('token_obtain_pair'), {'username': 'stateless', 'password': 'StrongPass123!'},
+                            format='json')
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {login.data['access']}")
+        assert client.get(reverse('team-me')).status_code == status.HTTP_200_OK
+        with django_capture_on_commit_callbacks(execute=True):
+            user.set_password('EvenStronger456!')
+            user.save()
+        resp = client.get(reverse('team-me'))
+        assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+        assert resp.data['detail'].code == 'token_revoked'
+
+    def test_async_read_views_answer_exactly_like_the_sync_ones(self, client, create_user, create_team, settings,
+                                                               bearer, sync_and_async):
+        seller = create_team(user=create_user('async_seller'), name="Async Sellers")
+        buyer = create_team(user=create_user('async_buyer'), name="Async Buyers")
+        create_user('async_free_agent')
+        listings = [TransferListing.objects.create(player=p, seller=seller, price=Decimal('1000.00') + i)
+                    for i, p in enumerate(seller.players.filter(position='DEF'))]
+        for listing in listings[:3]:
+            settle_listing(listing.pk, buyer.pk)
+
+        buyer_auth = bearer('async_buyer')
+        cursor_page = client.get('/api/transactions/?pagination=cursor&page_size=1', headers=buyer_auth).json()
+        cases = [
+            ('/api/players/market/?page_size=2&ordering=-price', buyer_auth),
+            ('/api/players/market/?min_price=abc', buyer_auth),
+            ('/api/players/?position=def&limit=4&offset=1&ordering=-id', buyer_auth),
+            ('/api/players/?available=true', buyer_auth),
+            ('/api/transactions/?limit=2', buyer_auth),
+            (f'/api/transactions/?team={buyer.pk}', buyer_auth),
+            ('/api/transactions/?pagination=cursor&page_size=1', buyer_auth),
+            (cursor_page['next'].replace('http://testserver', ''), buyer_auth),
+            ('/api/teams/me/', buyer_auth),
+            ('/api/teams/me/', bearer('async_free_agent')),
+            ('/api/teams/me/', {}),
+            ('/api/teams/me/', {'Authorization': 'Bearer not-a-token'}),
+        ]
+        for path, headers in cases:
+            sync, served = sync_and_async(path, headers)
+            assert served.resolver_match.url_name.startswith('async-'), path
+            assert (served.status_code, served.content) == (sync.status_code, sync.content), path
+            assert served['X-DB-Query-Count'] == sync['X-DB-Query-Count'], path
+            assert served.get('WWW-Authenticate') == sync.get('WWW-Authenticate'), path
+        assert [sync_and_async(path, headers)[1].status_code for path, headers in cases[-3:]] == [404, 401, 401]
+
+        # the async market view shares the versioned cache with the sync one
+        _, served = sync_and_async('/api/players/market/', buyer_auth)
+        again = async_to_sync(AsyncClient().get)('/api/players/market/', headers=buyer_auth)
+        assert (served['X-Market-Cache'], again['X-Market-Cache']) == ('miss', 'hit')
+        assert again.content == served.content
+
+    def test_fast_serializers_render_the_same_bytes(self, client, create_user, create_team, settings,
+                                                    bearer, sync_and_async):
+        seller = create_team(user=create_user('fast_seller'), name="Fast Sellers")
+        buyer = create_team(user=create_user('fast_buyer'), name="Fast Buyers")
+        Team.objects.create(user=create_user('fast_empty'), name="No Squad")
+        Player.objects.create(name="Free Agent", position='MID', value=Decimal('123.40'))
+        listings = [TransferListing.objects.create(player=p, seller=seller, price=Decimal('999.99') + i)
+                    for i, p in enumerate(seller.players.filter(position='DEF'))]
+        txs = [settle_listing(listing.pk, buyer.pk) for listing in listings[:3]]
+        # history outlives its teams and players (SET_NULL)
+        Transaction.objects.filter(pk=txs[0].pk).update(buyer=None, player=None)
+
+        def both(path, headers):
+            settings.ROOT_URLCONF = 'fantasy_project.urls'
+            settings.FAST_SERIALIZERS = False
+            slow = client.get(path, headers=headers)
+            settings.FAST_SERIALIZERS = True
+            return (slow, *sync_and_async(path, headers))
+
+        buyer_auth = bearer('fast_buyer')
+        cases = [
+            ('/api/players/?ordering=-value,id', buyer_auth),
+            ('/api/players/?position=def&limit=4&offset=1&ordering=-id', buyer_auth),
+            ('/api/players/?available=true', buyer_auth),
+            ('/api/transactions/', buyer_auth),
+            (f'/api/transactions/?team={buyer.pk}', buyer_auth),
+            ('/api/transactions/?pagination=cursor&page_size=2', buyer_auth),
+            ('/api/teams/', buyer_auth),
+            ('/api/teams/me/', buyer_auth),
+            ('/api/teams/me/', bearer('fast_empty')),
+            ('/api/teams/me/', bearer('fast_seller')),
+        ]
+        for time_zone in ('UTC', 'Asia/Kolkata'):  # DRF renders timestamps in the current time zone
+            settings.TIME_ZONE = time_zone
+            for path, headers in cases:
+                slow, fast, served = both(path, headers)
+                assert slow.status_code == 200, path
+                assert fast.content == slow.content, (time_zone, path)
+                assert int(fast['X-DB-Query-Count']) <= int(slow['X-DB-Query-Count']), path
+                if path.startswith(('/api/players/', '/api/transactions/', '/api/teams/me/')):
+                    assert served.content == slow.content, (time_zone, path)
+        assert b'+05:30' in fast.content and b'"owner":null' in both('/api/players/?available=true', buyer_auth)[1].content
+
+        # teams/me without a team is the same 404 on every path
+        settings.FAST_SERIALIZERS = True
+        create_user('fast_free_agent')
+        slow, fast, served = both('/api/teams/me/', bearer('fast_free_agent'))
+        assert slow.status_code == fast.status_code == served.status_code == 404
+        assert fast.content == served.content == slow.content
+
+    def test_polled_resources_answer_304_until_their_version_moves(self, client, create_user, create_team, settings,
+                                                                   bearer):
+        seller = create_team(user=create_user('etag_seller'), name="ETag Sellers")
+        buyer = create_team(user=create_user('etag_buyer'), name="ETag Buyers")
+        bystander = create_team(user=create_user('etag_bystander'), name="Bystanders")
+        on_sale = [TransferListing.objects.create(player=p, seller=seller, price=Decimal('1000.00'))
+                   for p in seller.players.filter(position='MID')[:3]]
+        me, market = reverse('team-me'), reverse('player-market')
+        client.force_authenticate(user=buyer.user)
+
+        def poll(path, etag, **params):
+            with CaptureQueriesContext(connection) as queries:
+                resp = client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+            return resp, len(queries)
+
+        first = client.get(me)
+        etag = first['ETag']
+        assert first.status_code == 200 and etag.startswith('"team-')
+        assert first['Cache-Control'] == 'private, no-cache' and 'Authorization' in first['Vary']
+        resp, queries = poll(me, etag)
+        assert (resp.status_code, resp.content, resp['ETag'], queries) == (304, b'', etag, 1)
+        assert poll(me, f'W/{etag}, "other"')[0].status_code == 304
+        assert client.get(me, HTTP_ACCEPT='text/html')['ETag'] != etag  # the browsable API is other bytes
+
+        # another team's deal leaves this one alone; its own buy, listing, cancel and rename move it
+        client.force_authenticate(user=bystander.user)
+        client.post(reverse('listings-buy', args=[on_sale[0].pk]))
+        client.force_authenticate(user=buyer.user)
+        assert poll(me, etag)[0].status_code == 304
+        changes = [
+            lambda: client.post(reverse('listings-buy', args=[on_sale[1].pk])),
+            lambda: client.post(reverse('listings-list'), {'player_id': buyer.players.filter(listing=None).first().pk,
+                                                              'price': '5.00'}),
+            lambda: client.delete(reverse('listings-detail', args=[TransferListing.objects.get(seller=buyer).pk])),
+            lambda: client.patch(reverse('team-detail', args=[buyer.pk]), {'name': "Renamed"}, format='json'),
+        ]
+        for change in changes:
+            assert change().status_code < 300
+            resp, _ = poll(me, etag)
+            assert resp.status_code == 200 and resp['ETag'] != etag
+            etag = resp['ETag']
+        assert resp.data['name'] == "Renamed"
+
+        # the seller's page moved with the buy; the market with every listing change, per page
+        page = client.get(market, {'ordering': '-price'})
+        assert page['ETag'] != client.get(market)['ETag']
+        resp, queries = poll(market, page['ETag'], ordering='-price')
+        assert (resp.status_code, queries) == (304, 1)
+        on_sale[2].price = Decimal('999.00')
+        on_sale[2].save()
+        resp, _ = poll(market, page['ETag'], ordering='-price')
+        assert resp.status_code == 200 and resp['ETag'] != page['ETag']
+        # so does a username change of a team with listings
+        seller.user.username = 'etag_seller_renamed'
+        seller.user.save()
+        moved, _ = poll(market, resp['ETag'], ordering='-price')
+        assert moved.status_code == 200 and moved['ETag'] != resp['ETag']
+        resp = moved
+
+        # the async views hand out and honour the same tags
+        settings.ROOT_URLCONF = 'fantasy_project.asgi_urls'
+        headers = bearer('etag_buyer')
+        for path, tag in ((me, etag), (market, resp['ETag'])):
+            params = {'ordering': '-price'} if path == market else {}
+            served = async_to_sync(AsyncClient().get)(path, params, headers={**headers, 'If-None-Match': tag})
+            assert (served.status_code, served['ETag']) == (304, tag), path
+            fresh = async_to_sync(AsyncClient().get)(path, params, headers=headers)
+            assert (fresh.status_code, fresh['ETag']) == (200, tag), path
+
+    def test_exports_stream_whole_tables_with_the_list_filters(self, client, create_user, create_team):
+        seller = create_team(user=create_user('export_seller'), name="Export Sellers")
+        buyer = create_team(user=create_user('export_buyer'), name="Export, \"Buyers\"")
+        Player.objects.create(name="Free Agent", position='MID', value=Decimal('5.50'))
+        listings = [TransferListing.objects.create(player=p, seller=seller, price=Decimal('250.00') + i)
+                    for i, p in enumerate(seller.players.filter(position='DEF'))]
+        txs = [settle_listing(listing.pk, buyer.pk) for listing in listings[:2]]
+        client.force_authenticate(user=buyer.user)
+
+        resp = client.get('/api/players/export/', {'position': 'def'})
+        assert resp.status_code == 200 and resp.streaming
+        assert resp['Content-Type'] == 'application/x-ndjson'
+        assert resp['Content-Disposition'] == 'attachment; filename="players.ndjson"'
+        assert resp['X-DB-Query-Count'] == '0'  # rows are read as the body streams
+        rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode().splitlines()]
+        assert [row['id'] for row in rows] == list(
+            Player.objects.filter(position='DEF').order_by('pk').values_list('pk', flat=True))
+        bought = next(row for row in rows if row['id'] == txs[0].player_id)
+        assert bought == {'id': txs[0].player_id, 'name': txs[0].player.name, 'position': 'DEF',
+                          'owner_id': buyer.pk, 'owner': str(buyer), 'value': bought['value'],
+                          'created_at': bought['created_at']}
+        free = [json.loads(line) for line in
+                b''.join(client.get('/api/players/export/?available=true').streaming_content).decode().splitlines()]
+        assert [(row['name'], row['owner'], row['value']) for row in free] == [("Free Agent", None, '5.50')]
+
+        resp = client.get('/api/transactions/export/', {'team': buyer.pk, 'output': 'csv'})
+        assert resp['Content-Type'] == 'text/csv; charset=utf-8'
+        table = list(csv.reader(StringIO(b''.join(resp.streaming_content).decode())))
+        assert table[0] == ['id', 'buyer_id', 'buyer', 'seller_id', 'seller', 'player_id', 'player', 'amount',
+                            'created_at', 'active']
+        assert [(int(r[0]), r[2], r[4], r[7]) for r in table[1:]] == [
+            (tx.pk, str(buyer), str(seller), str(tx.amount)) for tx in txs]
+
+        # sold listings are in the listings export unless filtered out
+        sold = b''.join(client.get('/api/transfers/export/?active=false&output=csv').streaming_content).decode()
+        assert [int(r[0]) for r in list(csv.reader(StringIO(sold)))[1:]] == [l.pk for l in listings[:2]]
+        everything = b''.join(client.get('/api/transfers/export/?min_price=251').streaming_content).decode()
+        assert len(everything.splitlines()) == len(listings) - 1
+
+        assert client.get('/api/players/export/?output=xml').status_code == 400
+        assert client.get('/api/transactions/export/?buyer=999999').status_code == 400
+
+        out = StringIO()
+        call_command('export', 'transactions', '--output', 'csv', '--filter', f'team={buyer.pk}', stdout=out)
+        assert out.getvalue() == b''.join(client.get('/api/transactions/export/', {
+            'team': buyer.pk, 'output': 'csv'}).streaming_content).decode()
+        with pytest.raises(CommandError):
+            call_command('export', 'players', '--filter', 'position')
+
+    def test_idempotency_keys_replay_the_first_response(self, client, create_user, create_team, create_players):
+        seller = create_team(user=create_user('idem_seller'), name="Sellers")
+        buyer_user = create_user('idem_buyer')
+        buyer = create_team(user=buyer_user, name="Buyers")
+        client.force_authenticate(user=seller.user)
+        players = list(seller.players.order_by('pk'))
+
+        # listing: the retry gets the first listing back instead of racing it
+        payload = {'player_id': players[0].pk, 'price': '150000.00'}
+        first = client.post(reverse('listings-list'), payload, format='json', HTTP_IDEMPOTENCY_KEY='list-1')
+        again = client.post(reverse('listings-list'), payload, format='json', HTTP_IDEMPOTENCY_KEY='list-1')
+        assert first.status_code == again.status_code == status.HTTP_201_CREATED
+        assert again.json() == first.json() and again['Idempotent-Replayed'] == 'true'
+        assert TransferListing.objects.filter(player=players[0]).count() == 1
+        other = client.post(reverse('listings-list'), {**payload, 'price': '1.00'}, format='json',
+                            HTTP_IDEMPOTENCY_KEY='list-1')
+        assert other.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        listing = TransferListing.objects.get(player=players[0])
+        second = TransferListing.objects.create(player=players[1], seller=seller, price=Decimal('10.00'))
+
+        client.force_authenticate(user=buyer_user)
+        buy = reverse('listings-buy', args=[listing.pk])
+        first = client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-1')
+        assert first.status_code == status.HTTP_201_CREATED
+        with CaptureQueriesContext(connection) as queries:
+            again = client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-1')
+        assert again.status_code == status.HTTP_201_CREATED and again.json() == first.json()
+        assert not [q for q in queries.captured_queries if 'fantasy_transferlisting' in q['sql']
+                    or 'fantasy_player' in q['sql'] or 'fantasy_team' in q['sql']]  # nothing locked, nothing read
+        assert Transaction.objects.count() == 1
+        assert client.post(reverse('listings-buy', args=[second.pk]),
+                           HTTP_IDEMPOTENCY_KEY='buy-1').status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        # another user's key is their own
+        client.force_authenticate(user=seller.user)
+        assert client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-1').status_code == status.HTTP_404_NOT_FOUND
+
+        # a refused purchase is stored like any response; one that raised is not
+        client.force_authenticate(user=buyer_user)
+        Team.objects.filter(pk=buyer.pk).update(capital=0)
+        buy = reverse('listings-buy', args=[second.pk])
+        assert client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-2').status_code == status.HTTP_400_BAD_REQUEST
+        Team.objects.filter(pk=buyer.pk).update(capital=INITIAL_TEAM_CAPITAL)
+        replayed = client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-2')
+        assert replayed.status_code == status.HTTP_400_BAD_REQUEST and replayed['Idempotent-Replayed'] == 'true'
+        resp = client.post(reverse('listings-buy-batch'), {'listing_ids': []}, format='json',
+                           HTTP_IDEMPOTENCY_KEY='batch-1')
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert not IdempotencyKey.objects.filter(key='batch-1').exists()
+        assert client.post(buy, HTTP_IDEMPOTENCY_KEY='x' * 256).status_code == status.HTTP_400_BAD_REQUEST
+
+        # drafting
+        drafter = create_user('idem_drafter')
+        client.force_authenticate(user=drafter)
+        payload = {'name': "Twice XI", 'players': [p.pk for p in create_players()]}
+        first = client.post(reverse('team-list'), payload, format='json', HTTP_IDEMPOTENCY_KEY='team-1')
+        again = client.post(reverse('team-list'), payload, format='json', HTTP_IDEMPOTENCY_KEY='team-1')
+        assert first.status_code == again.status_code == status.HTTP_201_CREATED and again.json() == first.json()
+        assert Team.objects.filter(user=drafter).count() == 1
+
+        # an expired key runs the request again, and is purged
+        IdempotencyKey.objects.filter(key='buy-2').update(created_at=timezone.now() - timedelta(days=2))
+        client.force_authenticate(user=buyer_user)
+        resp = client.post(buy, HTTP_IDEMPOTENCY_KEY='buy-2')
+        assert resp.status_code == status.HTTP_201_CREATED and not resp.has_header('Idempotent-Replayed')
+        IdempotencyKey.objects.filter(key='buy-1').update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys', '--batch-size', '1', stdout=StringIO())
+        assert sorted(IdempotencyKey.objects.values_list('key', flat=True)) == ['buy-2', 'list-1', 'team-1']
+
+    def test_archived_transactions_read_like_hot_ones(self, client, create_user, create_team):
+        seller = create_team(user=create_user('archive_seller'), name="Old Sellers")
+        buyer = create_team(user=create_user('archive_buyer'), name="Old Buyers")
+        client.force_authenticate(user=buyer.user)
+        players = list(seller.players.order_by('pk')[:7])
+        for player in players:
+            listing = TransferListing.objects.create(player=player, seller=seller, price=Decimal('10.00'))
+            assert client.post(reverse('listings-buy', args=[listing.pk])).status_code == status.HTTP_201_CREATED
+        txs = list(Transaction.objects.order_by('pk'))
+        for age, tx in zip((400, 200, 200, 100, 95, 10, 0), txs):
+            Transaction.objects.filter(pk=tx.pk).update(created_at=timezone.now() - timedelta(days=age))
+        order = Order.objects.create(team=buyer, side=Order.BID, player=players[0], position='GK',
+                                     price=Decimal('10.00'), status=Order.FILLED, transaction=txs[0])
+
+        def history():
+            pages = [client.get(reverse('transaction-list'), {'limit': 3, 'offset': n}).json() for n in (0, 3, 6)]
+            cursor = client.get(reverse('transaction-list'), {'pagination': 'cursor', 'page_size': 3}).json()
+            pages.append(cursor)
+            while cursor['next']:
+                cursor = client.get(cursor['next']).json()
+                pages.append(cursor)
+            pages.append(client.get(reverse('transaction-list'), {'team': seller.pk}).json())
+            pages += [client.get(reverse('transaction-detail', args=[tx.pk])).json() for tx in txs]
+            export = b''.join(client.get('/api/transactions/export/').streaming_content)
+            return pages, export, analytics.drift(timezone.localdate() - timedelta(days=400), timezone.localdate())
+
+        before = history()
+        # an interrupted run leaves every row in one table or the other; the next one carries on
+        assert archive.archive_batch(timezone.now() - timedelta(days=90), 2) == 2
+        out = StringIO()
+        call_command('archive_transactions', '--batch-size', '2', '--no-vacuum', stdout=out)
+        assert 'Archived 3 transactions' in out.getvalue()
+        assert list(Transaction.objects.order_by('pk').values_list('pk', flat=True)) == [tx.pk for tx in txs[5:]]
+        assert list(ArchivedTransaction.objects.order_by('pk').values_list('pk', flat=True)) == [tx.pk
+                                                                                               for tx in txs[:5]]
+        assert history() == before
+        assert Order.objects.get(pk=order.pk).transaction_id == txs[0].pk
+
+        call_command('archive_transactions', '--days', '5', '--no-vacuum', stdout=StringIO())
+        assert list(Transaction.objects.values_list('pk', flat=True)) == [txs[-1].pk]
+        assert history() == before
+        with pytest.raises(CommandError):
+            call_command('archive_transactions', '--batch-size', '0', stdout=StringIO())
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="row locking needs PostgreSQL")
+class TestSettlementConcurrency:
+    TEAMS = 6
+    LISTINGS_PER_TEAM = 4
+    THREADS_PER_TEAM = 3
+
+    def make_league(self):
+        teams = []
+        for i in range(self.TEAMS):
+            user = User.objects.create_user(username=f'racer{i}', password='StrongPass123!')
+            # capital for roughly two purchases, so some buyers run out mid-race
+            teams.append(Team.objects.create(user=user, name=f"Racers {i}", capital=Decimal('2500000.00')))
+        players = Player.objects.bulk_create([
+            Player(name=f"R{t.pk}-{n}", position='MID', owner=t, value=Decimal('1000000.00'))
+            for t in teams for n in range(self.LISTINGS_PER_TEAM)
+        ])
+        for t in teams:
+            Team.objects.filter(pk=t.pk).update(squad_value=Decimal('1000000.00') * self.LISTINGS_PER_TEAM)
+        listings = TransferListing.objects.bulk_create([
+            TransferListing(player=p, seller_id=p.owner_id, price=Decimal('1000000.00')) for p in players
+        ])
+        return [t.pk for t in teams], [l.pk for l in listings]
+
+    def test_crossing_single_and_batch_buyers_never_double_sell_overdraw_or_deadlock(self):
+        team_ids, listing_ids = self.make_league()
+        capital_before = sum(Team.objects.values_list('capital', flat=True))
+        barrier = threading.Barrier(len(team_ids) * self.THREADS_PER_TEAM)
+        sold, deadlocks, unexpected = [], [], []
+
+        def hammer(buyer_id, seed):
+            # every thread walks all listings in its own random order, so buyers cross each other
+            rng = random.Random(seed)
+            order = list(listing_ids)
+            rng.shuffle(order)
+            # every other thread buys in overlapping batches of up to three listings
+            batches = [order[i:i + 3] for i in range(0, len(order), 3)] if seed % 2 else [[l] for l in order]
+            try:
+                barrier.wait()
+                for batch in batches:
+                    try:
+                        sold.extend(tx.pk for tx in settle_listings(batch, buyer_id))
+                    except SettlementError:
+                        pass
+                    except OperationalError as exc:
+                        (deadlocks if 'deadlock' in str(exc) else unexpected).append(exc)
+            except Exception as exc:  # pragma: no cover - surfaced by the assertion below
+                unexpected.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hammer, args=(team_id, n * 1000 + team_id))
+                   for team_id in team_ids for n in range(self.THREADS_PER_TEAM)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert deadlocks == []
+        assert unexpected == []
+        assert sold
+
+        # no double-sells: one transaction per sold listing, and the player ended up with that buyer
+        txs = list(Transaction.objects.values_list('player_id', 'buyer_id', 'seller_id', 'amount'))
+        assert len(txs) == len(sold)
+        assert len({player_id for player_id, *_ in txs}) == len(txs)
+        assert TransferListing.objects.filter(active=False).count() == len(txs)
+        for player_id, buyer_id, seller_id, amount in txs:
+            assert buyer_id != seller_id
+            assert Player.objects.get(pk=player_id).owner_id == buyer_id
+
+        # no negative capital, money is conserved and squad values still add up
+        assert not Team.objects.filter(capital__lt=0).exists()
+        assert sum(Team.objects.values_list('capital', flat=True)) == capital_before
+        call_command('rebuild_team_values', '--verify')
+
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="row locking needs PostgreSQL")
+class TestIdempotencyConcurrency:
+    RETRIES = 6
+
+    def test_concurrent_duplicates_wait_for_the_first_and_replay_it(self):
+        sellers = [Team.objects.create(user=User.objects.create_user(f'dup{i}', password='StrongPass123!'),
+                                       name=f"Dup {i}") for i in range(2)]
+        player = Player.objects.create(name="Dup", position='MID', owner=sellers[0], value=Decimal('100.00'))
+        listing = TransferListing.objects.create(player=player, seller=sellers[0], price=Decimal('100.00'))
+        barrier = threading.Barrier(self.RETRIES)
+        responses, errors = [], []
+
+        def retry():
+            client = APIClient()
+            client.force_authenticate(user=sellers[1].user)
+            try:
+                barrier.wait()
+                resp = client.post(reverse('listings-buy', args=[listing.pk]), HTTP_IDEMPOTENCY_KEY='same')
+                responses.append((resp.status_code, resp.json(), resp.has_header('Idempotent-Replayed')))
+            except Exception as exc:  # pragma: no cover - surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=retry) for _ in range(self.RETRIES)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errors == []
+        # the work ran once; every duplicate got its response, none a "listing not active"
+        assert Transaction.objects.count() == 1
+        assert {(code, json.dumps(body)) for code, body, _ in responses} == {
+            (status.HTTP_201_CREATED, json.dumps(responses[0][1]))}
+        assert sorted(replayed for *_, replayed in responses) == [False] + [True] * (self.RETRIES - 1)
+
+    def test_a_key_claimed_afresh_during_a_purge_is_kept(self):
+        user = User.objects.create_user('purge_race', password='StrongPass123!')
+        IdempotencyKey.objects.create(user=user, key='again', fingerprint=b'old')
+        IdempotencyKey.objects.update(created_at=timezone.now() - idempotency.ttl() - timedelta(minutes=1))
+        purged, errors = [], []
+
+        def purge():
+            try:
+                purged.append(idempotency.purge())
+            except Exception as exc:  # pragma: no cover - surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            pk, stored = idempotency.claim(user.pk, 'again', b'new')
+            assert stored is None
+            purger = threading.Thread(target=purge)
+            purger.start()
+            # let the purge's DELETE reach the claimed row and wait on its lock
+            deadline = time.monotonic() + 10
+            with connection.cursor() as cursor:
+                while time.monotonic() < deadline:
+                    cursor.execute("SELECT count(*) FROM pg_locks WHERE NOT granted")
+                    if cursor.fetchone()[0]:
+                        break
+                    time.sleep(0.01)
+                else:  # pragma: no cover
+                    pytest.fail("the purge never waited on the claimed key")
+            IdempotencyKey.objects.filter(pk=pk).update(status_code=201, response='{}')
+        purger.join()
+
+        assert errors == [] and purged == [0]
+        assert IdempotencyKey.objects.get(pk=pk).status_code == 201
+
+
+@pytest.mark.django_db(transaction=True)  # reads inside a transaction stay on the primary
+class TestReadReplicaRouting:
+    @pytest.fixture
+    def replica(self, settings):
+        # a second connection to the test database, standing in for a streaming replica
+        connections.settings['replica'] = {**connection.settings_dict, 'CONN_MAX_AGE': None,
+                                           'TEST': {'MIRROR': 'default'}}
+        connections['replica'].connect()  # the test case only lets the aliases it was set up with connect lazily
+        settings.DATABASE_REPLICAS = ['replica']
+        cache.clear()
+        yield connections['replica']
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def test_safe_reads_use_the_replica_until_the_reader_writes(self, replica, settings):
+        seller = Team.objects.create(user=User.objects.create_user('rr_seller', password='StrongPass123!'),
+                                     name="Sellers")
+        buyer = Team.objects.create(user=User.objects.create_user('rr_buyer', password='StrongPass123!'),
+                                    name="Buyers")
+        player = Player.objects.create(name="Replicated", position='MID', owner=seller, value=Decimal('100.00'))
+        listing = TransferListing.objects.create(player=player, seller=seller, price=Decimal('100.00'))
+        # real logins: the router must see the token's user, which stays an unloaded ClaimsUser
+        buyers, sellers = APIClient(), APIClient()
+        for client, username in ((buyers, 'rr_buyer'), (sellers, 'rr_seller')):
+            login = client.post(reverse('token_obtain_pair'), {'username': username, 'password': 'StrongPass123!'},
+                                format='json')
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {login.data['access']}")
+
+        def replica_reads(client, url):
+            with CaptureQueriesContext(replica) as queries:
+                resp = client.get(url)
+                assert resp.status_code == status.HTTP_200_OK
+                if resp.streaming:
+                    b''.join(resp.streaming_content)  # an export reads its rows as it is sent
+            return len(queries)
+
+        assert replica_reads(buyers, reverse('team-me')) > 0
+        assert replica_reads(buyers, reverse('listings-list')) > 0
+        assert replica_reads(buyers, '/api/transactions/export/') > 0
+
+        # the purchase locks and reads on the primary, and pins the buyer there for a while
+        with CaptureQueriesContext(replica) as queries:
+            assert buyers.post(reverse('listings-buy', args=[listing.pk])).status_code == status.HTTP_201_CREATED
+        assert len(queries) == 0
+        assert cache.get(db_router.pin_key(buyer.user.pk))
+        assert replica_reads(buyers, reverse('team-me')) == 0
+        assert replica_reads(buyers, reverse('transaction-list')) == 0
+        assert replica_reads(buyers, '/api/transactions/export/') == 0
+        assert replica_reads(sellers, reverse('transaction-list')) > 0  # others lag behind as replicas do
+
+        # a refused write pins nobody
+        assert sellers.post(reverse('listings-buy', args=[listing.pk])).status_code == status.HTTP_404_NOT_FOUND
+        assert replica_reads(sellers, reverse('team-me')) > 0
+
+        cache.delete(db_router.pin_key(buyer.user.pk))  # the window ran out
+        assert replica_reads(buyers, reverse('team-me')) > 0
+
+        # outside a request everything is the primary's
+        with CaptureQueriesContext(replica) as queries:
+            assert Team.objects.get(pk=buyer.pk).players.count() == 1
+        assert len(queries) == 0
+        settings.DATABASE_REPLICAS = []
+        assert replica_reads(sellers, reverse('team-me')) == 0
+
+
+# what the outbox tests' handlers saw: (worker thread, transaction id) per call
+HANDLED = []
+FAILURES = {}
+
+
+def record_handled(message):
+    failures = FAILURES.get(message.payload['transaction_id'], 0)
+    if failures:
+        FAILURES[message.payload['transaction_id']] = failures - 1
+        raise RuntimeError("handler down")
+    time.sleep(0.002)  # long enough for the workers' batches to overlap
+    HANDLED.append((threading.get_ident(), message.payload['transaction_id']))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="SKIP LOCKED needs PostgreSQL")
+class TestOutboxWorkers:
+    WORKERS = 4
+
+    def test_concurrent_workers_handle_every_message_exactly_once(self, settings):
+        settings.OUTBOX_HANDLERS = {outbox.TRANSFER_SETTLED: [f'{__name__}.record_handled']}
+        HANDLED.clear()
+        FAILURES.clear()
+        ids = list(range(1, 401))
+        outbox.enqueue(outbox.TRANSFER_SETTLED, [{'transaction_id': i} for i in ids])
+        FAILURES.update({i: 1 for i in ids[::50]})  # fail once, then go through on the retry
+        barrier = threading.Barrier(self.WORKERS)
+        errors = []
+
+        def drain():
+            worker = outbox.OutboxWorker(batch_size=10, backoff=0, max_backoff=0)
+            try:
+                barrier.wait()
+                while worker.poll():
+                    pass
+            except Exception as exc:  # pragma: no cover - surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=drain) for _ in range(self.WORKERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errors == []
+        assert sorted(i for _, i in HANDLED) == ids
+        assert len({worker for worker, _ in HANDLED}) > 1
+        assert not OutboxMessage.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="row locking needs PostgreSQL")
+class TestDraftConcurrency:
+    DRAFTERS = 8
+
+    def test_concurrent_drafts_never_share_a_player(self):
+        # exactly two squads' worth of free agents, so most drafters must lose a race
+        pool = {pos: [Player.objects.create(name=f"FA-{pos}-{n}", position=pos, value=Decimal('100000.00')).pk
+                      for n in range(2 * count)] for pos, count in POSITIONS.items()}
+        users = [User.objects.create_user(username=f'drafter{i}', password='StrongPass123!')
+                 for i in range(self.DRAFTERS)]
+        barrier = threading.Barrier(len(users))
+        results, unexpected = {}, []
+
+        def draft(user, seed):
+            rng = random.Random(seed)
+            squad = [pk for pos, count in POSITIONS.items() for pk in rng.sample(pool[pos], count)]
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                barrier.wait()
+                resp = client.post(reverse('team-list'), {'name': f"{user.username} XI", 'players': squad},
+                                   format='json')
+                results[user.pk] = (resp.status_code, squad, int(resp['X-DB-Query-Count']))
+            except Exception as exc:  # pragma: no cover - surfaced by the assertion below
+                unexpected.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=draft, args=(u, n)) for n, u in enumerate(users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert unexpected == []
+        assert {code for code, _, _ in results.values()} <= {201, 400}
+        winners = {user_id: squad for user_id, (code, squad, _) in results.items() if code == 201}
+        assert 1 <= len(winners) <= 2
+        assert all(n <= 3 for code, _, n in results.values() if code == 201)
+
+        # every winner got exactly the squad it asked for, losers got nothing and paid nothing
+        assert Team.objects.count() == len(winners)
+        for team in Team.objects.all():
+            assert sorted(team.players.values_list('pk', flat=True)) == sorted(winners[team.user_id])
+            assert team.capital == INITIAL_TEAM_CAPITAL - Decimal('2000000.00')
+        assert Player.objects.filter(owner__isnull=False).count() == 20 * len(winners)
+        call_command('rebuild_team_values', '--verify')
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="plans are PostgreSQL's")
+class TestHotQueryPlans:
+    """
+    EXPLAIN ANALYZE every statement the hot read paths send, on a seeded league.
+
+    Seq scans are switched off, so the planner falls back to one only when no
+    index can serve the query at all; a scan that filters out most of its
+    table (a full index scan standing in for a missing index) fails too. A
+    small test database alone would let the planner prefer seq scans even
+    where the index is right.
+    """
+    MAX_FILTERED_SHARE = 0.5
+
+    @pytest.fixture
+    def league(self):
+        call_command('seed_league', users=300, seed=11, prefix='plan', listed=0.3, free_agents=600, verbosity=0,
+                     stdout=StringIO())
+        # most listings in a live league are long sold or cancelled
+        active = list(TransferListing.objects.order_by('pk').values_list('pk', flat=True))
+        TransferListing.objects.filter(pk__in=active[len(active) // 3:]).update(active=False)
+        # and most of their history is archived: the reads span both tables
+        history = Transaction.objects.order_by('created_at').values_list('created_at', flat=True)
+        assert archive.archive(history[history.count() * 2 // 3], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return Team.objects.select_related('user').order_by('pk')[7]
+
+    def nodes(self, sql, *settings):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for setting in ('enable_seqscan', *settings):
+                cursor.execute(f"SET LOCAL {setting} = off")
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql)
+            plan = cursor.fetchone()[0]
+            for setting in settings:
+                cursor.execute(f"RESET {setting}")  # SET LOCAL outlives the savepoint, up to the test's transaction
+        nodes = [plan[0]['Plan'] if isinstance(plan, list) else json.loads(plan)[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get('Plans', ()))
+            yield node
+
+    def scans(self, sql):
+        return (node for node in self.nodes(sql) if 'Relation Name' in node)
+
+    def assert_indexed(self, label, sql):
+        for node in self.scans(sql):
+            where = (f"{label}: {node['Node Type']} on {node['Relation Name']} ({node.get('Index Name', 'no index')}) "
+                     f"in {sql[:300]}")
+            assert node['Node Type'] != 'Seq Scan', where
+            filtered = node.get('Rows Removed by Filter', 0) * node.get('Actual Loops', 1)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [node['Relation Name']])
+                table_rows = cursor.fetchone()[0]
+            assert filtered <= self.MAX_FILTERED_SHARE * table_rows, f"{where} filtered out {filtered} rows"
+
+    def test_hot_read_paths_use_indexes(self, league):
+        client = APIClient()
+        client.force_authenticate(user=league.user)
+        market = reverse('player-market')
+        paths = [
+            market,
+            market + '?ordering=-price',
+            market + '?ordering=created_at',
+            market + '?ordering=-created_at',
+            market + '?position=mid&min_price=100000&max_price=200000&ordering=-price',
+            reverse('player-list') + '?position=mid',
+            reverse('player-list') + '?position=gk&available=true',
+            reverse('listings-list'),
+            reverse('transaction-list') + '?pagination=cursor',
+            reverse('transaction-list') + f'?pagination=cursor&team={league.pk}',
+            reverse('transaction-list') + f'?pagination=cursor&buyer={league.pk}',
+            reverse('transaction-list') + f'?pagination=cursor&seller={league.pk}',
+            reverse('team-me'),
+            reverse('team-leaderboard'),
+            reverse('team-rank', args=[league.pk]),
+            reverse('order-list'),
+            reverse('analytics-daily') + f'?since={timezone.localdate() - timedelta(days=365)}',
+            reverse('analytics-positions') + '?position=MID',
+            reverse('analytics-players'),
+        ]
+        statements = []
+        for path in paths:
+            with CaptureQueriesContext(connection) as queries:
+                resp = client.get(path)
+                assert resp.status_code == 200, path
+                if resp.data.get('next') and 'cursor=' in resp.data['next']:
+                    assert client.get(resp.data['next']).status_code == 200  # the keyset page 2 query
+            statements += [(path, q['sql']) for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+
+        assert len(statements) > len(paths)
+        for label, sql in statements:
+            self.assert_indexed(label, sql)
+            if label.startswith(reverse('transaction-list')) and 'ORDER BY' in sql:
+                # history pages can walk the (created_at, id) indexes in order, whatever a team's history,
+                # reading no rows they then throw away; the planner may still sort a history as small as
+                # this one, so sorting is switched off too
+                nodes = list(self.nodes(sql, 'enable_sort'))
+                sorts = [node for node in nodes if node['Node Type'] in ('Sort', 'Incremental Sort')]
+                assert not sorts, f"{label}: sorts in {sql[:300]}"
+                skipped = sum(node.get('Rows Removed by Filter', 0) for node in nodes
+                              if node.get('Relation Name') in ('fantasy_transaction', 'fantasy_archivedtransaction'))
+                assert skipped <= 20, f"{label}: walked past {skipped} rows in {sql[:300]}"
+
+    def test_drafting_locks_and_claims_the_squad_through_indexes(self, league):
+        # TeamCreateSerializer's statements on players, as a real draft sends them, rolled back afterwards
+        drafter = User.objects.create_user('plan_drafter', password='StrongPass123!')
+        squad = [pk for position, count in POSITIONS.items()
+                 for pk in Player.objects.filter(owner__isnull=True, position=position).values_list('pk', flat=True)[:count]]
+        client = APIClient()
+        client.force_authenticate(user=drafter)
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                resp = client.post(reverse('team-list'), {'name': "Planned XI", 'players': squad}, format='json')
+            assert resp.status_code == 201, resp.data
+            draft = [q['sql'] for q in queries.captured_queries
+                     if q['sql'].startswith(('SELECT "fantasy_player"', 'UPDATE "fantasy_player"'))]
+            assert [sql.split(' ', 1)[0] for sql in draft] == ['SELECT', 'UPDATE']
+            assert 'FOR UPDATE' in draft[0] and 'GROUP BY' in draft[0]
+            for sql in draft:
+                self.assert_indexed('draft', sql)
+            transaction.set_rollback(True)
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="the pool is psycopg 3's")
+def test_pooled_connections_queue_past_max_size_and_report_it(client):
+    pytest.importorskip('psycopg_pool')
+    # the test database behind a pool of one connection, shared by every wrapper with the alias
+    settings_dict = {**connection.settings_dict, 'CONN_MAX_AGE': 0,
+                     'OPTIONS': {'pool': {'min_size': 1, 'max_size': 1, 'timeout': 5}}}
+    wrapper = type(connections['default'])
+    first = wrapper(settings_dict, alias='pooltest')
+    first.pool.open(wait=True)  # filled up front, so only the second checkout queues
+    connects = db_pool.alias_stats(first)['connects']
+    first.ensure_connection()
+    waiter = {}
+
+    def second_request():
+        second = wrapper(settings_dict, alias='pooltest')
+        with second.cursor() as cursor:  # queues until the first gives its connection back
+            cursor.execute("SELECT 1")
+        second.close()
+        waiter['stats'] = db_pool.alias_stats(second)
+
+    thread = threading.Thread(target=second_request)
+    thread.start()
+    time.sleep(0.3)
+    first.close()  # back to the pool, not to Postgres
+    thread.join(timeout=10)
+    try:
+        stats = waiter['stats']
+        assert stats['mode'] == 'pool' and stats['max_size'] == 1 and stats['size'] == 1
+        assert stats['checkouts'] == 2 and stats['waited'] == 1 and stats['timeouts'] == 0
+        assert stats['wait_ms'] >= 200 and stats['wait_ms_per_checkout'] == round(stats['wait_ms'] / 2, 3)
+        assert stats['connects'] - connects == 2
+    finally:
+        first.close_pool()
+
+    # every worker reports on its own connections
+    admin = User.objects.create_superuser('pool_admin', 'pool@example.com', 'StrongPass123!')
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    report = client.get(reverse('db_pool_stats')).json()
+    assert report['databases']['default']['mode'] == db_pool.mode(connection.settings_dict)
+    client.force_authenticate(user=User.objects.create_user('pool_user', password='StrongPass123!'))
+    assert client.get(reverse('db_pool_stats')).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_export_memory_does_not_grow_with_the_table():
+    Player.objects.bulk_create(Player(name=f"Agent {i}", position=POSITIONS_CYCLE[i % 4], value=Decimal('10.00'))
+                               for i in range(20_000))
+    export = exports.PlayerExport()
+
+    def peak(rows):
+        chunks = 0
+        tracemalloc.start()
+        try:
+            for chunk in exports.stream(export, export.queryset()[:rows], 'ndjson', size=500):
+                chunks += 1  # sent on, not kept
+            return tracemalloc.get_traced_memory()[1], chunks
+        finally:
+            tracemalloc.stop()
+
+    small, small_chunks = peak(2_000)
+    large, large_chunks = peak(20_000)
+    assert (small_chunks, large_chunks) == (4, 40)
+    assert large < small * 1.5, (small, large)
+
+
+@pytest.mark.django_db
+def test_exports_stream_chunk_by_chunk_under_asgi(settings):
+    settings.EXPORT_CHUNK_SIZE = 500
+    user = User.objects.create_user('asgi_exporter', password='StrongPass123!')
+    headers = {'Authorization': f"Bearer {ClaimsTokenObtainPairSerializer.get_token(user).access_token}"}
+
+    async def download():
+        resp = await AsyncClient().get('/api/players/export/', headers=headers)
+        # a sync body would be read whole into a list by the ASGI handler before the first byte is sent
+        assert resp.status_code == 200 and resp.is_async
+        chunks = rows = 0
+        async for chunk in resp.streaming_content:
+            chunks += 1  # sent on, not kept
+            rows += chunk.count(b'\n')
+        return chunks, rows
+
+    def peak():
+        tracemalloc.start()
+        try:
+            return (*async_to_sync(download)(), tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    def add_players(count):
+        Player.objects.bulk_create(Player(name=f"Agent {i}", position=POSITIONS_CYCLE[i % 4], value=Decimal('10.00'))
+                                   for i in range(count))
+
+    add_players(2_000)
+    small_chunks, small_rows, small = peak()
+    add_players(18_000)
+    large_chunks, large_rows, large = peak()
+    assert (small_chunks, small_rows, large_chunks, large_rows) == (4, 2_000, 40, 20_000)
+    assert large < small * 1.5, (small, large)
+
 
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="the tree is kept by PostgreSQL triggers")
+def test_leaderboard_buckets_agree_with_the_database():
+    values = [0, 1, 127, 128, 255, 256, 257, 511, 512, 513, 2 ** 20 - 1, 2 ** 20, 2 ** 20 + 1, 500_000_000,
+              500_000_001, 2 ** 40 + 12345, 2 ** 62, leaderboard.MAX_CENTS]
+    values += [random.Random(20).randrange(10 ** random.Random(i).randrange(1, 18)) for i in range(200)]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT fantasy_leaderboard_bucket(v) FROM unnest(%s::numeric[]) AS v",
+                       [[Decimal(v).scaleb(-2) for v in values]])
+        database = [row[0] for row in cursor.fetchall()]
+    assert database == [leaderboard.bucket(v) for v in values]
+    for v in values:
+        b = leaderboard.bucket(v)
+        low, high = leaderboard.bounds(b)
+        assert low <= v <= high and b < leaderboard.SIZE
+        assert leaderboard.bucket(low) == leaderboard.bucket(high) == b and leaderboard.bucket(high + 1) == b + 1
+        assert high - low <= max(low, 1) / 2 ** leaderboard.MANTISSA_BITS
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="the tree is kept by PostgreSQL triggers")
+def test_leaderboard_ranks_follow_every_write_path():
+    def assert_ranks():
+        totals = dict(Team.objects.annotate(total=leaderboard.TOTAL).values_list('pk', 'total'))
+        for pk, total in totals.items():
+            entry, teams = leaderboard.standing(pk)
+            assert (entry['rank'], teams) == (1 + sum(other > total for other in totals.values()), len(totals))
+        assert dict(LeaderboardNode.objects.exclude(teams=0).values_list('node', 'teams')) == leaderboard.expected_nodes()
+
+    call_command('seed_league', users=30, seed=20, prefix='rank', listed=0.3, free_agents=40, verbosity=0,
+                 stdout=StringIO())
+    teams = list(Team.objects.order_by('pk').values_list('pk', flat=True))
+    # spread the totals over buckets, and tie some of them
+    for i, pk in enumerate(teams):
+        Team.objects.filter(pk=pk).update(capital=F('capital') + Decimal(i % 7) * Decimal('37519.13'))
+    assert_ranks()
+
+    listing = TransferListing.objects.filter(active=True).order_by('pk').first()
+    settle_listing(listing.pk, next(pk for pk in teams if pk != listing.seller_id))
+    player = Player.objects.filter(owner_id=teams[3]).first()
+    player.value = Decimal('7.77')
+    player.save()
+    Player.objects.filter(owner_id=teams[4]).first().delete()
+    Team.objects.get(pk=teams[5]).user.delete()
+    assert_ranks()
+
+    drafter = User.objects.create_user('rank_drafter', password='StrongPass123!')
+    client = APIClient()
+    client.force_authenticate(user=drafter)
+    free = {p: list(Player.objects.filter(owner__isnull=True, position=p).values_list('pk', flat=True)[:n])
+            for p, n in POSITIONS.items()}
+    resp = client.post(reverse('team-list'), {'name': "Late XI", 'players': sum(free.values(), [])}, format='json')
+    assert resp.status_code == status.HTTP_201_CREATED, resp.data
+    Revaluation(max_change=0.1).run()
+    assert_ranks()
+
+    resp = client.get(reverse('team-leaderboard'), {'limit': 5})
+    assert resp.status_code == status.HTTP_200_OK
+    board = resp.json()
+    drafted = Team.objects.get(user=drafter).pk
+    mine, teams_count = leaderboard.standing(drafted)
+    assert board['teams'] == teams_count == Team.objects.count() and board['me'] == json.loads(json.dumps(mine))
+    assert [row['rank'] for row in board['results']][0] == 1 and len(board['results']) == 5
+    totals = [Decimal(row['total_value']) for row in board['results']]
+    assert totals == sorted(totals, reverse=True)
+    assert totals[0] == max(t.total_value for t in Team.objects.all())
+
+    other = Team.objects.exclude(pk=drafted).order_by('pk').first()
+    resp = client.get(reverse('team-rank', args=[other.pk]))
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()['rank'] == leaderboard.standing(other.pk)[0]['rank']
+    assert client.get(reverse('team-rank', args=[10 ** 9])).status_code == status.HTTP_404_NOT_FOUND
+    assert client.get(reverse('team-leaderboard'), {'limit': 0}).status_code == status.HTTP_400_BAD_REQUEST
+
+    LeaderboardNode.objects.filter(node=leaderboard.SIZE).update(teams=F('teams') + 1)
+    with pytest.raises(CommandError):
+        call_command('rebuild_leaderboard', '--verify', stdout=StringIO())
+    call_command('rebuild_leaderboard', stdout=StringIO())
+    assert_ranks()
+
+
+@pytest.mark.django_db
+def test_analytics_rollups_follow_settlement_and_match_the_history():
+    call_command('seed_league', users=30, seed=21, prefix='stats', listed=0.5, history_days=10, verbosity=0,
+                 stdout=StringIO())
+    today = timezone.localdate()
+    seeded = PositionDay.objects.aggregate(t=Sum('trades'))['t']
+    assert seeded == Transaction.objects.filter(player__isnull=False).count() > 0
+    call_command('rebuild_analytics', '--verify', stdout=StringIO())
+
+    teams = list(Team.objects.order_by('pk').values_list('pk', flat=True))
+    listings = list(TransferListing.objects.filter(active=True).select_related('player').order_by('pk')[:5])
+    buyer = next(pk for pk in teams if all(l.seller_id != pk for l in listings))
+    Team.objects.filter(pk=buyer).update(capital=Decimal('100000000.00'))
+    with CaptureQueriesContext(connection) as queries:
+        settle_listing(listings[0].pk, buyer)
+    assert sum('fantasy_positionday' in q['sql'] for q in queries.captured_queries) == 1
+    settle_listings([l.pk for l in listings[1:]], buyer)
+    traded = listings[1:3] + listings[:1]
+    for l in traded:  # the order book settles through the rollups too
+        ask = Order.objects.create(team_id=buyer, side='ASK', player=l.player, position=l.player.position,
+                                   price=Decimal('10.00'))
+        bid = Order.objects.create(team_id=l.seller_id, side='BID', player=l.player, position=l.player.position,
+                                   price=Decimal('10.00'))
+        txs, rejected = settle_fills([Fill(BookOrder(bid.pk, bid.team_id, 'BID', l.player_id, bid.position, bid.price),
+                                           BookOrder(ask.pk, ask.team_id, 'ASK', l.player_id, ask.position, ask.price),
+                                           Decimal('10.00'))])
+        assert txs[0] is not None and not rejected
+    call_command('rebuild_analytics', '--verify', stdout=StringIO())
+
+    history = Transaction.objects.filter(player__isnull=False, created_at__date=today)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get(team__pk=buyer))
+    resp = client.get(reverse('analytics-daily'), {'since': today - timedelta(days=10)})
+    assert resp.status_code == status.HTTP_200_OK
+    days = resp.json()['results']
+    assert len(days) == 11 and days[-1]['day'] == today.isoformat()
+    assert days[-1]['trades'] == history.count()
+    assert Decimal(days[-1]['volume']) == history.aggregate(v=Sum('amount'))['v']
+    assert sum(d['trades'] for d in days) == Transaction.objects.count()
+
+    resp = client.get(reverse('analytics-positions'), {'since': today, 'until': today})
+    by_position = {row['position']: row for row in resp.json()['results']}
+    for position, _ in POSITION_CHOICES:
+        mine = history.filter(player__position=position)
+        assert by_position[position]['trades'] == mine.count()
+        if mine.exists():
+            average = (mine.aggregate(v=Sum('amount'))['v'] / mine.count()).quantize(Decimal('0.01'), ROUND_HALF_UP)
+            assert Decimal(by_position[position]['average_price']) == average
+        else:
+            assert by_position[position]['average_price'] is None
+
+    resp = client.get(reverse('analytics-players'), {'since': today, 'until': today, 'limit': 2})
+    top = [(row['id'], row['trades'], Decimal(row['volume'])) for row in resp.json()['results']]
+    counted = history.values('player').annotate(n=Count('pk'), v=Sum('amount')).values_list('player', 'n', 'v')
+    assert top == sorted(counted, key=lambda row: (-row[1], -row[2], row[0]))[:2]
+    assert top[0][1] == 2  # a listing bought, then sold back through the book
+    assert client.get(reverse('analytics-daily'), {'since': today, 'until': today - timedelta(days=1)}
+                      ).status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get(reverse('analytics-daily'), {'position': 'XX'}).status_code == status.HTTP_400_BAD_REQUEST
+
+    # a lost rollup is found, and rebuilt from the history in chunks
+    PositionDay.objects.filter(day=today).delete()
+    PlayerDay.objects.filter(day__lt=today).delete()
+    with pytest.raises(CommandError):
+        call_command('rebuild_analytics', '--verify', stdout=StringIO())
+    call_command('rebuild_analytics', '--days-per-chunk', '3', stdout=StringIO())
+    call_command('rebuild_analytics', '--verify', stdout=StringIO())
+    assert PositionDay.objects.aggregate(t=Sum('trades'))['t'] == Transaction.objects.count()
+
+@pytest.mark.django_db
+def test_outbox_messages_commit_with_the_settlement_and_retry_with_backoff(settings):
+    settings.OUTBOX_HANDLERS = {outbox.TRANSFER_SETTLED: [f'{__name__}.record_handled', 'fantasy.outbox.log_transfer']}
+    HANDLED.clear()
+    FAILURES.clear()
+    call_command('seed_league', users=4, seed=22, prefix='outbox', listed=1, history=0, verbosity=0, stdout=StringIO())
+    seller, buyer = Team.objects.order_by('pk')[:2]
+    listings = list(TransferListing.objects.filter(seller=seller).order_by('pk'))
+
+    Team.objects.filter(pk=buyer.pk).update(capital=0)
+    with pytest.raises(SettlementError):
+        settle_listing(listings[0].pk, buyer.pk)
+    assert not OutboxMessage.objects.exists()  # rolled back with the purchase
+
+    Team.objects.filter(pk=buyer.pk).update(capital=Decimal('100000000.00'))
+    tx = settle_listing(listings[0].pk, buyer.pk)
+    txs = [tx, *settle_listings([l.pk for l in listings[1:3]], buyer.pk)]
+    messages = list(OutboxMessage.objects.order_by('pk'))
+    assert [(m.topic, m.payload['transaction_id']) for m in messages] == [(outbox.TRANSFER_SETTLED, t.pk) for t in txs]
+    assert messages[0].payload == {'transaction_id': tx.pk, 'player_id': tx.player_id, 'buyer_id': buyer.pk,
+                                   'seller_id': seller.pk, 'amount': str(tx.amount),
+                                   'created_at': tx.created_at.isoformat()}
+
+    FAILURES[txs[1].pk] = 2
+    worker = outbox.OutboxWorker(backoff=30, max_backoff=60, max_attempts=3)
+    started = timezone.now()
+    assert worker.poll() == 3
+    assert sorted(i for _, i in HANDLED) == [txs[0].pk, txs[2].pk]
+    failed = OutboxMessage.objects.get()
+    assert (failed.attempts, failed.last_error) == (1, "RuntimeError: handler down")
+    assert started + timedelta(seconds=15) <= failed.available_at <= timezone.now() + timedelta(seconds=30)
+    assert worker.poll() == 0  # not due yet
+
+    OutboxMessage.objects.update(available_at=started)
+    assert worker.poll() == 1
+    failed.refresh_from_db()
+    assert failed.attempts == 2 and started + timedelta(seconds=30) <= failed.available_at  # doubled
+    OutboxMessage.objects.update(available_at=started)
+    call_command('run_outbox', '--once', stdout=StringIO())
+    assert not OutboxMessage.objects.exists() and len(HANDLED) == 3
+    assert dict(worker.stats) == {'handled': 2, 'retried': 2, 'given_up': 0}
+
+    # a message nothing can handle is given up on after the last attempt, and kept
+    outbox.enqueue('unknown.topic', [{}])
+    worker = outbox.OutboxWorker(backoff=0, max_backoff=0, max_attempts=2)
+    assert worker.poll() == 1 and worker.poll() == 1 and worker.poll() == 0
+    dead = OutboxMessage.objects.get()
+    assert dead.failed_at is not None and dead.attempts == 2 and "No handler" in dead.last_error
+
+def test_revaluation_matches_decimal_arithmetic_to_the_cent():
+    rng = random.Random(19)
+    revaluation = Revaluation(anchor=0.37, max_change=0.15)
+    revaluation.rates = np.array([9000, 10450, 12333, 8500, 10000])
+    pks = np.arange(1, 20_001)
+    positions = np.array([rng.randrange(5) for _ in pks])
+    values = np.array([rng.randrange(10 ** rng.randrange(1, 12)) for _ in pks])
+    revaluation.sold_ids = pks[::3]
+    revaluation.sold_cents = np.array([rng.randrange(10 ** 11) for _ in revaluation.sold_ids])
+    sold = dict(zip(revaluation.sold_ids.tolist(), revaluation.sold_cents.tolist()))
+
+    def reference(pk, position, value):
+        cent, value = Decimal('0.01'), Decimal(value) / 100
+        last = Decimal(sold.get(pk, int(value * 100))) / 100
+        target = (value * Decimal('0.63') + last * Decimal('0.37')).quantize(cent, ROUND_HALF_UP)
+        price = (target * Decimal(int(revaluation.rates[position])) / 10000).quantize(cent, ROUND_HALF_UP)
+        low, high = ((value * rate).quantize(cent, ROUND_HALF_UP) for rate in (Decimal('0.85'), Decimal('1.15')))
+        return int(min(max(price, low), high) * 100)
+
+    new = revaluation.reprice(pks, positions, values)
+    assert new.tolist() == [reference(*row) for row in zip(pks.tolist(), positions.tolist(), values.tolist())]
+
+
+def test_order_book_price_time_priority_and_no_self_trades():
+    book = OrderBook()
+    ids = iter(range(1, 100))
+
+    def add(team, side, price, player=None, position='MID'):
+        return book.add(BookOrder(next(ids), team, side, player, position, Decimal(price)))
+
+    assert add(1, BID, '100.00') is None                # 1: position bid
+    assert add(2, BID, '120.00', player=7) is None      # 2: bid on player 7
+    assert add(3, BID, '120.00') is None                # 3: better position bid
+
+    # the better position bid wins and team 2's own bid on the player is skipped; the trade is at the
+    # resting bid's price
+    fill = add(2, ASK, '90.00', player=7)               # 4
+    assert (fill.bid.id, fill.ask.id, fill.price) == (3, 4, Decimal('120.00'))
+    fill = add(4, ASK, '90.00', player=7)               # 5
+    assert (fill.bid.id, fill.price) == (2, Decimal('120.00'))
+
+    assert add(1, ASK, '100.00', player=9) is None      # 6: only team 1's own bid would cross
+    assert add(5, BID, '99.00') is None                 # 7: below the ask
+    fill = add(5, BID, '100.00', player=9)              # 8
+    assert (fill.bid.id, fill.ask.id, fill.price) == (8, 6, Decimal('100.00'))
+
+    assert book.cancel(1) and not book.cancel(1)
+    fill = add(6, ASK, '50.00', player=10)              # 9: bid 1 is gone, bid 7 is next
+    assert (fill.bid.id, fill.price) == (7, Decimal('99.00'))
+
+    assert add(7, BID, '50.00') is None                 # 10
+    assert add(8, BID, '50.00') is None                 # 11: same price, later
+    assert add(9, ASK, '50.00', player=11).bid.id == 10
+    assert len(book) == 1 and 11 in book
+    with pytest.raises(ValueError):
+        book.add(BookOrder(11, 8, BID, None, 'MID', Decimal('50.00')))
@@ -1,23 +1,33 @@
-from rest_framework import viewsets, permissions, status, generics ,filters as drf_filters
+from rest_framework import viewsets, mixins, permissions, status, generics ,filters as drf_filters
+from rest_framework.views import APIView
 from rest_framework.decorators import action
 from django_filters import rest_framework as df_filters
 from rest_framework.response import Response
-from django.db import transaction
-from decimal import Decimal
-import random
+from rest_framework.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth.models import User
-from .models import Team, Player, TransferListing, Transaction
+from .models import Team, Player, TransferListing, Transaction, TransactionHistory, TeamTransaction, Order
 from .serializers import (UserRegisterSerializer, UserProfileSerializer,TeamSerializer,
                           PlayerSerializer, TransferListingSerializer,
-                          TransactionSerializer,TeamCreateSerializer)
+                          TransactionSerializer,TeamCreateSerializer,
+                          BatchBuySerializer, OrderSerializer, AnalyticsQuerySerializer)
+from .pagination import MarketCursorPagination, TransactionCursorPagination
+from .settlement import settle_listing, settle_listings, SettlementError
+from .authentication import team_id_of
+from .idempotency import idempotent
+from . import market_cache, db_pool, etags, exports, fast_serializers, leaderboard, analytics
 
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserRegisterSerializer
+    query_budgets = {'create': 3, 'list': 2, 'retrieve': 1}
 
     def get_permissions(self):
         if self.action in ['create']:
@@ -32,6 +42,7 @@ class RegisterAPIView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [permissions.AllowAny]
     serializer_class = UserRegisterSerializer
+    query_budgets = {'post': 3}
 
     def perform_create(self, serializer):
         return serializer.save()  # signals create team/players
@@ -40,11 +51,61 @@ class RegisterAPIView(generics.CreateAPIView):
 class ProfileAPIView(generics.RetrieveAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {'get': 1}
 
     def get_object(self):
         return self.request.user
 
 
+class FastListMixin:
+    """
+    ``list`` through ``fast_serializer_class`` when settings.FAST_SERIALIZERS
+    is on: same filters, ordering and pagination, over ``.values()`` rows
+    (fantasy/fast_serializers.py) instead of model instances.
+    """
+    fast_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers.enabled():
+            return super().list(request, *args, **kwargs)
+        fast = self.fast_serializer_class()
+        queryset = fast.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(fast.rows(page))
+        return Response(fast.rows(queryset))
+
+
+def export_response(request, name, filterset_class):
+    """
+    ``?output=ndjson|csv`` export of the whole table, narrowed by
+    ``filterset_class`` (fantasy/exports.py). Rows are read while the response
+    streams, after the query instrumentation has reported on the view; under
+    ASGI through an async iterator, chunk by chunk.
+    """
+    output = request.query_params.get('output', 'ndjson')
+    if output not in exports.OUTPUTS:
+        raise ValidationError({'output': [f"Choose one of: {', '.join(exports.OUTPUTS)}."]})
+    export = exports.EXPORTS[name]()
+    filterset = filterset_class(request.query_params, queryset=export.queryset(request.query_params), request=request)
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    return exports.response(export, filterset.qs, output, asynchronous=isinstance(request._request, ASGIRequest))
+
+
+# a team's squad in id order, so every rendering of a team lists it the same way
+SQUAD = Prefetch('players', queryset=Player.objects.order_by('pk'))
+
+
+class DatabasePoolStatsAPIView(APIView):
+    # connection mode and pool counters of the worker that answers (fantasy/db_pool.py)
+    permission_classes = [IsAdminUser]
+    query_budgets = {'get': 1}
+
+    def get(self, request):
+        return Response(db_pool.stats())
+
+
 # class TeamViewSet(viewsets.ReadOnlyModelViewSet):
 #     queryset = Team.objects.prefetch_related('players').all()
 #     serializer_class = TeamSerializer
@@ -61,38 +122,115 @@ class ProfileAPIView(generics.RetrieveAPIView):
 #         return Response(serializer.data)
 
 
-class TeamViewSet(viewsets.ModelViewSet):
-    queryset = Team.objects.prefetch_related('players').all()
+LEADERBOARD_LIMIT = 10
+MAX_LEADERBOARD_LIMIT = 100
+
+
+class TeamViewSet(FastListMixin, viewsets.ModelViewSet):
+    queryset = Team.objects.prefetch_related(SQUAD).all()
     serializer_class = TeamSerializer
+    fast_serializer_class = fast_serializers.FastTeamSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 3, 'retrieve': 2, 'me': 3, 'create': 4, 'partial_update': 6, 'update': 6,
+                     'leaderboard': 5, 'rank': 3}
 
     def get_serializer_class(self):
         if self.action == "create":
             return TeamCreateSerializer
         return TeamSerializer
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def get_queryset(self):
-        return Team.objects.filter(user=self.request.user)
+        return Team.objects.filter(user_id=self.request.user.pk).select_related('user').prefetch_related(SQUAD)
 
     @action(detail=False, methods=['get'])
     def me(self, request):
-        team = request.user.team
+        # polled constantly: If-None-Match with the team's current version is a 304 after one query
+        versioned = etags.team_version(request.user.pk)
+        if versioned is None:
+            raise Http404("No Team matches the given query.")  # get_object_or_404's message
+        team_id, version = versioned
+        etag = etags.team_etag(team_id, version, output=request.accepted_renderer.format)
+        not_modified = etags.not_modified(request, etag, per_user=True)
+        if not_modified is not None:
+            return not_modified
+
+        if fast_serializers.enabled():
+            fast = fast_serializers.FastTeamSerializer()
+            rows = fast.rows(fast.values(Team.objects.filter(pk=team_id)))
+            if not rows:
+                raise Http404("No Team matches the given query.")
+            return Response(rows[0], headers=etags.headers(etag, per_user=True))
+        # players' owner is filled in from the prefetch, so rendering costs no extra queries
+        team = get_object_or_404(Team.objects.select_related('user').prefetch_related(SQUAD), pk=team_id)
         serializer = self.get_serializer(team)
-        return Response(serializer.data)
+        return Response(serializer.data, headers=etags.headers(etag, per_user=True))
+
+    @action(detail=False, methods=['get'])
+    def leaderboard(self, request):
+        # ?limit= most valuable teams, and where the requesting user's team stands
+        try:
+            limit = int(request.query_params.get('limit', LEADERBOARD_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': "A whole number is required."})
+        if not 1 <= limit <= MAX_LEADERBOARD_LIMIT:
+            raise ValidationError({'limit': f"Must be between 1 and {MAX_LEADERBOARD_LIMIT}."})
+        results = leaderboard.top(limit)
+        team_id = team_id_of(request.user)
+        standing = leaderboard.standing(team_id) if team_id is not None else None
+        me, teams = standing if standing is not None else (None, leaderboard.team_count())
+        return Response({'teams': teams, 'results': results, 'me': me})
+
+    @action(detail=True, methods=['get'])
+    def rank(self, request, pk=None):
+        # any team's standing, not just the user's own: no get_object()
+        try:
+            standing = leaderboard.standing(int(pk))
+        except ValueError:
+            standing = None
+        if standing is None:
+            raise Http404("No Team matches the given query.")
+        me, teams = standing
+        return Response({**me, 'teams': teams})
 
 
 
 class PlayerFilter(df_filters.FilterSet):
     # case-insensitive exact match on Player.position
     position = df_filters.CharFilter(field_name="position", lookup_expr="iexact")
+    # ?available=true: free agents, the players a new team can draft
+    available = df_filters.BooleanFilter(field_name="owner", lookup_expr="isnull")
 
     class Meta:
         model = Player
-        fields = ["position"]
+        fields = ["position", "available"]
 
-class PlayerViewSet(viewsets.ModelViewSet):
-    queryset = Player.objects.select_related('owner').all()
+class MarketFilter(df_filters.FilterSet):
+    # same case-insensitive position match as PlayerFilter, plus a price range
+    position = df_filters.CharFilter(field_name="player__position", lookup_expr="iexact")
+    min_price = df_filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = df_filters.NumberFilter(field_name="price", lookup_expr="lte")
+
+    class Meta:
+        model = TransferListing
+        fields = ["position", "min_price", "max_price"]
+
+class ListingFilter(MarketFilter):
+    # the listings export covers sold and cancelled listings too, unless ?active= says otherwise
+    active = df_filters.BooleanFilter(field_name="active")
+
+    class Meta(MarketFilter.Meta):
+        fields = MarketFilter.Meta.fields + ["active"]
+
+class PlayerViewSet(FastListMixin, viewsets.ModelViewSet):
+    queryset = Player.objects.select_related('owner__user').all()
     serializer_class = PlayerSerializer
+    fast_serializer_class = fast_serializers.FastPlayerSerializer
+    query_budgets = {'list': 2, 'retrieve': 1, 'market': 3, 'market_cache_stats': 2, 'export': 0,
+                     'partial_update': 5, 'update': 5}
     # filterset_fields = ['position']  # you can add more fields if needed
     # search_fields = ['name']  # example
     # ordering_fields = ['id', 'position']
@@ -103,111 +241,212 @@ class PlayerViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def market(self, request):
-        # players on sale (active)
+        # players on sale (active), served from the versioned market cache when possible
+        version = market_cache.current_version()
+        etag = etags.market_etag(version, request, output=request.accepted_renderer.format)
+        not_modified = etags.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        payload = market_cache.get_page(version, request)
+        if payload is not None:
+            return Response(payload, headers={'X-Market-Cache': 'hit', **etags.headers(etag)})
+
         listings = TransferListing.objects.filter(active=True)
-        data = []
-        for l in listings:
-            data.append({
-                'listing_id': l.id,
-                'player': PlayerSerializer(l.player, context={'request': request}).data,
-                'price': l.price,
-                'seller': l.seller.name,
-            })
-        return Response(data)
+        filterset = MarketFilter(request.query_params, queryset=listings, request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        # the keyset query only needs the ordering columns; rows come from the fragment cache
+        paginator = MarketCursorPagination()
+        page = paginator.paginate_queryset(filterset.qs.only('id', 'price', 'created_at'), request, view=self)
+        rows = market_cache.render_listings(version, [l.pk for l in page], {'request': request})
+        response = paginator.get_paginated_response(rows)
+        market_cache.set_page(version, request, response.data)
+        response['X-Market-Cache'] = 'miss'
+        for name, value in etags.headers(etag).items():
+            response[name] = value
+        return response
+
+    @action(detail=False, methods=['get'], url_path='market/cache-stats', permission_classes=[IsAdminUser])
+    def market_cache_stats(self, request):
+        return Response(market_cache.stats())
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # every player, with PlayerFilter's ?position= and ?available=
+        return export_response(request, 'players', PlayerFilter)
 
 
 class TransferListingViewSet(viewsets.ModelViewSet):
     queryset = TransferListing.objects.select_related('player','seller').all()
     serializer_class = TransferListingSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 2, 'retrieve': 1, 'create': 3, 'destroy': 3, 'buy': 11, 'buy_batch': 11,
+                     'export': 0, 'partial_update': 3, 'update': 3}
 
     def get_queryset(self):
-        return TransferListing.objects.filter(active=True)
+        return TransferListing.objects.filter(active=True).select_related('player__owner__user', 'seller__user')
 
     def perform_destroy(self, instance):
         # cancel (mark inactive) only by seller
-        user_team = self.request.user.team
-        if instance.seller != user_team:
+        if instance.seller.user_id != self.request.user.id:
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("Only seller can cancel this listing.")
         instance.active = False
-        instance.save()
+        instance.save(update_fields=['active'])
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # every listing ever made: ?active=, plus the market's ?position=, ?min_price=, ?max_price=
+        return export_response(request, 'listings', ListingFilter)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def buy(self, request, pk=None):
         """
         Purchase a player listed for sale.
         """
-        print("IINN BBUUYY", pk,self.get_object())
-        listing = self.get_object()
-        print("IINN BBUUYY1")
-        buyer_team = request.user.team
-        print("IINN BBUUYY2")
-        seller_team = listing.seller
-        print("IINN BBUUYY3")
-
-        if not listing.active:
-            print("IN INACTIVE")
-            return Response({'detail':'Listing not active.'}, status=status.HTTP_400_BAD_REQUEST)
-        if buyer_team == seller_team:
-            return Response({'detail':'Cannot buy your own player.'}, status=status.HTTP_400_BAD_REQUEST)
-        print("AFTER===")
-        price = listing.price
-        if buyer_team.capital < price:
-            return Response({'detail':'Insufficient capital.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        with transaction.atomic():
-            # debit buyer
-            buyer = Team.objects.select_for_update().get(pk=buyer_team.pk)
-            seller = Team.objects.select_for_update().get(pk=seller_team.pk)
-            player = Player.objects.select_for_update().get(pk=listing.player.pk)
-
-            # Verify ownership still holds
-            if player.owner != seller:
-                return Response({'detail':'Seller no longer owns player.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Transfer money
-            buyer.capital = buyer.capital - price
-            seller.capital = seller.capital + price
-
-            buyer.save()
-            seller.save()
-
-            # Change player owner
-            player.owner = buyer
-            # Random value increase: e.g., between 5% and 15%
-            increase_pct = Decimal(random.uniform(0.05, 0.15))
-            new_value = (player.value * (Decimal('1.0') + increase_pct)).quantize(Decimal('0.01'))
-            player.value = new_value
-            player.save()
-
-            # record transaction (initially active True, then we mark inactive per your constraints)
-            tx = Transaction.objects.create(
-                buyer=buyer,
-                seller=seller,
-                player=player,
-                amount=price,
-                active=True,
-            )
-
-            # Mark listing inactive (can't be reused)
-            listing.active = False
-            listing.save()
-
-            # As per constraint: "Once a transfer is completed, the corresponding transfer entry should be marked as inactive and cannot be deleted."
-            # Transaction record should be marked inactive (so it's immutable?) — interpretation: mark tx.active=False to indicate completed and immutable.
-            tx.active = False
-            tx.save()
-
-            serializer = TransactionSerializer(tx, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-
-class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Transaction.objects.select_related('buyer','seller','player').all().order_by('-created_at')
+        return self._settle(request, lambda buyer_team_id: [settle_listing(pk, buyer_team_id)])
+
+    @action(detail=False, methods=['post'], url_path='buy-batch')
+    @idempotent
+    def buy_batch(self, request):
+        """
+        Purchase several listings in one all-or-nothing transaction: {"listing_ids": [..]}.
+        """
+        serializer = BatchBuySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        listing_ids = serializer.validated_data['listing_ids']
+        return self._settle(request, lambda buyer_team_id: settle_listings(listing_ids, buyer_team_id), many=True)
+
+    def _settle(self, request, settle, many=False):
+        buyer_team_id = team_id_of(request.user)
+        if buyer_team_id is None:
+            return Response({'detail':'You need a team to buy players.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            txs = settle(buyer_team_id)
+        except SettlementError as exc:
+            return Response({'detail': exc.detail}, status=exc.status_code)
+
+        txs = (Transaction.objects.select_related('buyer__user', 'seller__user', 'player__owner__user')
+               .filter(pk__in=[tx.pk for tx in txs]).order_by('pk'))
+        serializer = TransactionSerializer(txs if many else txs[0], many=many, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class OrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                   mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Your team's bids and asks on the order book. Orders are matched by the
+    run_matching engine, not here: a new order is OPEN until it fills
+    (status FILLED, with its transaction) or is cancelled with DELETE.
+    """
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'create': 5, 'list': 2, 'retrieve': 1, 'destroy': 2}
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['side', 'status']
+
+    def get_queryset(self):
+        return Order.objects.filter(team__user_id=self.request.user.pk).select_related('team__user').order_by('-id')
+
+    def perform_destroy(self, instance):
+        # only an open order can be cancelled; the engine may have filled it a moment ago
+        if not Order.objects.filter(pk=instance.pk, status=Order.OPEN).update(status=Order.CANCELLED):
+            raise ValidationError("Only open orders can be cancelled.")
+
+
+class TransactionFilter(df_filters.FilterSet):
+    # ?team= matches either side of the deal. `buyer = t OR seller = t` can walk neither side's
+    # (team, created_at, id) index in order, so those queries read TeamTransaction, which has a row per
+    # side: TransactionViewSet and TransactionExport.queryset() pick it, and TeamTransactionFilter, for ?team=
+    team = df_filters.NumberFilter(method="filter_team")
+
+    class Meta:
+        model = TransactionHistory
+        fields = ["buyer", "seller", "team"]
+
+    def filter_team(self, queryset, name, value):
+        return TeamTransaction.for_team(queryset, value)
+
+
+class TeamTransactionFilter(TransactionFilter):
+    class Meta(TransactionFilter.Meta):
+        model = TeamTransaction
+
+
+class TransactionViewSet(FastListMixin, viewsets.ReadOnlyModelViewSet):
+    # hot and archived transactions alike (fantasy/archive.py)
+    related = ('buyer__user', 'seller__user', 'player__owner__user')
+    queryset = TransactionHistory.objects.select_related(*related).all().order_by('-created_at', '-id')
     serializer_class = TransactionSerializer
+    fast_serializer_class = fast_serializers.FastTransactionSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 2, 'retrieve': 1, 'export': 2}
+    filter_backends = [DjangoFilterBackend]
+
+    def by_team(self):
+        # ?team= reads a row per side of each deal, narrowed to the team's by TransactionFilter.filter_team
+        return bool(self.request.query_params.get('team'))
+
+    @property
+    def filterset_class(self):
+        return TeamTransactionFilter if self.by_team() else TransactionFilter
 
     def get_queryset(self):
         # allow all users to view transaction history (global). Could limit to user's transactions via query param.
+        if self.by_team():
+            return TeamTransaction.objects.select_related(*self.related).order_by('-created_at', '-id')
         return self.queryset
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor swaps LIMIT/OFFSET + COUNT(*) for a keyset walk whose cost is the same on every page
+        if not hasattr(self, '_paginator') and self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = TransactionCursorPagination()
+        return super().paginator
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # the whole history in id order, with the list's ?team=, ?buyer=, ?seller= (each checked: 1 query)
+        return export_response(request, 'transactions', self.filterset_class)
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """
+    Market dashboards, read from the rollup tables alone (fantasy/analytics.py),
+    for the days ?since= to ?until= (the last 30 by default).
+    """
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'daily': 1, 'positions': 1, 'players': 2}
+
+    def _query(self, request):
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        # transfers and volume per day, every day of the range; ?position= narrows them to one
+        query = self._query(request)
+        results = analytics.daily(query['since'], query['until'], query.get('position'))
+        return Response({'since': query['since'], 'until': query['until'], 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def positions(self, request):
+        query = self._query(request)
+        results = analytics.positions(query['since'], query['until'])
+        return Response({'since': query['since'], 'until': query['until'], 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def players(self, request):
+        # the ?limit= most traded players
+        query = self._query(request)
+        results = analytics.top_players(query['since'], query['until'], query['limit'])
+        return Response({'since': query['since'], 'until': query['until'], 'results': results})
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fantasy_project.settings')
+# route the read-heavy endpoints to their async views (fantasy_project.asgi_urls)
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
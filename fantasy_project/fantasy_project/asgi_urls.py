@@ -0,0 +1,18 @@
+"""
+URL configuration under ASGI (see asgi.py): the read-heavy endpoints are
+served by their async views in fantasy.async_views, everything else exactly
+as in urls.py.
+"""
+from django.urls import path
+
+from fantasy.async_views import MarketView, PlayerListView, TeamMeView, TransactionListView
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path("api/players/", PlayerListView.as_view(), name="async-player-list"),
+    path("api/players/market/", MarketView.as_view(), name="async-player-market"),
+    path("api/transactions/", TransactionListView.as_view(), name="async-transaction-list"),
+    path("api/teams/me/", TeamMeView.as_view(), name="async-team-me"),
+    *sync_urlpatterns,
+]
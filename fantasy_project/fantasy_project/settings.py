@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import copy
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,15 +55,19 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'fantasy.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'fantasy.middleware.ReadReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'fantasy_project.urls'
+# asgi.py turns ASYNC_VIEWS on: market, transactions, players list and teams/me then run as async views
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "0") == "1"
+ROOT_URLCONF = 'fantasy_project.asgi_urls' if ASYNC_VIEWS else 'fantasy_project.urls'
 
 TEMPLATES = [
     {
@@ -91,8 +97,6 @@ WSGI_APPLICATION = 'fantasy_project.wsgi.application'
 #     }
 # }
 
-import os
-
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -104,6 +108,36 @@ DATABASES = {
     }
 }
 
+# Connection reuse, per worker process (fantasy/db_pool.py reports on it):
+#   DB_POOL=1          psycopg 3's pool: DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections, requests wait up to
+#                      DB_POOL_TIMEOUT seconds for a free one. gunicorn.conf.py sizes it to the worker.
+#   otherwise          persistent connections kept DB_CONN_MAX_AGE seconds (0: one per request), checked
+#                      before reuse unless DB_CONN_HEALTH_CHECKS=0. Off under ASGI, where every request
+#                      runs in a thread of its own and would leave its connection behind.
+DB_POOL = os.getenv("DB_POOL", "0") == "1"
+if DB_POOL:
+    DATABASES["default"]["OPTIONS"] = {"pool": {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "4")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    }}
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "0" if ASYNC_VIEWS else "60"))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = os.getenv("DB_CONN_HEALTH_CHECKS", "1") == "1"
+
+# Read replicas (fantasy/db_router.py): DB_REPLICA_HOSTS="host[:port],..." adds an alias per replica,
+# replica1, replica2..., with the primary's name, credentials and connection settings. Safe requests
+# read from one of them; writers read their own writes from the primary for READ_YOUR_WRITES_SECONDS.
+DATABASE_REPLICAS = []
+for n, address in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(",")), 1):
+    host, _, port = address.strip().partition(":")
+    alias = f"replica{n}"
+    DATABASES[alias] = copy.deepcopy(DATABASES["default"])
+    DATABASES[alias].update(HOST=host, PORT=port or DATABASES["default"]["PORT"], TEST={"MIRROR": "default"})
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["fantasy.db_router.ReplicaRouter"]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,15 +159,47 @@ AUTH_PASSWORD_VALIDATORS = [
 
 
 REST_FRAMEWORK = {
+    # trusts the token's claims instead of loading the user on every request; see fantasy/authentication.py
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'fantasy.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'fantasy.pagination.AsyncLimitOffsetPagination',
     'PAGE_SIZE': 20,
 }
+# FAST_SERIALIZERS=1: the players, transactions and teams lists and teams/me render from .values() rows
+# (fantasy/fast_serializers.py) instead of model instances through DRF serializers; same JSON
+FAST_SERIALIZERS = os.getenv("FAST_SERIALIZERS", "0") == "1"
+# rows per fetch from the server-side cursor, and per chunk sent, for the /export/ endpoints (fantasy/exports.py)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+
+# Cache framework: per-process locmem by default; set REDIS_URL (needs the `redis` package)
+# to share the market cache and its hit/miss counters between workers.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+if os.getenv("REDIS_URL"):
+    CACHES["default"] = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.getenv("REDIS_URL")}
+MARKET_CACHE_TTL = int(os.getenv("MARKET_CACHE_TTL", "300"))
+
+# Per-request query instrumentation (fantasy.middleware). Views declare `query_budgets`;
+# the test suite turns enforcement on so going over budget fails instead of only logging.
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "0") == "1"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "fantasy.db": {"handlers": ["console"], "level": os.getenv("QUERY_LOG_LEVEL", "INFO"), "propagate": False},
+        "fantasy.matching": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "fantasy.outbox": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
 
 # Simple JWT settings (basic)
 from datetime import timedelta
@@ -143,8 +209,26 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # adds the team id and auth version claims ClaimsJWTAuthentication relies on
+    "TOKEN_OBTAIN_SERIALIZER": "fantasy.authentication.ClaimsTokenObtainPairSerializer",
+}
+
+# seconds a worker may keep accepting a revoked token's auth version (password change, deactivation)
+AUTH_VERSION_TTL = int(os.getenv("AUTH_VERSION_TTL", "30"))
+
+# what `manage.py run_outbox` does with each outbox topic (fantasy/outbox.py): dotted paths of callables
+# taking the OutboxMessage, run in order; delivery is at least once, so each must be idempotent
+OUTBOX_HANDLERS = {
+    "transfer.settled": ["fantasy.outbox.log_transfer"],
 }
 
+# seconds a stored Idempotency-Key response is replayed to retries (fantasy/idempotency.py)
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 3600)))
+
+# days a settled transaction stays in the hot table before `manage.py archive_transactions` moves it to the
+# archive (fantasy/archive.py); /transactions/ reads both
+TRANSACTION_ARCHIVE_DAYS = int(os.getenv("TRANSACTION_ARCHIVE_DAYS", "90"))
+
 # import os
 #
 # DATABASES = {
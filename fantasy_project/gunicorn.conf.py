@@ -1,11 +1,37 @@
 import multiprocessing
+import os
+
+# Two profiles, picked with GUNICORN_PROFILE:
+#   gthread (default): the WSGI app, cpu*2+1 processes of 4 threads; one thread per request in flight.
+#   asgi: fantasy_project.asgi under uvicorn workers, one event loop per core. The market, transactions,
+#         players list and teams/me run as async views (fantasy/async_views.py); everything else runs
+#         as before, in a thread per request.
+# Start either with `gunicorn -c gunicorn.conf.py` (no app argument: wsgi_app below picks it).
+# GUNICORN_WORKERS overrides the process count, e.g. to compare the two at the same size.
+profile = os.getenv("GUNICORN_PROFILE", "gthread")
 
 bind = "0.0.0.0:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "gthread"
-threads = 4
+if profile == "asgi":
+    wsgi_app = "fantasy_project.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+elif profile == "gthread":
+    wsgi_app = "fantasy_project.wsgi:application"
+    worker_class = "gthread"
+    workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+    threads = 4
+else:
+    raise ValueError(f"unknown GUNICORN_PROFILE {profile!r}: use gthread or asgi")
+
+# With DB_POOL=1 each worker process holds its own pool (see settings.py). A gthread worker never has more
+# than `threads` requests in flight; an ASGI worker has as many as its connections, so its pool caps how
+# many of them reach Postgres at once and the rest queue for DB_POOL_TIMEOUT seconds. Keep
+# workers * DB_POOL_MAX_SIZE below Postgres' max_connections.
+# settings.py is imported after this file runs (preload_app), so the defaults reach it through the environment.
+os.environ.setdefault("DB_POOL_MAX_SIZE", str(threads if profile == "gthread" else 10))
+os.environ.setdefault("DB_POOL_MIN_SIZE", "2")
 timeout = 120
 preload_app = True
 loglevel = "info"
 accesslog = "-"
-errorlog = "-"
\ No newline at end of file
+errorlog = "-"